@@ -0,0 +1,96 @@
+import json
+import logging
+import os
+import wave
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class FillerBank:
+    """
+    Audio of all the fillers as a single contiguous int16 PCM blob, decoded once from the WAV files of the
+    descriptions and memory-mapped, so that starting a filler on a turn is a slice of the blob, without disk I/O.
+    The blob (bank_path) and its index (bank_path with .json) are rebuilt when a WAV file or the list of fillers
+    changed. Fillers are indexed by the "id" of their description, or by their position if they have none.
+    """
+
+    def __init__(self, descriptions, audio_data_dir, bank_path, sample_rate=16000):
+        self.sample_rate = sample_rate
+        self.bank_path = bank_path
+        self.index_path = os.path.splitext(bank_path)[0] + ".json"
+        sources = self.list_sources(descriptions, audio_data_dir)
+        index = self.load_index(sources)
+        if index is None:
+            index = self.build(sources)
+        self.offsets = {entry["id"]: (entry["offset"], entry["samples"]) for entry in index["fillers"]}
+        self.audio = np.memmap(self.bank_path, dtype="<i2", mode="r") if index["total_samples"] else np.zeros(0, np.int16)
+
+    @staticmethod
+    def list_sources(descriptions, audio_data_dir):
+        sources = []
+        for position, item in enumerate(descriptions):
+            filename = item.get("filename")
+            if not filename:
+                logger.warning(f"No 'filename' in item: {item}")
+                continue
+            path = os.path.join(audio_data_dir, filename)
+            if not os.path.isfile(path):
+                raise FileNotFoundError(f"Missing audio file: {path}")
+            stat = os.stat(path)
+            sources.append({"id": item.get("id", position), "path": path, "size": stat.st_size, "mtime": stat.st_mtime})
+        return sources
+
+    def load_index(self, sources):
+        """Returns the index of the existing blob if it was built from the same files, else None."""
+        if not (os.path.isfile(self.bank_path) and os.path.isfile(self.index_path)):
+            return None
+        with open(self.index_path, encoding="utf-8") as file:
+            index = json.load(file)
+        built_from = [{key: entry[key] for key in ("id", "path", "size", "mtime")} for entry in index["fillers"]]
+        if built_from != sources or index["sample_rate"] != self.sample_rate:
+            return None
+        if os.path.getsize(self.bank_path) != 2 * index["total_samples"]:
+            return None
+        return index
+
+    def build(self, sources):
+        logger.info(f"Building the filler bank {self.bank_path} from {len(sources)} files")
+        fillers = []
+        offset = 0
+        temporary_path = self.bank_path + ".tmp"
+        with open(temporary_path, "wb") as bank:
+            for source in sources:
+                samples = self.decode(source["path"])
+                bank.write(samples.tobytes())
+                fillers.append({**source, "offset": offset, "samples": len(samples)})
+                offset += len(samples)
+        os.replace(temporary_path, self.bank_path)
+        index = {"sample_rate": self.sample_rate, "total_samples": offset, "fillers": fillers}
+        with open(self.index_path, "w", encoding="utf-8") as file:
+            json.dump(index, file, ensure_ascii=False, indent=2)
+        return index
+
+    def decode(self, path):
+        with wave.open(path, "rb") as wav:
+            if wav.getsampwidth() != 2 or wav.getnchannels() != 1 or wav.getframerate() != self.sample_rate:
+                raise ValueError(
+                    f"{path}: fillers must be 16 bit mono WAV files at {self.sample_rate} Hz, got "
+                    f"{8 * wav.getsampwidth()} bit, {wav.getnchannels()} channels at {wav.getframerate()} Hz"
+                )
+            return np.frombuffer(wav.readframes(wav.getnframes()), dtype="<i2")
+
+    def __contains__(self, filler_id):
+        return filler_id in self.offsets
+
+    def get(self, filler_id):
+        """Audio of the filler, a view of the mapped blob."""
+        offset, samples = self.offsets[filler_id]
+        return self.audio[offset : offset + samples]
+
+    def blocks(self, filler_id, blocksize):
+        """Yields the audio of the filler in slices of blocksize samples, the last one may be shorter."""
+        audio = self.get(filler_id)
+        for start in range(0, len(audio), blocksize):
+            yield audio[start : start + blocksize]
@@ -2,9 +2,11 @@ from utils.process_iterator import ProcessIterator
 from time import perf_counter
 import logging
 import json
-import os
 import random
 from utils.data import ImmutableDataChain
+from utils import metrics, tracing
+from FILLER_GEN.filler_bank import FillerBank
+from FILLER_GEN.filler_selector import FillerSelector, NgramEmbedder, TransformersEmbedder
 
 logger = logging.getLogger(__name__)
 
@@ -34,13 +36,29 @@ class FillerHandler:
             audio_description_json_path="data/filler_data/description.json",
             activated=True,
             device="cuda",
+            bank_path="data/filler_data/filler_bank.pcm",
+            blocksize=512,
+            sample_rate=16000,
+            selection="embedding",
+            embedding_model="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
+            min_score=0.2,
+            score_margin=0.05,
             gen_kwargs = {},
     ):
         self.audio_data_dir = audio_data_dir
         self.audio_description_json_path = audio_description_json_path
         self.activated = activated
         self.device = device
+        self.bank_path = bank_path
+        self.blocksize = blocksize
+        self.sample_rate = sample_rate
+        self.selection = selection
+        self.embedding_model = embedding_model
+        self.min_score = min_score
+        self.score_margin = score_margin
         self.audio_descriptions = []  # Will hold the loaded JSON data
+        self.bank = None
+        self.selector = None
         self.warmup()
 
     def warmup(self):
@@ -56,19 +74,32 @@ class FillerHandler:
             self.stop_event.set()
             return
 
-        # Verify that all audio files listed in the JSON are present
-        for item in self.audio_descriptions:
-            audio_filename = item.get('filename', None)
-            if not audio_filename:
-                logger.warning(f"No 'filename' in item: {item}")
-                continue
-            audio_path = os.path.join(self.audio_data_dir, audio_filename)
-            if not os.path.isfile(audio_path):
-                logger.error(f"Missing audio file: {audio_path}")
-                self.stop_event.set()
-                return
+        # Decode all the audio files listed in the JSON once, the turns only slice the mapped blob
+        try:
+            self.bank = FillerBank(self.audio_descriptions, self.audio_data_dir, self.bank_path, self.sample_rate)
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading the filler bank: {e}")
+            self.stop_event.set()
+            return
+
+        if self.selection == "embedding":
+            if not self.embedding_model:
+                raise ValueError("The 'embedding' filler selection needs an embedding_model")
+            embedder = TransformersEmbedder(self.embedding_model, self.device)
+        elif self.selection == "ngram":
+            # matches the spelling of the words, not their meaning
+            embedder = NgramEmbedder()
+        elif self.selection == "random":
+            return
+        else:
+            raise ValueError(f"Unknown filler selection '{self.selection}', should be 'embedding', 'ngram' or 'random'")
+        self.selector = FillerSelector(self.audio_descriptions, embedder, self.min_score, self.score_margin)
 
     def process(self, data: ImmutableDataChain):
+        if data.get("is_partial"):
+            # partial transcriptions of an utterance still being spoken are not answered
+            logger.debug(f"Partial transcription: {data.get('partial_text')}")
+            return
         if not self.activated:
             # If the handler is deactivated, pass the data unchanged
             self.queue_out_mess.put(data)
@@ -80,8 +111,14 @@ class FillerHandler:
                 self.stop_event.set()
                 return
 
-            # Select a random audio file description
-            random_item = random.choice(self.audio_descriptions)
+            # Select the audio file description fitting the transcription best, or a random one
+            if self.selector is not None:
+                start_time = perf_counter()
+                position = self.selector.select(data.get("text"))
+                logger.debug(f"Filler selected in {(perf_counter() - start_time) * 1000:.3f} ms")
+            else:
+                position = random.randrange(len(self.audio_descriptions))
+            random_item = self.audio_descriptions[position]
             text_content = random_item.get('text', '')
             if text_content:
                 self.queue_out_mess.put(data.add_data(text_content, "start_phrase"))
@@ -89,32 +126,19 @@ class FillerHandler:
             else:
                 logger.warning(f"No 'text' field in random item: {random_item}")
 
-            # Read the audio file and put it into queue_out_audio
-            audio_filename = random_item.get('filename', None)
-            if audio_filename:
-                audio_path = os.path.join(self.audio_data_dir, audio_filename)
-                if os.path.isfile(audio_path):
-                    try:
-                        with open(audio_path, 'rb') as f:
-                            audio_data = f.read()
-
-                        # to return iterator
-                        iterator = ProcessIterator()
-                        iterator.put(audio_data)
-                        iterator.close()
-                        logger.debug(f"Added audio data from file: {audio_filename}")
-                        self.queue_out_audio.put(data.add_data(iterator, "output_audio_iterator"))
-
-                    except Exception as e:
-                        logger.error(f"Error reading audio file {audio_filename}: {e}")
-                        self.stop_event.set()
-                        return
-                else:
-                    logger.error(f"Audio file not found: {audio_path}")
-                    self.stop_event.set()
-                    return
+            # Stream the audio of the filler from the bank into queue_out_audio
+            filler_id = random_item.get('id', position)
+            if filler_id in self.bank:
+                # to return iterator
+                iterator = ProcessIterator()
+                for block in self.bank.blocks(filler_id, self.blocksize):
+                    iterator.put(block)
+                iterator.close()
+                logger.debug(f"Added audio data of filler {filler_id}")
+                tracing.mark(data, "filler_emitted")
+                self.queue_out_audio.put(data.add_data(iterator, "output_audio_iterator"))
             else:
-                logger.warning(f"No 'filename' in random item: {random_item}")
+                logger.warning(f"No audio in the filler bank for item: {random_item}")
                 self.stop_event.set()
                 return
 
@@ -125,9 +149,11 @@ class FillerHandler:
                 # Sentinel signal to avoid queue deadlock
                 logger.debug("Stopping thread")
                 break
+            metrics.handler_inputs.inc(handler=self.__class__.__name__)
             start_time = perf_counter()
             self.process(input_data_chain)
             self._times.append(perf_counter() - start_time)
+            metrics.handler_process_seconds.observe(self.last_time, handler=self.__class__.__name__)
             if self.last_time > self.min_time_to_debug:
                 logger.debug(f"{self.__class__.__name__}: {self.last_time:.3f} s")
             start_time = perf_counter()
@@ -0,0 +1,104 @@
+import logging
+import random
+import re
+from zlib import crc32
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+WORD = re.compile(r"\w+")
+
+
+class NgramEmbedder:
+    """
+    Bag of the character n-grams of the words (with boundary markers), hashed into `dim` buckets and L2 normalized.
+    It measures how close the spelling of two texts is, not their meaning: close word forms share most of their
+    n-grams, so an utterance matches the fillers whose contexts use the same words, and a sentence is embedded in
+    tens of microseconds. Used by the 'ngram' filler selection.
+    """
+
+    def __init__(self, dim=2048, ngram_sizes=(2, 3, 4)):
+        self.dim = dim
+        self.ngram_sizes = ngram_sizes
+
+    def embed(self, texts):
+        embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            buckets = []
+            for word in WORD.findall(text.lower()):
+                token = f"<{word}>"
+                for n in self.ngram_sizes:
+                    buckets.extend(crc32(token[i : i + n].encode()) % self.dim for i in range(len(token) - n + 1))
+            if buckets:
+                embeddings[row] = np.bincount(buckets, minlength=self.dim)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.maximum(norms, 1e-12)
+
+
+class TransformersEmbedder:
+    """
+    Mean pooled hidden states of a transformers encoder, e.g. a sentence-transformers checkpoint, L2 normalized.
+    Texts of the same meaning are close whatever their words. Used by the 'embedding' filler selection.
+    """
+
+    def __init__(self, model_name, device="cpu"):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        self.torch = torch
+        self.device = device
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name).to(device).eval()
+
+    def embed(self, texts):
+        with self.torch.no_grad():
+            tokens = self.tokenizer(texts, padding=True, truncation=True, return_tensors="pt").to(self.device)
+            hidden = self.model(**tokens).last_hidden_state
+            mask = tokens["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+            pooled = self.torch.nn.functional.normalize(pooled, dim=-1)
+        return pooled.float().cpu().numpy()
+
+
+class FillerSelector:
+    """
+    Nearest neighbour index of the fillers of description.json, built once at startup.
+    Every filler is embedded from its "text" and the optional "contexts" of its description (examples of user
+    utterances it answers well), and scores the cosine similarity of its closest row to the transcription.
+    The filler is drawn among those within `margin` of the best score, so that similar fillers alternate, or among
+    all of them when no filler reaches `min_score`, as the random choice did.
+    """
+
+    def __init__(self, descriptions, embedder, min_score=0.2, margin=0.05):
+        self.embedder = embedder
+        self.min_score = min_score
+        self.margin = margin
+        self.count = len(descriptions)
+        texts = []
+        owners = []
+        for position, item in enumerate(descriptions):
+            for text in [item.get("text", "")] + list(item.get("contexts", [])):
+                if text:
+                    texts.append(text)
+                    owners.append(position)
+        self.owners = np.array(owners, dtype=np.intp)
+        self.embeddings = embedder.embed(texts) if texts else np.zeros((0, 1), dtype=np.float32)
+        logger.debug(f"Filler index: {len(texts)} texts of {self.count} fillers")
+
+    def scores(self, text):
+        """Score of every filler for the text, -inf for fillers without text."""
+        scores = np.full(self.count, -np.inf, dtype=np.float32)
+        if len(self.owners):
+            np.maximum.at(scores, self.owners, self.embeddings @ self.embedder.embed([text])[0])
+        return scores
+
+    def select(self, text):
+        """Position of the filler in the descriptions."""
+        if not text:
+            return random.randrange(self.count)
+        scores = self.scores(text)
+        best = scores.max()
+        if best < self.min_score:
+            return random.randrange(self.count)
+        return int(random.choice(np.flatnonzero(scores >= best - self.margin)))
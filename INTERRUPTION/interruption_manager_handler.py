@@ -2,14 +2,37 @@ import logging
 from queue import Queue, Empty
 from typing import List
 from utils.data import FilteredQueue
+from utils import cancellation, metrics
 
 logger = logging.getLogger(__name__)
 
 class InterruptionManagerHandler:
+    """
+    Applies interruption requests to the filtered queues of the pipeline.
+    A request is a (session_id, user_phrase_id) tuple: items of that session older than the phrase are dropped,
+    items of other sessions are kept. The work already running on the older utterances is cancelled through
+    their CancellationToken.
+    """
     def __init__(self, stop_event, interruption_request_queue : Queue, filtered_queues : List[FilteredQueue]):
         self.stop_event = stop_event
         self.interruption_request_queue = interruption_request_queue
-        self.filtered_queues = filtered_queues
+        self.filtered_queues = list(filtered_queues)
+
+    def add_filtered_queue(self, filtered_queue: FilteredQueue):
+        """
+        Registers a queue created after startup, e.g. the outgoing queue of a session.
+        Any object with the filter() and forget_session() methods of FilteredQueue can be registered, e.g. a handler
+        cancelling its running requests.
+        """
+        self.filtered_queues = self.filtered_queues + [filtered_queue]
+
+    def remove_filtered_queue(self, filtered_queue: FilteredQueue):
+        self.filtered_queues = [queue for queue in self.filtered_queues if queue is not filtered_queue]
+
+    def forget_session(self, session_id):
+        cancellation.forget_session(session_id)
+        for filtered_queue in self.filtered_queues:
+            filtered_queue.forget_session(session_id)
 
     def run(self):
         logger.debug("Interruption Manager started.")
@@ -18,8 +41,11 @@ class InterruptionManagerHandler:
                 interruption_request = self.interruption_request_queue.get(timeout=0.05)
                 if interruption_request is not None:
                     logger.debug(f"Processing interruption request: {interruption_request}")
+                    session_id, phrase_id = interruption_request
+                    metrics.interruptions.inc()
+                    cancellation.cancel_before(phrase_id, session_id)
                     for filtered_queue in self.filtered_queues:
-                        filtered_queue.filter(interruption_request)
+                        filtered_queue.filter(phrase_id, session_id)
 
             except Empty:
                 continue
@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import threading
+import time
+from time import perf_counter
+
+import httpx
+from openai import AsyncOpenAI
+
+from LLM.openai_api_language_model import OpenApiModelHandler, WARMUP_MESSAGES
+from LLM.sentence_segmenter import SentenceSegmenter
+from utils.data import ImmutableDataChain
+from utils.session import get_session_id
+from utils import cancellation, metrics, tracing
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncOpenApiModelHandler(OpenApiModelHandler):
+    """
+    Asyncio variant of OpenApiModelHandler.
+    Every request is a task of a single event loop thread streaming through one httpx.AsyncClient, so the number of
+    concurrent completions is bounded by the connection pool (max_connections) instead of the handler threads.
+    Requests of a session run one after the other to keep the order of its answers, sessions run concurrently.
+    The handler is registered in the InterruptionManagerHandler next to the FilteredQueues: filter() cancels the
+    running requests of the interrupted phrases, which closes their upstream stream at once.
+    The outputs are put in queue_out from the executor of the handler, so a bounded queue_out with the block policy
+    only holds up the requests waiting for it and never the event loop.
+    """
+
+    def setup(self, **kwargs):
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self.loop.run_forever, name="llm-event-loop", daemon=True)
+        self.loop_thread.start()
+        # Only touched from the event loop thread, no lock needed
+        self.requests = {}  # task -> (session_id, user_phrase_id)
+        self.session_tails = {}  # session_id -> last task of the session
+        self.user_phrase_ids = {}  # session_id -> first user_phrase_id not interrupted
+        super().setup(**kwargs)
+
+    def create_client(self, api_key, base_url, proxy_url):
+        self.http_client = httpx.AsyncClient(**self.http_client_kwargs(proxy_url))
+        return AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=self.http_client)
+
+    def warmup(self):
+        logger.info(f"Warming up {self.__class__.__name__}")
+        start = time.time()
+        completion = self.client.chat.completions.create(model=self.model_name, messages=WARMUP_MESSAGES)
+        asyncio.run_coroutine_threadsafe(completion, self.loop).result()
+        end = time.time()
+        logger.info(
+            f"{self.__class__.__name__}: warmed up! time: {(end - start):.3f} s"
+        )
+
+    def run(self):
+        while not self.stop_event.is_set():
+            input_data = self.queue_in.get()
+
+            if isinstance(input_data, bytes) and input_data == b"END":
+                logger.debug("Stopping thread")
+                break
+
+            metrics.handler_inputs.inc(handler=self.__class__.__name__)
+            self.loop.call_soon_threadsafe(self.start_request, input_data)
+
+        asyncio.run_coroutine_threadsafe(self.finish_requests(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join()
+        self.executor.shutdown(wait=True)
+        metrics.handler_threads.dec(self.threads, handler=self.__class__.__name__)
+        self.cleanup()
+        self.queue_out.put(b"END")
+
+    def filter(self, phrase_id: int, session_id=None):
+        """Same interface as FilteredQueue.filter: cancels the requests of the session older than the phrase."""
+        self.loop.call_soon_threadsafe(self.cancel_requests, phrase_id, session_id)
+
+    def forget_session(self, session_id):
+        """The session is closed, nobody is left to listen to its answers."""
+        self.loop.call_soon_threadsafe(self.cancel_requests, None, session_id)
+
+    def is_obsolete(self, session_id, phrase_id):
+        return phrase_id is not None and phrase_id < self.user_phrase_ids.get(session_id, 0)
+
+    def start_request(self, data: ImmutableDataChain):
+        session_id = get_session_id(data)
+        phrase_id = data.get_index("user_audio")
+        if self.is_obsolete(session_id, phrase_id):
+            return
+        task = self.loop.create_task(self.process_and_write(data, self.session_tails.get(session_id)))
+        self.requests[task] = (session_id, phrase_id)
+        self.session_tails[session_id] = task
+        task.add_done_callback(self.request_done)
+
+    def request_done(self, task):
+        session_id, _ = self.requests.pop(task)
+        if self.session_tails.get(session_id) is task:
+            del self.session_tails[session_id]
+
+    def cancel_requests(self, phrase_id, session_id):
+        """phrase_id None cancels all the requests of the session and forgets its interruption scope."""
+        if phrase_id is None:
+            self.user_phrase_ids.pop(session_id, None)
+        else:
+            self.user_phrase_ids[session_id] = phrase_id
+        for task, (task_session_id, task_phrase_id) in list(self.requests.items()):
+            if task_session_id == session_id and (phrase_id is None or self.is_obsolete(session_id, task_phrase_id)):
+                if task.cancel():
+                    metrics.requests_cancelled.inc(handler=self.__class__.__name__)
+
+    async def finish_requests(self):
+        if self.requests:
+            await asyncio.wait(list(self.requests))
+        await self.client.close()
+
+    async def process_and_write(self, data: ImmutableDataChain, previous_request):
+        if previous_request is not None:
+            await asyncio.wait([previous_request])
+
+        handler = self.__class__.__name__
+        start_time = perf_counter()
+        first_chunk = True
+        metrics.requests_in_flight.inc(handler=handler)
+        try:
+            async for chunk in self.process_async(data):
+                if first_chunk:
+                    metrics.handler_first_chunk_seconds.observe(perf_counter() - start_time, handler=handler)
+                    first_chunk = False
+                metrics.handler_outputs.inc(handler=handler)
+                await self.put_output(chunk)
+            metrics.handler_process_seconds.observe(perf_counter() - start_time, handler=handler)
+        except asyncio.CancelledError:
+            logger.debug(f"{handler}: request cancelled after {perf_counter() - start_time:.3f} s")
+            raise
+        except Exception as e:
+            logger.error(f"Error in {handler}: {e}")
+            self.stop_event.set()
+            await self.put_output(b"END")
+        finally:
+            metrics.requests_in_flight.dec(handler=handler)
+
+    async def put_output(self, item):
+        # queue_out.put may block on a full queue, which must not stop the event loop
+        await self.loop.run_in_executor(self.executor, self.queue_out.put, item)
+
+    async def process_async(self, data: ImmutableDataChain):
+        logger.debug("call async api language model...")
+        chat, turn, speculation = self.prepare_turn(data)
+
+        response = await self.client.chat.completions.create(
+            model=self.model_name,
+            messages=chat.to_list() + turn,
+            stream=self.stream
+        )
+
+        if self.stream:
+            generated_text = ""
+            first_chunk = True
+            first_sentence = True
+            segmenter = SentenceSegmenter(self.clause_min_words)
+            # leaving the block, cancellation included, closes the upstream stream
+            async with response:
+                async for chunk in response:
+                    if first_chunk:
+                        tracing.mark(data, "llm_first_token")
+                        first_chunk = False
+                    if cancellation.is_cancelled(data):
+                        logger.debug("Utterance cancelled, stopping the completion")
+                        return
+                    new_text = chunk.choices[0].delta.content or ""
+                    generated_text += new_text
+                    for item in self.text_outputs(data, new_text, segmenter):
+                        if first_sentence:
+                            tracing.mark(data, "llm_first_sentence")
+                            first_sentence = False
+                        yield item
+
+            tracing.mark(data, "llm_first_sentence")
+            for item in self.last_outputs(data, segmenter):
+                yield item
+        else:
+            generated_text = response.choices[0].message.content
+            tracing.mark(data, "llm_first_token")
+            tracing.mark(data, "llm_first_sentence")
+            for item in self.whole_text_outputs(data, generated_text):
+                yield item
+        # the speculation may not be decided yet, wait for it outside of the event loop
+        await asyncio.to_thread(self.save_turn, chat, turn + [{"role": "assistant", "content": generated_text}], speculation)
+
+    def cleanup(self):
+        self.loop.close()
@@ -11,7 +11,11 @@ from LLM.chat import Chat
 from baseHandler import BaseHandler
 from rich.console import Console
 import logging
-from nltk import sent_tokenize
+from LLM.sentence_segmenter import SentenceSegmenter
+from utils import cancellation
+from utils.session import get_session
+from utils.stopping_criteria import cancellation_criteria
+from utils.utils import text_and_language
 
 logger = logging.getLogger(__name__)
 
@@ -42,8 +46,10 @@ class LanguageModelHandler(BaseHandler):
         chat_size=1,
         init_chat_role=None,
         init_chat_prompt="You are a helpful AI assistant.",
+        clause_min_words=0,
     ):
         self.device = device
+        self.clause_min_words = clause_min_words
         self.torch_dtype = getattr(torch, torch_dtype)
 
         self.tokenizer = AutoTokenizer.from_pretrained(model_name)
@@ -64,13 +70,15 @@ class LanguageModelHandler(BaseHandler):
             **gen_kwargs,
         }
 
-        self.chat = Chat(chat_size)
+        self.chat_size = chat_size
+        self.init_chat_message = None
         if init_chat_role:
             if not init_chat_prompt:
                 raise ValueError(
                     "An initial promt needs to be specified when setting init_chat_role."
                 )
-            self.chat.init_chat({"role": init_chat_role, "content": init_chat_prompt})
+            self.init_chat_message = {"role": init_chat_role, "content": init_chat_prompt}
+        self.chat = self.new_chat()
         self.user_role = user_role
 
         self.warmup()
@@ -110,18 +118,37 @@ class LanguageModelHandler(BaseHandler):
                 f"{self.__class__.__name__}:  warmed up! time: {start_event.elapsed_time(end_event) * 1e-3:.3f} s"
             )
 
-    def process(self, prompt):
+    def new_chat(self):
+        chat = Chat(self.chat_size)
+        if self.init_chat_message:
+            chat.init_chat(self.init_chat_message)
+        return chat
+
+    def get_chat(self, session):
+        """Every session has its own history, self.chat is used for data outside of any session."""
+        if session is None:
+            return self.chat
+        return session.get_state("chat", self.new_chat)
+
+    def output(self, data, sentence, language_code):
+        """The chain of the utterance with the sentence, or a (sentence, language_code) tuple for plain inputs."""
+        if hasattr(data, "get_data"):
+            return data.add_data(sentence, "llm_sentence")
+        return (sentence, language_code)
+
+    def process(self, data):
         logger.debug("infering language model...")
-        language_code = None
-        if isinstance(prompt, tuple):
-            prompt, language_code = prompt
-            if language_code[-5:] == "-auto":
-                language_code = language_code[:-5]
-                prompt = f"Please reply to my message in {WHISPER_LANGUAGE_TO_LLM_LANGUAGE[language_code]}. " + prompt
-
-        self.chat.append({"role": self.user_role, "content": prompt})
+        prompt, language_code = text_and_language(data)
+        if language_code is not None and language_code[-5:] == "-auto":
+            language_code = language_code[:-5]
+            prompt = f"Please reply to my message in {WHISPER_LANGUAGE_TO_LLM_LANGUAGE[language_code]}. " + prompt
+
+        chat = self.get_chat(get_session(data))
+        chat.append({"role": self.user_role, "content": prompt})
         thread = Thread(
-            target=self.pipe, args=(self.chat.to_list(),), kwargs=self.gen_kwargs
+            target=self.pipe,
+            args=(chat.to_list(),),
+            kwargs={"stopping_criteria": cancellation_criteria(data), **self.gen_kwargs},
         )
         thread.start()
         if self.device == "mps":
@@ -131,16 +158,22 @@ class LanguageModelHandler(BaseHandler):
             printable_text = generated_text
             torch.mps.empty_cache()
         else:
-            generated_text, printable_text = "", ""
+            generated_text = ""
+            segmenter = SentenceSegmenter(self.clause_min_words)
             for new_text in self.streamer:
+                if cancellation.is_cancelled(data):
+                    logger.debug("Utterance cancelled, stopping the generation")
+                    # the stopping criteria ends the generation at the next token, the streamer is shared by the calls
+                    for _ in self.streamer:
+                        pass
+                    break
                 generated_text += new_text
-                printable_text += new_text
-                sentences = sent_tokenize(printable_text)
-                if len(sentences) > 1:
-                    yield (sentences[0], language_code)
-                    printable_text = new_text
+                for sentence in segmenter.feed(new_text):
+                    yield self.output(data, sentence, language_code)
+            printable_text = segmenter.flush()
 
-        self.chat.append({"role": "assistant", "content": generated_text})
+        chat.append({"role": "assistant", "content": generated_text})
 
         # don't forget last sentence
-        yield (printable_text, language_code)
+        if not cancellation.is_cancelled(data):
+            yield self.output(data, printable_text, language_code)
@@ -4,6 +4,8 @@ from baseHandler import BaseHandler
 from mlx_lm import load, stream_generate, generate
 from rich.console import Console
 import torch
+from utils.session import get_session
+from utils.utils import text_and_language
 
 logger = logging.getLogger(__name__)
 
@@ -38,13 +40,15 @@ class MLXLanguageModelHandler(BaseHandler):
         self.model, self.tokenizer = load(self.model_name)
         self.gen_kwargs = gen_kwargs
 
-        self.chat = Chat(chat_size)
+        self.chat_size = chat_size
+        self.init_chat_message = None
         if init_chat_role:
             if not init_chat_prompt:
                 raise ValueError(
                     "An initial promt needs to be specified when setting init_chat_role."
                 )
-            self.chat.init_chat({"role": init_chat_role, "content": init_chat_prompt})
+            self.init_chat_message = {"role": init_chat_role, "content": init_chat_prompt}
+        self.chat = self.new_chat()
         self.user_role = user_role
 
         self.warmup()
@@ -67,25 +71,41 @@ class MLXLanguageModelHandler(BaseHandler):
                 verbose=False,
             )
 
-    def process(self, prompt):
+    def new_chat(self):
+        chat = Chat(self.chat_size)
+        if self.init_chat_message:
+            chat.init_chat(self.init_chat_message)
+        return chat
+
+    def get_chat(self, session):
+        """Every session has its own history, self.chat is used for data outside of any session."""
+        if session is None:
+            return self.chat
+        return session.get_state("chat", self.new_chat)
+
+    def output(self, data, sentence, language_code):
+        """The chain of the utterance with the sentence, or a (sentence, language_code) tuple for plain inputs."""
+        if hasattr(data, "get_data"):
+            return data.add_data(sentence, "llm_sentence")
+        return (sentence, language_code)
+
+    def process(self, data):
         logger.debug("infering language model...")
-        language_code = None
+        prompt, language_code = text_and_language(data)
+        if language_code is not None and language_code[-5:] == "-auto":
+            language_code = language_code[:-5]
+            prompt = f"Please reply to my message in {WHISPER_LANGUAGE_TO_LLM_LANGUAGE[language_code]}. " + prompt
 
-        if isinstance(prompt, tuple):
-            prompt, language_code = prompt
-            if language_code[-5:] == "-auto":
-                language_code = language_code[:-5]
-                prompt = f"Please reply to my message in {WHISPER_LANGUAGE_TO_LLM_LANGUAGE[language_code]}. " + prompt
-
-        self.chat.append({"role": self.user_role, "content": prompt})
+        chat = self.get_chat(get_session(data))
+        chat.append({"role": self.user_role, "content": prompt})
 
         # Remove system messages if using a Gemma model
         if "gemma" in self.model_name.lower():
             chat_messages = [
-                msg for msg in self.chat.to_list() if msg["role"] != "system"
+                msg for msg in chat.to_list() if msg["role"] != "system"
             ]
         else:
-            chat_messages = self.chat.to_list()
+            chat_messages = chat.to_list()
 
         prompt = self.tokenizer.apply_chat_template(
             chat_messages, tokenize=False, add_generation_prompt=True
@@ -101,9 +121,9 @@ class MLXLanguageModelHandler(BaseHandler):
             output += t
             curr_output += t
             if curr_output.endswith((".", "?", "!", "<|end|>")):
-                yield (curr_output.replace("<|end|>", ""), language_code)
+                yield self.output(data, curr_output.replace("<|end|>", ""), language_code)
                 curr_output = ""
         generated_text = output.replace("<|end|>", "")
         torch.mps.empty_cache()
 
-        self.chat.append({"role": "assistant", "content": generated_text})
\ No newline at end of file
+        chat.append({"role": "assistant", "content": generated_text})
\ No newline at end of file
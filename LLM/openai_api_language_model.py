@@ -2,18 +2,24 @@ import logging
 import time
 import httpx
 
-from nltk import sent_tokenize
 from rich.console import Console
 from openai import OpenAI
 
 from baseHandler import BaseHandler
 from LLM.chat import Chat
+from LLM.sentence_segmenter import SentenceSegmenter
 import os
 from utils.data import ImmutableDataChain
+from utils import cancellation, tracing
 logger = logging.getLogger(__name__)
 
 console = Console()
 
+WARMUP_MESSAGES = [
+    {"role": "system", "content": "You are a helpful assistant"},
+    {"role": "user", "content": "Hello"},
+]
+
 class OpenApiModelHandler(BaseHandler):
     """
     Handles the language model part.
@@ -30,19 +36,35 @@ class OpenApiModelHandler(BaseHandler):
         chat_size=1,
         init_chat_role="system",
         init_chat_prompt="You are a helpful AI assistant.",
-        proxy_url=None
+        proxy_url=None,
+        clause_min_words=0,
+        max_connections=16,
+        http2=False,
+        fragments=False,
     ):
         self.model_name = model_name
         self.stream = stream
-        self.chat = Chat(chat_size)
+        self.clause_min_words = clause_min_words
+        self.max_connections = max_connections
+        self.http2 = http2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("HTTP/2 needs the h2 package (pip install httpx[http2]), using HTTP/1.1")
+                self.http2 = False
+        self.fragments = fragments  # set for TTS handlers taking the text as it is generated
+        self.chat_size = chat_size
+        self.init_chat_message = None
 
         if init_chat_role:
             if not init_chat_prompt:
                 raise ValueError(
                     "An initial prompt needs to be specified when setting init_chat_role."
                 )
-            self.chat.init_chat({"role": init_chat_role, "content": init_chat_prompt})
+            self.init_chat_message = {"role": init_chat_role, "content": init_chat_prompt}
             logger.debug(f"Prompt: {init_chat_prompt}")
+        self.chat = self.new_chat()
 
         self.user_role = user_role
 
@@ -54,26 +76,33 @@ class OpenApiModelHandler(BaseHandler):
         if proxy_url is None:
             proxy_url = os.getenv("PROXY_URL")
 
-        # Создаем один экземпляр httpx.Client и переиспользуем его
-        limits = httpx.Limits(keepalive_expiry = 60*60)
+        self.client = self.create_client(api_key, base_url, proxy_url)
+        self.warmup()
+
+    def http_client_kwargs(self, proxy_url):
+        # Создаем один пул соединений на все запросы и переиспользуем его
+        limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_connections,
+            keepalive_expiry=60*60,
+        )
+        kwargs = dict(limits=limits, http2=self.http2, timeout=60*60)
         if proxy_url is not None:
-            self.http_client = httpx.Client(proxies=proxy_url, limits = limits, timeout=60*60)
-        else:
-            raise ConnectionError("No proxy")
-            self.http_client = httpx.Client(limits = limits, timeout=60*60)
+            kwargs["proxy"] = proxy_url
+        return kwargs
 
-        self.client = OpenAI(api_key=api_key, base_url=base_url, http_client=self.http_client)
-        self.warmup()
+    def create_client(self, api_key, base_url, proxy_url):
+        if proxy_url is None:
+            raise ConnectionError("No proxy")
+        self.http_client = httpx.Client(**self.http_client_kwargs(proxy_url))
+        return OpenAI(api_key=api_key, base_url=base_url, http_client=self.http_client)
 
     def warmup(self):
         logger.info(f"Warming up {self.__class__.__name__}")
         start = time.time()
         response = self.client.chat.completions.create(
             model=self.model_name,
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant"},
-                {"role": "user", "content": "Hello"},
-            ],
+            messages=WARMUP_MESSAGES,
             stream=self.stream
         )
         end = time.time()
@@ -81,9 +110,20 @@ class OpenApiModelHandler(BaseHandler):
             f"{self.__class__.__name__}: warmed up! time: {(end - start):.3f} s"
         )
 
-    def process(self, data: ImmutableDataChain):
-        logger.debug("call api language model...")
+    def new_chat(self):
+        chat = Chat(self.chat_size)
+        if self.init_chat_message:
+            chat.init_chat(self.init_chat_message)
+        return chat
+
+    def get_chat(self, session):
+        """Every session has its own history, self.chat is used for data outside of any session."""
+        if session is None:
+            return self.chat
+        return session.get_state("chat", self.new_chat)
 
+    def prepare_turn(self, data: ImmutableDataChain):
+        """Returns the chat of the item, the messages of the new turn and the speculation of the utterance."""
         prompt = data.get("text")
         language_code = data.get("language_code")
         start_phrase = data.get("start_phrase")
@@ -92,42 +132,81 @@ class OpenApiModelHandler(BaseHandler):
         logger.debug(f"language_code is {language_code}")
         logger.debug(f"start_phrase is {start_phrase}")
 
-        self.chat.append({"role": self.user_role, "content": prompt})
+        chat = self.get_chat(data.get("session"))
+        speculation = data.get("speculation")
+        turn = [{"role": self.user_role, "content": prompt}]
 
         # Add the start_phrase to the assistant's role to guide the model
         if start_phrase:
-            self.chat.append({"role": "assistant", "content": start_phrase})
+            turn.append({"role": "assistant", "content": start_phrase})
+        return chat, turn, speculation
+
+    def process(self, data: ImmutableDataChain):
+        logger.debug("call api language model...")
+        chat, turn, speculation = self.prepare_turn(data)
 
         response = self.client.chat.completions.create(
             model=self.model_name,
-            messages=self.chat.to_list(),
+            messages=chat.to_list() + turn,
             stream=self.stream
         )
 
         first_chunk = True
         first_sentence = True
         if self.stream:
-            generated_text, printable_text = "", ""
+            generated_text = ""
+            segmenter = SentenceSegmenter(self.clause_min_words)
             for chunk in response:
                 if first_chunk:
                     logger.debug(f"First chunk received")
+                    tracing.mark(data, "llm_first_token")
                     first_chunk = False
+                if cancellation.is_cancelled(data):
+                    logger.debug("Utterance cancelled, stopping the completion")
+                    response.close()
+                    return
                 new_text = chunk.choices[0].delta.content or ""
                 generated_text += new_text
-                printable_text += new_text
-                sentences = sent_tokenize(printable_text)
-                if len(sentences) > 1:
+                for item in self.text_outputs(data, new_text, segmenter):
                     if first_sentence:
                         logger.debug(f"First sentence received")
+                        tracing.mark(data, "llm_first_sentence")
                         first_sentence = False
-                    yield data.add_data(sentences[0], "llm_sentence")
-                    printable_text = new_text
+                    yield item
 
             logger.debug(f"All chunks received")
-            self.chat.append({"role": "assistant", "content": generated_text})
             # don't forget last sentence
-            yield data.add_data(printable_text, "llm_sentence")
+            tracing.mark(data, "llm_first_sentence")
+            yield from self.last_outputs(data, segmenter)
         else:
             generated_text = response.choices[0].message.content
-            self.chat.append({"role": "assistant", "content": generated_text})
-            yield data.add_data(generated_text, "llm_sentence")
+            tracing.mark(data, "llm_first_token")
+            tracing.mark(data, "llm_first_sentence")
+            yield from self.whole_text_outputs(data, generated_text)
+        self.save_turn(chat, turn + [{"role": "assistant", "content": generated_text}], speculation)
+
+    def text_outputs(self, data, new_text, segmenter):
+        """Items for the new text of the stream: the fragment itself in fragments mode, else the completed sentences."""
+        if self.fragments:
+            return [data.add_data(new_text, "llm_fragment")] if new_text else []
+        return [data.add_data(sentence, "llm_sentence") for sentence in segmenter.feed(new_text)]
+
+    def last_outputs(self, data, segmenter):
+        """Items once the stream is over: the rest of the text, or the end of the turn in fragments mode."""
+        if self.fragments:
+            return [data.add_data("", "llm_fragment").add_data(True, "llm_done")]
+        return [data.add_data(segmenter.flush(), "llm_sentence")]
+
+    def whole_text_outputs(self, data, generated_text):
+        if self.fragments:
+            return [data.add_data(generated_text, "llm_fragment"), data.add_data("", "llm_fragment").add_data(True, "llm_done")]
+        return [data.add_data(generated_text, "llm_sentence")]
+
+    def save_turn(self, chat, messages, speculation):
+        """Appends the messages of a turn to the chat, the turn of a speculative utterance only once it is committed."""
+        if speculation is not None:
+            speculation.wait()
+            if not speculation.committed:
+                return
+        for message in messages:
+            chat.append(message)
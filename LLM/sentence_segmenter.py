@@ -0,0 +1,111 @@
+TERMINATORS = ".!?…"
+CLOSING = "\"')]»”’"
+CLAUSE_SEPARATORS = ",;:"
+
+# Words followed by a dot that rarely end a sentence (lowercase, without the final dot)
+ABBREVIATIONS = {
+    "mr", "mrs", "ms", "dr", "prof", "sr", "jr", "st", "vs", "e.g", "i.e", "inc", "ltd", "no", "fig", "approx",
+    "т.е", "т.к", "т.н", "др", "пр", "г", "гг", "см", "стр", "им", "ул", "д",
+}
+
+
+class SentenceSegmenter:
+    """
+    Streaming sentence splitter for the text generated by the LLM, fed with the new text of every token.
+    Each character is scanned once: a sentence ends with . ! ? or … (and the quotes or brackets closing it), once the
+    whitespace and the first character of the next sentence arrived, unless that character is lowercase or the dot
+    follows an abbreviation, an initial or a list number. A line break always ends a sentence.
+    With clause_min_words > 0, a sentence is also cut after , ; or : followed by whitespace once it has at least
+    clause_min_words words, so that TTS can start on the first clause of a long sentence.
+    """
+
+    def __init__(self, clause_min_words=0, abbreviations=ABBREVIATIONS):
+        self.clause_min_words = clause_min_words
+        self.abbreviations = abbreviations
+        self._buffer = ""
+        self._position = 0  # next character of the buffer to scan
+        self._words = 0  # words of the current sentence
+        self._in_word = False
+        self._sentence_end = None  # end of a possible sentence end, confirmed by the next characters
+        self._clause_end = None
+        self._space_after_end = False
+
+    def feed(self, text):
+        """Adds the new text, returns the sentences it completed."""
+        self._buffer += text
+        sentences = []
+        buffer = self._buffer
+        i = self._position
+        while i < len(buffer):
+            char = buffer[i]
+            cut = None
+            if char.isspace():
+                self._in_word = False
+                if self._sentence_end is not None:
+                    self._space_after_end = True
+                elif self._clause_end is not None:
+                    cut = self._clause_end
+                if char == "\n" and cut is None:
+                    cut = self._sentence_end if self._sentence_end is not None else i
+            elif self._sentence_end is not None and not self._space_after_end:
+                if char in TERMINATORS or char in CLOSING:
+                    self._sentence_end = i + 1
+                else:
+                    self._sentence_end = None  # e.g. 3.14 or e.g
+            elif self._sentence_end is not None:
+                if not char.islower() and self._is_sentence_end(buffer, self._sentence_end):
+                    cut = self._sentence_end
+                self._sentence_end = None
+            else:
+                self._clause_end = None
+                if char in TERMINATORS:
+                    self._sentence_end = i + 1
+                    self._space_after_end = False
+                elif char in CLAUSE_SEPARATORS and self.clause_min_words and self._words >= self.clause_min_words:
+                    self._clause_end = i + 1
+
+            if cut is not None:
+                sentence = buffer[:cut].strip()
+                if sentence:
+                    sentences.append(sentence)
+                buffer = buffer[cut:]
+                i -= cut
+                self._sentence_end = None
+                self._clause_end = None
+                # the character that confirmed the cut may start the first word of the next sentence
+                self._words = 0
+                self._in_word = False
+
+            if not char.isspace() and not self._in_word:
+                self._in_word = True
+                self._words += 1
+            i += 1
+
+        self._buffer = buffer
+        self._position = i
+        return sentences
+
+    def _is_sentence_end(self, buffer, end):
+        # word before the terminators, e.g. "Dr" for "Dr.", "т.е" for "т.е."
+        stop = end
+        while stop > 0 and (buffer[stop - 1] in TERMINATORS or buffer[stop - 1] in CLOSING):
+            stop -= 1
+        start = stop
+        while start > 0 and not buffer[start - 1].isspace():
+            start -= 1
+        word = buffer[start:stop]
+        if buffer[stop] != ".":
+            return True
+        if word.lower() in self.abbreviations:
+            return False
+        if len(word) == 1 and word.isupper():
+            return False  # initial, e.g. "A. S. Pushkin"
+        if word.isdigit() and not buffer[:start].strip():
+            return False  # number of a list item
+        return True
+
+    def flush(self):
+        """Returns the rest of the text, once the generation is over."""
+        rest = self._buffer.strip()
+        self.__init__(self.clause_min_words, self.abbreviations)
+        return rest
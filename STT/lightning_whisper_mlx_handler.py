@@ -1,5 +1,4 @@
 import logging
-from time import perf_counter
 from baseHandler import BaseHandler
 from lightning_whisper_mlx import LightningWhisperMLX
 import numpy as np
@@ -57,9 +56,6 @@ class LightningWhisperSTTHandler(BaseHandler):
     def process(self, spoken_prompt):
         logger.debug("infering whisper...")
 
-        global pipeline_start
-        pipeline_start = perf_counter()
-
         if self.start_language != 'auto':
             transcription_dict = self.model.transcribe(spoken_prompt, language=self.start_language)
         else:
@@ -1,14 +1,15 @@
-from time import perf_counter
 from transformers import (
     AutoProcessor,
     AutoModelForSpeechSeq2Seq
 )
 import torch
+import numpy as np
 from copy import copy
-from baseHandler import BaseHandler
+from batchingHandler import BatchingHandler
 from rich.console import Console
 import logging
 from utils.data import ImmutableDataChain
+from utils import tracing
 
 logger = logging.getLogger(__name__)
 console = Console()
@@ -24,9 +25,15 @@ SUPPORTED_LANGUAGES = [
 ]
 
 
-class WhisperSTTHandler(BaseHandler):
+class WhisperSTTHandler(BatchingHandler):
     """
     Handles the Speech To Text generation using a Whisper model.
+    Utterances arriving within batch_window_ms of each other (e.g. from different sessions) are padded into one
+    input_features batch and transcribed by a single generate call.
+    Partial utterances (see VADIterator.pop_partial) are transcribed while the user is still speaking: the tokens two
+    consecutive partial hypotheses agree on are emitted as "partial_text" and forced as decoder prefix of the final
+    transcription, which then only has to decode the tail. The finals of a batch whose prefixes have the same length
+    share one generate call.
     """
 
     def setup(
@@ -36,8 +43,12 @@ class WhisperSTTHandler(BaseHandler):
         torch_dtype="float16",
         compile_mode=None,
         language=None,
+        max_batch_size=1,
+        batch_window_ms=20,
         gen_kwargs={},
     ):
+        self.max_batch_size = max_batch_size
+        self.batch_window_ms = batch_window_ms
         self.device = device
         self.torch_dtype = getattr(torch, torch_dtype)
         self.compile_mode = compile_mode
@@ -61,10 +72,15 @@ class WhisperSTTHandler(BaseHandler):
             )
         self.warmup()
 
-    def prepare_model_inputs(self, spoken_prompt):
+    def prepare_model_inputs(self, spoken_prompts):
         input_features = self.processor(
-            spoken_prompt, sampling_rate=16000, return_tensors="pt"
+            spoken_prompts, sampling_rate=16000, return_tensors="pt"
         ).input_features
+        if self.compile_mode and len(input_features) < self.max_batch_size:
+            # keep a static batch size, so that the compiled model is not recompiled for every batch size
+            input_features = torch.nn.functional.pad(
+                input_features, (0, 0, 0, 0, 0, self.max_batch_size - len(input_features))
+            )
         input_features = input_features.to(self.device, dtype=self.torch_dtype)
 
         return input_features
@@ -75,7 +91,7 @@ class WhisperSTTHandler(BaseHandler):
         # 2 warmup steps for no compile or compile mode with CUDA graphs capture
         n_steps = 1 if self.compile_mode == "default" else 2
         dummy_input = torch.randn(
-            (1, self.model.config.num_mel_bins, 3000),
+            (self.max_batch_size if self.compile_mode else 1, self.model.config.num_mel_bins, 3000),
             dtype=self.torch_dtype,
             device=self.device,
         )
@@ -110,36 +126,189 @@ class WhisperSTTHandler(BaseHandler):
                 f"{self.__class__.__name__}:  warmed up! time: {start_event.elapsed_time(end_event) * 1e-3:.3f} s"
             )
 
-    def process(self, data : ImmutableDataChain):
-        spoken_prompt = data.get("user_audio")
-        logger.debug("infering whisper...")
-
-        global pipeline_start
-        pipeline_start = perf_counter()
+    def language_code(self, pred_ids):
+        return self.processor.tokenizer.decode(pred_ids[1])[2:-2]  # remove "<|" and "|>"
 
-        input_features = self.prepare_model_inputs(spoken_prompt)
-        pred_ids = self.model.generate(input_features, **self.gen_kwargs)
-        language_code = self.processor.tokenizer.decode(pred_ids[0, 1])[2:-2]  # remove "<|" and "|>"
+    def session_language(self, session):
+        """Last supported language detected for the session, the fallback of its unsupported detections."""
+        if session is None:
+            return self.last_language
+        return session.get_state("whisper_language", lambda: self.last_language)
 
-        if language_code not in SUPPORTED_LANGUAGES:  # reprocess with the last language
-            logger.warning("Whisper detected unsupported language:", language_code)
-            gen_kwargs = copy(self.gen_kwargs)
-            gen_kwargs['language'] = self.last_language
-            language_code = self.last_language
-            pred_ids = self.model.generate(input_features, **gen_kwargs)
-        else:
+    def set_session_language(self, session, language_code):
+        if session is None:
             self.last_language = language_code
-        
-        pred_text = self.processor.batch_decode(
+        else:
+            session.set_state("whisper_language", language_code)
+
+    def transcribe(self, spoken_prompts, decoder_input_ids=None, sessions=None):
+        """
+        Transcribes the prompts with one generate call, returns their token ids, texts and language codes.
+        decoder_input_ids are the forced prefixes of the prompts, one per prompt and all of the same length.
+        sessions are the sessions of the prompts (None for prompts outside of any session): a prompt detected in
+        an unsupported language is transcribed again in the last language of its session.
+        """
+        if sessions is None:
+            sessions = [None] * len(spoken_prompts)
+        input_features = self.prepare_model_inputs(spoken_prompts)
+        gen_kwargs = self.gen_kwargs
+        if decoder_input_ids is not None:
+            decoder_input_ids = torch.tensor(decoder_input_ids, device=self.device)
+            if len(decoder_input_ids) < len(input_features):
+                # rows padding the static batch size of the compiled model
+                padding = decoder_input_ids[:1].repeat(len(input_features) - len(decoder_input_ids), 1)
+                decoder_input_ids = torch.cat([decoder_input_ids, padding])
+            gen_kwargs = {**self.gen_kwargs, "decoder_input_ids": decoder_input_ids}
+        pred_ids = self.model.generate(input_features, **gen_kwargs)[:len(spoken_prompts)]
+        language_codes = [self.language_code(ids) for ids in pred_ids]
+
+        unsupported = {}  # last language of the session -> prompts to reprocess with it
+        for i, (session, language_code) in enumerate(zip(sessions, language_codes)):
+            if language_code in SUPPORTED_LANGUAGES:
+                self.set_session_language(session, language_code)
+            else:
+                unsupported.setdefault(self.session_language(session), []).append(i)
+        pred_ids = list(pred_ids)
+        pred_texts = self.processor.batch_decode(
             pred_ids, skip_special_tokens=True, decode_with_timestamps=False
-        )[0]
-        language_code = self.processor.tokenizer.decode(pred_ids[0, 1])[2:-2] # remove "<|" and "|>"
+        )
+
+        for language, indexes in unsupported.items():  # reprocess with the last language of their sessions
+            logger.warning(f"Whisper detected unsupported languages: {[language_codes[i] for i in indexes]}")
+            gen_kwargs = copy(self.gen_kwargs)
+            gen_kwargs['language'] = language
+            retry_ids = self.model.generate(input_features[indexes], **gen_kwargs)
+            retry_texts = self.processor.batch_decode(
+                retry_ids, skip_special_tokens=True, decode_with_timestamps=False
+            )
+            for i, ids, text in zip(indexes, retry_ids, retry_texts):
+                language_codes[i] = self.language_code(ids)
+                pred_ids[i] = ids
+                pred_texts[i] = text
+
+        return pred_ids, pred_texts, language_codes
+
+    def hypothesis(self, pred_ids):
+        """Token ids of a transcription without the end of text token and padding."""
+        ids = pred_ids.tolist()
+        eos_token_id = self.model.generation_config.eos_token_id
+        return ids[:ids.index(eos_token_id)] if eos_token_id in ids else ids
+
+    def stable_prefix(self, previous_ids, ids):
+        """
+        Text tokens two consecutive partial hypotheses agree on, cut before the last agreed word which may still be
+        completed by the following audio. Returns None if no complete word is agreed on.
+        The special tokens (start of transcript, language, task) are left out: generate puts its own in front of
+        the decoder_input_ids.
+        """
+        common = []
+        for previous_id, token_id in zip(previous_ids, ids):
+            if previous_id != token_id:
+                break
+            common.append(token_id)
+        special_ids = set(self.processor.tokenizer.all_special_ids)
+        n_special = next((i for i, token_id in enumerate(common) if token_id not in special_ids), len(common))
+        tokens = self.processor.tokenizer.convert_ids_to_tokens(common)
+        for i in range(len(common) - 1, n_special, -1):
+            if tokens[i].startswith("Ġ"):  # the token starts a new word
+                return common[n_special:i]
+        return None
+
+    def partial_state(self, data):
+        session = data.get("session")
+        if session is None:
+            return None
+        return session.get_state("whisper_partial", dict)
+
+    def take_prefix(self, data):
+        """Returns the stable prefix of the partial transcriptions of this utterance, if any."""
+        state = self.partial_state(data)
+        if not state:
+            return None
+        spoken_prompt = data.get("user_audio")
+        head = state["head"]
+        prefix = state.get("prefix")
+        same_utterance = (
+            state["index"] == data.get_index("user_audio")
+            and len(spoken_prompt) >= len(head)
+            and np.array_equal(spoken_prompt[:len(head)], head)
+        )
+        state.clear()
+        return prefix if same_utterance else None
+
+    def update_partial(self, data, pred_ids):
+        """Stores the partial hypothesis and returns the text of the new stable prefix, if any."""
+        state = self.partial_state(data)
+        if state is None:
+            return None
+        index = data.get_index("user_audio")
+        if state.get("index") != index:
+            state.clear()
+            state["index"] = index
+            state["head"] = data.get("user_audio")[:256].copy()
+        previous_ids = state.get("hypothesis")
+        state["hypothesis"] = self.hypothesis(pred_ids)
+        if previous_ids is None:
+            return None
+        prefix = self.stable_prefix(previous_ids, state["hypothesis"])
+        if prefix is None or prefix == state.get("prefix"):
+            return None
+        state["prefix"] = prefix
+        return self.processor.tokenizer.decode(prefix, skip_special_tokens=True)
+
+    def process_batch(self, batch):
+        logger.debug(f"infering whisper on {len(batch)} utterances...")
+
+        # a partial is useless if a later audio of the same session is already there
+        sessions = [data.get("session") for data in batch]
+        superseded = [
+            data.get("is_partial") and sessions[i] is not None and sessions[i] in sessions[i + 1:]
+            for i, data in enumerate(batch)
+        ]
+        prefixes = [None if data.get("is_partial") else self.take_prefix(data) for data in batch]
+
+        results = [None] * len(batch)
+        plain = [i for i in range(len(batch)) if prefixes[i] is None and not superseded[i]]
+        if plain:
+            spoken_prompts = [batch[i].get("user_audio") for i in plain]
+            for i, result in zip(plain, zip(*self.transcribe(spoken_prompts, sessions=[sessions[i] for i in plain]))):
+                results[i] = result
+        # the finals with a stable prefix are decoded together, one generate call per length of prefix
+        prefixed = {}
+        for i, prefix in enumerate(prefixes):
+            if prefix is not None:
+                prefixed.setdefault(len(prefix), []).append(i)
+        for length, indexes in prefixed.items():
+            logger.debug(f"decoding the tails of {len(indexes)} utterances after {length} stable tokens")
+            spoken_prompts = [batch[i].get("user_audio") for i in indexes]
+            results_of_length = self.transcribe(
+                spoken_prompts, [prefixes[i] for i in indexes], sessions=[sessions[i] for i in indexes]
+            )
+            for i, result in zip(indexes, zip(*results_of_length)):
+                results[i] = result
 
         logger.debug("finished whisper inference")
-        console.print(f"[yellow]USER: {pred_text}")
-        logger.debug(f"Language Code Whisper: {language_code}")
 
-        if self.start_language == "auto":
-            language_code += "-auto"
+        outputs = []
+        for data, result in zip(batch, results):
+            if result is None:
+                outputs.append([])
+                continue
+            pred_ids, pred_text, language_code = result
+
+            if data.get("is_partial"):
+                partial_text = self.update_partial(data, pred_ids)
+                if partial_text is not None:
+                    logger.debug(f"USER (partial): {partial_text}")
+                outputs.append([data.add_data(partial_text, "partial_text")] if partial_text is not None else [])
+                continue
+
+            console.print(f"[yellow]USER: {pred_text}")
+            logger.debug(f"Language Code Whisper: {language_code}")
+            tracing.mark(data, "stt_done")
+
+            if self.start_language == "auto":
+                language_code += "-auto"
 
-        yield data.add_data(pred_text, "text") #.add_data(language_code, "language_code")
+            outputs.append([data.add_data(pred_text, "text")]) #.add_data(language_code, "language_code")
+        return outputs
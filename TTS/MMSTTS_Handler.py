@@ -7,6 +7,8 @@ import torch
 import re
 from num2words import num2words
 from transliterate import translit
+from TTS.phrase_cache import PhraseCache
+from utils.utils import sentence_and_language, to_int16
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -23,8 +25,11 @@ class MMSTTSHandler(BaseHandler):
             device="cuda",
             gen_kwargs={},
             model_name="facebook/mms-tts-rus",
+            cache_mb=64,
+            cache_dir=None,
     ):
         self.should_listen = should_listen
+        self.cache = PhraseCache(int(cache_mb * 2**20), cache_dir)
         self.device = device
         self.model_name = model_name
         self.model = VitsModel.from_pretrained(self.model_name).to(self.device)
@@ -40,11 +45,18 @@ class MMSTTSHandler(BaseHandler):
 
     def process(self, llm_sentence):
 
-        if isinstance(llm_sentence, tuple):
-            llm_sentence, language_code = llm_sentence
+        llm_sentence, language_code = sentence_and_language(llm_sentence)
 
         console.print(f"[green]ASSISTANT: {llm_sentence}")
 
+        key = self.cache.key(None, self.model_name, llm_sentence)
+        cached = self.cache.get(key)
+        if cached is not None:
+            logger.debug("Phrase cache hit")
+            yield cached
+            self.should_listen.set()
+            return
+
         text = llm_sentence
         text = re.sub(r'\d+', lambda x: num2words(int(x.group()), lang='ru'), text)
         text = translit(text, 'ru')
@@ -60,7 +72,8 @@ class MMSTTSHandler(BaseHandler):
             return
 
         # Масштабируем аудио и преобразуем в int16
-        audio = (audio * 32768).astype(np.int16)
+        audio = to_int16(audio)
+        self.cache.put(key, audio)
 
         # Выдаем аудио целиком
         yield audio
@@ -1,9 +1,10 @@
 import ChatTTS
 import logging
 from baseHandler import BaseHandler
-import librosa
 import numpy as np
 from rich.console import Console
+from utils.resampler import StreamingResampler, resample
+from utils.utils import sentence_and_language, to_int16
 import torch
 
 logging.basicConfig(
@@ -21,13 +22,12 @@ class ChatTTSHandler(BaseHandler):
         device="cuda",
         gen_kwargs={},  # Unused
         stream=True,
-        chunk_size=512,
+        chunk_size=512,  # Not used, the audio is cut into frames by the SessionPlayout of the session
     ):
         self.should_listen = should_listen
         self.device = device
         self.model = ChatTTS.Chat()
         self.model.load(compile=False)  # Doesn't work for me with True
-        self.chunk_size = chunk_size
         self.stream = stream
         rnd_spk_emb = self.model.sample_random_speaker()
         self.params_infer_code = ChatTTS.Chat.InferCodeParams(
@@ -41,8 +41,7 @@ class ChatTTSHandler(BaseHandler):
 
     def process(self, llm_sentence):
 
-        if isinstance(llm_sentence, tuple):
-            llm_sentence, language_code = llm_sentence
+        llm_sentence, language_code = sentence_and_language(llm_sentence)
 
         console.print(f"[green]ASSISTANT: {llm_sentence}")
         if self.device == "mps":
@@ -61,26 +60,18 @@ class ChatTTSHandler(BaseHandler):
 
         if self.stream:
             wavs = [np.array([])]
+            resampler = StreamingResampler(24000, 16000)
             for gen in wavs_gen:
                 if gen[0] is None or len(gen[0]) == 0:
                     self.should_listen.set()
                     return
-                audio_chunk = librosa.resample(gen[0], orig_sr=24000, target_sr=16000)
-                audio_chunk = (audio_chunk * 32768).astype(np.int16)[0]
-                while len(audio_chunk) > self.chunk_size:
-                    yield audio_chunk[: self.chunk_size]  # 返回前 chunk_size 字节的数据
-                    audio_chunk = audio_chunk[self.chunk_size :]  # 移除已返回的数据
-                yield np.pad(audio_chunk, (0, self.chunk_size - len(audio_chunk)))
+                yield to_int16(resampler.process(gen[0]))
+            yield to_int16(resampler.flush())
         else:
             wavs = wavs_gen
             if len(wavs[0]) == 0:
                 self.should_listen.set()
                 return
-            audio_chunk = librosa.resample(wavs[0], orig_sr=24000, target_sr=16000)
-            audio_chunk = (audio_chunk * 32768).astype(np.int16)
-            for i in range(0, len(audio_chunk), self.chunk_size):
-                yield np.pad(
-                    audio_chunk[i : i + self.chunk_size],
-                    (0, self.chunk_size - len(audio_chunk[i : i + self.chunk_size])),
-                )
+            audio_chunk = resample(wavs[0], orig_sr=24000, target_sr=16000)
+            yield to_int16(audio_chunk)
         self.should_listen.set()
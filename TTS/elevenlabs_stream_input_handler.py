@@ -0,0 +1,228 @@
+import base64
+import json
+import logging
+import os
+import threading
+from queue import Queue, Empty
+
+import httpx
+import numpy as np
+from rich.console import Console
+from websockets.exceptions import ConnectionClosed
+from websockets.sync.client import connect
+
+from baseHandler import BaseHandler
+from utils import cancellation, metrics
+from utils.data import ImmutableDataChain
+from utils.process_iterator import ProcessIterator
+from utils.session import get_session_id
+
+logger = logging.getLogger(__name__)
+console = Console()
+
+
+class StreamingTurn:
+    """
+    One stream-input session of the TTS, open for the whole reply of a turn: the text is sent as it is generated
+    and the audio of the session goes to a single iterator.
+    The connection is opened and written by the thread of the turn, the audio is read by a second thread.
+    """
+
+    def __init__(self, handler, data, iterator):
+        self.handler = handler
+        self.data = data
+        self.iterator = iterator
+        self.texts = Queue()
+        self.text = ""  # whole text of the turn, for the console
+        self.finished = threading.Event()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def push(self, text):
+        self.text += text
+        self.texts.put(text)
+
+    def end(self):
+        self.texts.put(None)
+
+    def run(self):
+        try:
+            with self.handler.connect() as connection:
+                connection.send(json.dumps(self.handler.begin_message()))
+                receiver = threading.Thread(target=self.receive, args=(connection,), daemon=True)
+                receiver.start()
+                while True:
+                    try:
+                        text = self.texts.get(timeout=0.1)
+                    except Empty:
+                        text = ""  # nothing to send, check the cancellation
+                    if cancellation.is_cancelled(self.data):
+                        logger.debug("Utterance cancelled, closing the TTS stream")
+                        connection.close()
+                        break
+                    if text is None:
+                        connection.send(json.dumps({"text": ""}))  # end of the input, flushes the audio
+                        break
+                    if text:
+                        connection.send(json.dumps({"text": text}))
+                receiver.join()
+        except Exception as e:
+            logger.error(f"Error in {self.handler.__class__.__name__}: {e}")
+        finally:
+            self.iterator.close()
+            self.finished.set()
+            if self.handler.should_listen is not None:
+                self.handler.should_listen.set()
+
+    def receive(self, connection):
+        buffer = b""
+        first_chunk = True
+        try:
+            for message in connection:
+                response = json.loads(message)
+                if response.get("audio"):
+                    if first_chunk:
+                        logger.debug("First chunk received")
+                        first_chunk = False
+                    buffer += base64.b64decode(response["audio"])
+                    even = (len(buffer) // 2) * 2
+                    if even:
+                        self.iterator.put(np.frombuffer(buffer[:even], dtype="<i2"))
+                        buffer = buffer[even:]
+                if response.get("isFinal"):
+                    logger.debug("All chunks received")
+                    return
+        except ConnectionClosed:
+            pass
+
+
+class ElevenLabsStreamInputTTSHandler(BaseHandler):
+    """
+    ElevenLabs TTS over the websocket stream-input API: one synthesis session per assistant turn instead of one
+    HTTP stream per sentence, fed with the fragments of the LLM ("llm_fragment") as they are generated until
+    "llm_done". A whole sentence ("llm_sentence", from LLM handlers without fragments) is a turn of its own.
+    The items are only dispatched to the turns, so they are processed in order by the thread of the handler.
+    stream_url may point to the local stand-in server of TTS/stream_input_server.py.
+    """
+
+    def setup(
+        self,
+        should_listen,
+        api_key=None,
+        proxy_url=None,
+        voice=None,
+        model="eleven_turbo_v2_5",
+        gen_kwargs={},  # Not used
+        cache_mb=64,  # Not used, turns are not cached
+        cache_dir=None,  # Not used
+        stream_url="wss://api.elevenlabs.io",
+        chunk_length_schedule=(50, 120, 160, 250),
+    ):
+        self.should_listen = should_listen
+        self.model = model
+        self.stream_url = stream_url.rstrip("/")
+        self.chunk_length_schedule = list(chunk_length_schedule)
+
+        if api_key is None:
+            api_key = os.getenv("ELEVENLABS_API_KEY")
+            if api_key is None:
+                raise ValueError("ElevenLabs API key must be provided or set in the ELEVENLABS_API_KEY environment variable.")
+        self.api_key = api_key
+
+        if proxy_url is None:
+            proxy_url = os.getenv("PROXY_URL")
+        self.proxy_url = proxy_url
+
+        self.voice_id = self.resolve_voice(voice)
+        self.turns = {}  # (session_id, user_phrase_id) -> StreamingTurn, only used by the thread of the handler
+        self.warmup()
+
+    def resolve_voice(self, voice):
+        """The websocket API takes a voice id, names (e.g. 'Rachel') are looked up through the REST API."""
+        if voice is None:
+            raise ValueError("A voice must be provided.")
+        http_url = self.stream_url.replace("wss://", "https://", 1).replace("ws://", "http://", 1)
+        try:
+            with httpx.Client(proxy=self.proxy_url, timeout=10) as client:
+                response = client.get(f"{http_url}/v1/voices", headers={"xi-api-key": self.api_key})
+                response.raise_for_status()
+                voices = response.json()["voices"]
+        except Exception as e:
+            logger.error(f"Could not look up the voice {voice}, using it as a voice id: {e}")
+            return voice
+        for item in voices:
+            if voice in (item["name"], item["voice_id"]):
+                return item["voice_id"]
+        raise ValueError(f"Unknown ElevenLabs voice {voice}, available: {', '.join(item['name'] for item in voices)}")
+
+    def warmup(self):
+        logger.info(f"Warmup {self.__class__.__name__}")
+        try:
+            with self.connect():
+                pass
+            logger.debug(f"Warmup {self.__class__.__name__} done")
+        except Exception as e:
+            logger.error(f"Warmup {self.__class__.__name__} failed, {e}")
+
+    def connect(self):
+        uri = (
+            f"{self.stream_url}/v1/text-to-speech/{self.voice_id}/stream-input"
+            f"?model_id={self.model}&output_format=pcm_16000"
+        )
+        return connect(
+            uri,
+            additional_headers={"xi-api-key": self.api_key},
+            proxy=self.proxy_url if self.proxy_url else True,
+        )
+
+    def begin_message(self):
+        return {"text": " ", "generation_config": {"chunk_length_schedule": self.chunk_length_schedule}}
+
+    def run(self):
+        while not self.stop_event.is_set():
+            input_data = self.queue_in.get()
+
+            if isinstance(input_data, bytes) and input_data == b"END":
+                logger.debug("Stopping thread")
+                break
+
+            metrics.handler_inputs.inc(handler=self.__class__.__name__)
+            try:
+                for output in self.process(input_data):
+                    metrics.handler_outputs.inc(handler=self.__class__.__name__)
+                    self.queue_out.put(output)
+            except Exception as e:
+                logger.error(f"Error in {self.__class__.__name__}: {e}")
+                self.stop_event.set()
+                break
+
+        self.executor.shutdown(wait=True)
+        metrics.handler_threads.dec(self.threads, handler=self.__class__.__name__)
+        self.cleanup()
+        self.queue_out.put(b"END")
+
+    def process(self, input_data: ImmutableDataChain):
+        self.turns = {key: turn for key, turn in self.turns.items() if not turn.finished.is_set()}
+        sentence = input_data.get("llm_sentence")
+        key = (get_session_id(input_data), input_data.get_index("user_audio"))
+        turn = self.turns.get(key) if sentence is None else None
+        if turn is None:
+            iterator = ProcessIterator()
+            turn = StreamingTurn(self, input_data, iterator)
+            if sentence is None:
+                self.turns[key] = turn
+            yield input_data.add_data(iterator, "output_audio_iterator")
+
+        if sentence is not None:
+            console.print(f"[green]ASSISTANT: {sentence}")
+            turn.push(sentence)
+            turn.end()
+        elif input_data.get("llm_done"):
+            console.print(f"[green]ASSISTANT: {turn.text}")
+            turn.end()
+            del self.turns[key]
+        else:
+            turn.push(input_data.get("llm_fragment"))
+
+    def cleanup(self):
+        for turn in self.turns.values():
+            turn.end()
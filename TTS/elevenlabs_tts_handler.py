@@ -6,6 +6,7 @@ import time
 import httpx
 from elevenlabs.client import ElevenLabs
 import os
+from TTS.phrase_cache import PhraseCache, stream_cached
 
 logger = logging.getLogger(__name__)
 console = Console()
@@ -19,10 +20,14 @@ class ElevenLabsTTSHandler(BaseHandler):
         voice=None,
         model="eleven_turbo_v2_5",
         gen_kwargs={},  # Not used
+        cache_mb=64,
+        cache_dir=None,
+        stream_url=None,  # Used by the stream-input handler only
     ):
         self.should_listen = should_listen
         self.voice = voice
         self.model = model
+        self.cache = PhraseCache(int(cache_mb * 2**20), cache_dir)
 
         if api_key is None:
             api_key = os.getenv("ELEVENLABS_API_KEY")
@@ -59,6 +64,15 @@ class ElevenLabsTTSHandler(BaseHandler):
 
         console.print(f"[green]ASSISTANT: {llm_sentence}")
 
+        key = self.cache.key(self.voice, self.model, llm_sentence)
+        cached = self.cache.get(key)
+        if cached is not None:
+            logger.debug("Phrase cache hit")
+            yield from stream_cached(cached, 16000)
+            if self.should_listen is not None:
+                self.should_listen.set()
+            return
+
         try:
             audio = self.client.generate(
                 voice=self.voice,
@@ -70,6 +84,7 @@ class ElevenLabsTTSHandler(BaseHandler):
             )
             buffer = b""
             first_chunk = True
+            chunks = []
             for chunk in audio:
                 if chunk:
 
@@ -80,10 +95,13 @@ class ElevenLabsTTSHandler(BaseHandler):
                     buffer += chunk
                     even_chunk = buffer[:(len(buffer) // 2) * 2]
                     audio_chunk = np.frombuffer(even_chunk, dtype='<i2')  # 16-битные целые числа, little-endian
+                    chunks.append(audio_chunk)
                     yield audio_chunk
                     buffer = buffer[(len(buffer) // 2) * 2:]
 
             logger.debug(f"All chunck recived")
+            if chunks:
+                self.cache.put(key, np.concatenate(chunks))
         except Exception as e:
             logger.error(f"Error in ElevenLabsTTSHandler: {e}")
             if self.should_listen is not None:
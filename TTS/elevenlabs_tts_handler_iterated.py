@@ -8,6 +8,8 @@ import httpx
 from elevenlabs.client import ElevenLabs
 from utils.process_iterator import ProcessIterator
 from utils.data import ImmutableDataChain
+from utils import cancellation
+from TTS.phrase_cache import PhraseCache, stream_cached
 import os
 
 logger = logging.getLogger(__name__)
@@ -22,10 +24,14 @@ class ElevenLabsTTSHandler(BaseHandler):
         voice=None,
         model="eleven_turbo_v2_5",
         gen_kwargs={},  # Not used
+        cache_mb=64,
+        cache_dir=None,
+        stream_url=None,  # Used by the stream-input handler only
     ):
         self.should_listen = should_listen
         self.voice = voice
         self.model = model
+        self.cache = PhraseCache(int(cache_mb * 2**20), cache_dir)
 
         if api_key is None:
             api_key = os.getenv("ELEVENLABS_API_KEY")
@@ -41,7 +47,7 @@ class ElevenLabsTTSHandler(BaseHandler):
 
         # Создаем один экземпляр httpx.Client и сохраняем его в self.http_client
         limits = httpx.Limits(keepalive_expiry=60 * 60)
-        self.http_client = httpx.Client(proxies=self.proxy_url, limits=limits, timeout=60*60)
+        self.http_client = httpx.Client(proxy=self.proxy_url, limits=limits, timeout=60*60)
 
         # Переиспользуем http_client для клиента ElevenLabs
         self.client = ElevenLabs(
@@ -70,6 +76,17 @@ class ElevenLabsTTSHandler(BaseHandler):
         try:
             yield input_data.add_data(iterator, "output_audio_iterator")
 
+            key = self.cache.key(self.voice, self.model, llm_sentence)
+            cached = self.cache.get(key)
+            if cached is not None:
+                logger.debug("Phrase cache hit")
+                for audio_chunk in stream_cached(cached, 16000, input_data):
+                    iterator.put(audio_chunk)
+                iterator.close()
+                if self.should_listen is not None:
+                    self.should_listen.set()
+                return
+
             audio = self.client.generate(
                 voice=self.voice,
                 text=llm_sentence,
@@ -80,7 +97,13 @@ class ElevenLabsTTSHandler(BaseHandler):
             )
             buffer = b""
             first_chunk = True
+            chunks = []
             for chunk in audio:
+                if cancellation.is_cancelled(input_data):
+                    logger.debug("Utterance cancelled, closing the stream")
+                    audio.close()  # generator of the SDK, closes the HTTP response
+                    chunks = None  # incomplete, not cached
+                    break
                 if chunk:
 
                     if first_chunk:
@@ -91,9 +114,12 @@ class ElevenLabsTTSHandler(BaseHandler):
                     even_chunk = buffer[:(len(buffer) // 2) * 2]
                     audio_chunk = np.frombuffer(even_chunk, dtype='<i2')
                     iterator.put(audio_chunk)
+                    chunks.append(audio_chunk)
                     buffer = buffer[(len(buffer) // 2) * 2:]
 
             logger.debug(f"All chunks received")
+            if chunks:
+                self.cache.put(key, np.concatenate(chunks))
             iterator.close()
         except Exception as e:
             logger.error(f"Error in ElevenLabsTTSHandler: {e}")
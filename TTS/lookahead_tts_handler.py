@@ -0,0 +1,184 @@
+import logging
+import threading
+from collections import deque
+
+from iteratorsHandler import IteratorHandler
+from utils import cancellation, metrics
+from utils.data import ImmutableDataChain
+from utils.process_iterator import ProcessIterator
+from utils.session import get_session_id
+
+logger = logging.getLogger(__name__)
+
+
+class PrefetchBudget:
+    """Bytes of synthesized audio waiting in the iterators of the handler, over all sessions."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def exhausted(self):
+        return self.used >= self.max_bytes
+
+    def reserve(self, nbytes):
+        """Never waits: the budget only decides which sentences are started, see LookaheadTTSHandler.schedule."""
+        with self.lock:
+            self.used += nbytes
+            metrics.tts_prefetch_bytes.set(self.used)
+
+    def release(self, nbytes):
+        """Returns True if the budget was exhausted and is not anymore, so that held back sentences may start."""
+        if not nbytes:
+            return False
+        with self.lock:
+            was_exhausted = self.exhausted()
+            self.used -= nbytes
+            metrics.tts_prefetch_bytes.set(self.used)
+            return was_exhausted and not self.exhausted()
+
+
+class PrefetchIterator(ProcessIterator):
+    """ProcessIterator of one sentence, accounting its unread audio in the budget of the handler."""
+
+    def __init__(self, handler, data):
+        super().__init__()
+        self.handler = handler
+        self.data = data
+        self.buffered = 0  # bytes put and not read yet
+        self.discarded = False
+        self.lock = threading.Lock()
+
+    def put(self, chunk):
+        nbytes = getattr(chunk, "nbytes", 0)
+        self.handler.budget.reserve(nbytes)
+        with self.lock:
+            if self.discarded:
+                self.handler.budget.release(nbytes)
+                return
+            self.buffered += nbytes
+            super().put(chunk)
+
+    def _take(self, chunk):
+        if chunk is self._sentinel:
+            self.handler.played(self)
+            raise StopIteration
+        nbytes = getattr(chunk, "nbytes", 0)
+        freed = False
+        with self.lock:
+            if not self.discarded:
+                self.buffered -= nbytes
+                freed = self.handler.budget.release(nbytes)
+        if freed:
+            self.handler.schedule()
+        return chunk
+
+    def discard(self):
+        """
+        The sentence was cancelled: frees its budget, the chunks put from now on are dropped.
+        Returns True if held back sentences may start.
+        """
+        with self.lock:
+            self.discarded = True
+            freed = self.handler.budget.release(self.buffered)
+            self.buffered = 0
+        return freed
+
+
+class LookaheadTTSHandler(IteratorHandler):
+    """
+    Runs a TTS handler synthesizing one sentence per call of its process (Parler, Melo, ChatTTS, MMS, OpenAI) in the
+    iterated pipeline, and synthesizes the next sentences of a session while the previous ones are played.
+
+    IteratorHandler.run puts the iterator of every sentence in the output queue in the order of the sentences, so
+    playback is in order whatever the order the syntheses end in. A sentence is started once at most `depth`
+    sentences of its session are ahead of it, started and not fully read from their iterator yet (played).
+    The audio waiting to be played is capped to max_prefetch_mb over all the sessions: past it, a sentence that is
+    not the next one to play of its session stays pending until audio is played. A started synthesis never waits
+    for the budget (the sentences already started may go over it), so the `threads` workers of the executor,
+    shared by all the sessions, are only busy synthesizing.
+    """
+
+    def setup(self, backend, depth=2, max_prefetch_mb=16):
+        self.backend = backend
+        self.depth = depth
+        self.budget = PrefetchBudget(int(max_prefetch_mb * 2**20))
+        self.lock = threading.Lock()
+        self.pending = {}  # session_id -> deque of (data, iterator) of the sentences waiting to be started
+        self.windows = {}  # session_id -> deque of the iterators of the started sentences not played yet
+
+    def create_iterator(self, input_data):
+        return PrefetchIterator(self, input_data)
+
+    def submit(self, input_data, iterator):
+        with self.lock:
+            self.pending.setdefault(get_session_id(input_data), deque()).append((input_data, iterator))
+        self.schedule()
+
+    def schedule(self):
+        """Starts the sentences that entered the window of their session, and drops the cancelled ones."""
+        started = []
+        cancelled = []
+        with self.lock:
+            for session_id in set(self.pending) | set(self.windows):
+                window = self.windows.get(session_id, deque())
+                for iterator in [iterator for iterator in window if cancellation.is_cancelled(iterator.data)]:
+                    window.remove(iterator)
+                    cancelled.append(iterator)
+                pending = self.pending.get(session_id, deque())
+                while pending and (self.may_start(window) or cancellation.is_cancelled(pending[0][0])):
+                    data, iterator = pending.popleft()
+                    if cancellation.is_cancelled(data):
+                        cancelled.append(iterator)
+                        iterator.close()  # never synthesized
+                    else:
+                        window.append(iterator)
+                        started.append((data, iterator))
+                self.set_or_drop(self.windows, session_id, window)
+                self.set_or_drop(self.pending, session_id, pending)
+        # the budget and the iterators are locked after the handler, never while holding self.lock
+        freed = [iterator.discard() for iterator in cancelled]
+        for data, iterator in started:
+            self.executor.submit(self.process_and_write, data, iterator)
+        if any(freed):
+            self.schedule()
+
+    def may_start(self, window):
+        """The next pending sentence of a session starts if it is the next to play, or fits in the depth and budget."""
+        if not window:
+            return True
+        return len(window) <= self.depth and not self.budget.exhausted()
+
+    @staticmethod
+    def set_or_drop(sessions, session_id, items):
+        if items:
+            sessions[session_id] = items
+        else:
+            sessions.pop(session_id, None)
+
+    def played(self, iterator):
+        with self.lock:
+            window = self.windows.get(get_session_id(iterator.data))
+            if window and iterator in window:
+                window.remove(iterator)
+        self.schedule()
+
+    def filter(self, phrase_id, session_id=None):
+        """Same interface as FilteredQueue.filter, the tokens of the interrupted utterances are already cancelled."""
+        self.schedule()
+
+    def forget_session(self, session_id):
+        self.schedule()
+
+    def process(self, input_data: ImmutableDataChain):
+        # the chain is passed on, so that backends stopping their generation on cancellation (Parler) see its token
+        chunks = self.backend.process(input_data)
+        try:
+            for chunk in chunks:
+                if cancellation.is_cancelled(input_data) or self.stop_event.is_set():
+                    logger.debug("Utterance cancelled, stopping the synthesis")
+                    break
+                yield chunk
+        finally:
+            chunks.close()
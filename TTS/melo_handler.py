@@ -1,9 +1,10 @@
 from melo.api import TTS
 import logging
 from baseHandler import BaseHandler
-import librosa
 import numpy as np
 from rich.console import Console
+from utils.resampler import resample
+from utils.utils import sentence_and_language, to_int16
 import torch
 
 logger = logging.getLogger(__name__)
@@ -37,7 +38,7 @@ class MeloTTSHandler(BaseHandler):
         language="en",
         speaker_to_id="en",
         gen_kwargs={},  # Unused
-        blocksize=512,
+        blocksize=512,  # Not used, the audio is cut into frames by the SessionPlayout of the session
     ):
         self.should_listen = should_listen
         self.device = device
@@ -48,7 +49,6 @@ class MeloTTSHandler(BaseHandler):
         self.speaker_id = self.model.hps.data.spk2id[
             WHISPER_LANGUAGE_TO_MELO_SPEAKER[speaker_to_id]
         ]
-        self.blocksize = blocksize
         self.warmup()
 
     def warmup(self):
@@ -56,10 +56,7 @@ class MeloTTSHandler(BaseHandler):
         _ = self.model.tts_to_file("text", self.speaker_id, quiet=True)
 
     def process(self, llm_sentence):
-        language_code = None
-
-        if isinstance(llm_sentence, tuple):
-            llm_sentence, language_code = llm_sentence
+        llm_sentence, language_code = sentence_and_language(llm_sentence)
 
         console.print(f"[green]ASSISTANT: {llm_sentence}")
 
@@ -98,12 +95,7 @@ class MeloTTSHandler(BaseHandler):
         if len(audio_chunk) == 0:
             self.should_listen.set()
             return
-        audio_chunk = librosa.resample(audio_chunk, orig_sr=44100, target_sr=16000)
-        audio_chunk = (audio_chunk * 32768).astype(np.int16)
-        for i in range(0, len(audio_chunk), self.blocksize):
-            yield np.pad(
-                audio_chunk[i : i + self.blocksize],
-                (0, self.blocksize - len(audio_chunk[i : i + self.blocksize])),
-            )
+        audio_chunk = resample(audio_chunk, orig_sr=44100, target_sr=16000)
+        yield to_int16(audio_chunk)
 
         self.should_listen.set()
@@ -7,7 +7,9 @@ import time
 import httpx
 from openai import OpenAI
 import os
-import librosa
+from TTS.phrase_cache import PhraseCache, stream_cached
+from utils.resampler import StreamingResampler
+from utils.utils import sentence_and_language, to_int16
 
 logger = logging.getLogger(__name__)
 console = Console()
@@ -20,10 +22,15 @@ class OpenAITTSHandler(BaseHandler):
         api_key=None,
         proxy_url=None,
         voice="alloy",
+        model="tts-1",
         gen_kwargs={},  # Не используется
+        cache_mb=64,
+        cache_dir=None,
     ):
         self.should_listen = should_listen
         self.voice = voice
+        self.model = model
+        self.cache = PhraseCache(int(cache_mb * 2**20), cache_dir)
 
         if api_key is None:
             api_key = os.getenv("OPENAI_API_KEY")
@@ -51,15 +58,25 @@ class OpenAITTSHandler(BaseHandler):
 
     def process(self, llm_sentence):
         # Обработка возможного кода языка
-        if isinstance(llm_sentence, tuple):
-            llm_sentence, language_code = llm_sentence
+        llm_sentence, language_code = sentence_and_language(llm_sentence)
 
         console.print(f"[green]ASSISTANT: {llm_sentence}")
 
+        key = self.cache.key(self.voice, self.model, llm_sentence)
+        cached = self.cache.get(key)
+        if cached is not None:
+            logger.debug("Phrase cache hit")
+            yield from stream_cached(cached, 16000)
+            self.should_listen.set()
+            return
+
+        chunks = []
+        # Исходная частота дискретизации 24000 Гц, целевая 16000 Гц для вашего пайплайна
+        resampler = StreamingResampler(24000, 16000)
         try:
             start_time = time.time()
             with self.client.audio.speech.with_streaming_response.create(
-                    model="tts-1",
+                    model=self.model,
                     voice=self.voice,
                     response_format="pcm",  # PCM формат без заголовка
                     input=llm_sentence,
@@ -69,23 +86,19 @@ class OpenAITTSHandler(BaseHandler):
                     audio_chunk = np.frombuffer(chunk, dtype='<i2')
                     print(audio_chunk.max())
 
-                    # Ресемплирование с учетом исходной частоты дискретизации 48000 Гц
-                    original_sr = 24000  # Исходная частота дискретизации
-                    target_sr = 16000    # Целевая частота дискретизации для вашего пайплайна
-
-                    audio_chunk = librosa.resample(
-                        audio_chunk.astype(np.float32),
-                        orig_sr=original_sr,
-                        target_sr=target_sr
-                    )
-
-                    audio_chunk = audio_chunk
-                    audio_chunk = audio_chunk.astype(np.int16)
+                    # Ресемплирование потоком: состояние фильтра сохраняется между чанками
+                    audio_chunk = to_int16(resampler.process(audio_chunk), scale=1)
+                    chunks.append(audio_chunk)
                     yield audio_chunk
                     start_time = time.time()
+            audio_chunk = to_int16(resampler.flush(), scale=1)
+            chunks.append(audio_chunk)
+            yield audio_chunk
         except Exception as e:
             logger.error(f"Ошибка в OpenAITTSHandler: {e}")
             self.should_listen.set()
             return
 
+        if chunks:
+            self.cache.put(key, np.concatenate(chunks))
         self.should_listen.set()
@@ -1,5 +1,4 @@
 from threading import Thread
-from time import perf_counter
 from baseHandler import BaseHandler
 import numpy as np
 import torch
@@ -7,10 +6,12 @@ from transformers import (
     AutoTokenizer,
 )
 from parler_tts import ParlerTTSForConditionalGeneration, ParlerTTSStreamer
-import librosa
 import logging
 from rich.console import Console
-from utils.utils import next_power_of_2
+from utils.utils import next_power_of_2, sentence_and_language, to_int16
+from utils import cancellation
+from utils.resampler import StreamingResampler
+from utils.stopping_criteria import cancellation_criteria
 from transformers.utils.import_utils import (
     is_flash_attn_2_available,
 )
@@ -46,7 +47,7 @@ class ParlerTTSHandler(BaseHandler):
             "She speaks very fast."
         ),
         play_steps_s=1,
-        blocksize=512,
+        blocksize=512,  # Not used, the audio is cut into frames by the SessionPlayout of the session
     ):
         self.should_listen = should_listen
         self.device = device
@@ -64,7 +65,6 @@ class ParlerTTSHandler(BaseHandler):
 
         framerate = self.model.audio_encoder.config.frame_rate
         self.play_steps = int(framerate * play_steps_s)
-        self.blocksize = blocksize
 
         if self.compile_mode not in (None, "default"):
             logger.warning(
@@ -147,9 +147,9 @@ class ParlerTTSHandler(BaseHandler):
             )
 
     def process(self, llm_sentence):
-        if isinstance(llm_sentence, tuple):
-            llm_sentence, _ = llm_sentence
-            
+        data = llm_sentence  # the chain, whose cancellation token stops the generation
+        llm_sentence, _ = sentence_and_language(data)
+
         console.print(f"[green]ASSISTANT: {llm_sentence}")
         nb_tokens = len(self.prompt_tokenizer(llm_sentence).input_ids)
 
@@ -169,23 +169,20 @@ class ParlerTTSHandler(BaseHandler):
         streamer = ParlerTTSStreamer(
             self.model, device=self.device, play_steps=self.play_steps
         )
-        tts_gen_kwargs = {"streamer": streamer, **tts_gen_kwargs}
+        tts_gen_kwargs = {"streamer": streamer, "stopping_criteria": cancellation_criteria(data), **tts_gen_kwargs}
         torch.manual_seed(0)
         thread = Thread(target=self.model.generate, kwargs=tts_gen_kwargs)
         thread.start()
 
-        for i, audio_chunk in enumerate(streamer):
-            global pipeline_start
-            if i == 0 and "pipeline_start" in globals():
-                logger.info(
-                    f"Time to first audio: {perf_counter() - pipeline_start:.3f}"
-                )
-            audio_chunk = librosa.resample(audio_chunk, orig_sr=44100, target_sr=16000)
-            audio_chunk = (audio_chunk * 32768).astype(np.int16)
-            for i in range(0, len(audio_chunk), self.blocksize):
-                yield np.pad(
-                    audio_chunk[i : i + self.blocksize],
-                    (0, self.blocksize - len(audio_chunk[i : i + self.blocksize])),
-                )
+        # the chunks of the streamer are resampled as one stream, without discontinuities between them
+        resampler = StreamingResampler(44100, 16000)
+        for audio_chunk in streamer:
+            if cancellation.is_cancelled(data):
+                # the stopping criteria ends the generate thread at the next step
+                logger.debug("Utterance cancelled, stopping the generation")
+                break
+            yield to_int16(resampler.process(audio_chunk))
+        else:
+            yield to_int16(resampler.flush())
 
         self.should_listen.set()
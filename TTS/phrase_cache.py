@@ -0,0 +1,165 @@
+import json
+import logging
+import mmap
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from utils import cancellation
+
+logger = logging.getLogger(__name__)
+
+REPLAY_CHUNK_S = 0.1  # duration of the chunks of a cached phrase
+REPLAY_LEAD_S = 0.5  # how far the replay runs ahead of real time, like a TTS stream faster than real time
+
+
+class PhraseCache:
+    """
+    Synthesized audio of the sentences already spoken, keyed by (voice, model, normalized text).
+    Int16 PCM arrays are kept in memory in LRU order up to max_bytes. With a directory, every new phrase is also
+    appended to an on-disk store (phrases.pcm, indexed by phrases.json) which is memory-mapped, so that phrases
+    evicted from memory or synthesized by a previous run are read back without a copy. The store is compacted
+    to its most recently used half once it would exceed disk_max_bytes.
+    max_bytes=0 disables the cache, the on-disk store included.
+    A directory must not be shared by several processes.
+    """
+
+    def __init__(self, max_bytes=64 * 2**20, directory=None, disk_max_bytes=512 * 2**20):
+        self.max_bytes = max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> int16 array
+        self._memory_bytes = 0
+        self._index = OrderedDict()  # key -> (offset in bytes, samples) in the store
+        self._store_bytes = 0
+        self._map = None
+        self._pcm_path = self._index_path = None
+        if directory is not None and max_bytes > 0:
+            os.makedirs(directory, exist_ok=True)
+            self._pcm_path = os.path.join(directory, "phrases.pcm")
+            self._index_path = os.path.join(directory, "phrases.json")
+            self._load()
+
+    @staticmethod
+    def key(voice, model, text):
+        # punctuation is kept, it changes the intonation
+        return f"{voice}|{model}|{' '.join(text.split()).lower()}"
+
+    def get(self, key):
+        """Returns the int16 audio of the phrase, or None."""
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                return audio
+            entry = self._index.get(key)
+            if entry is None:
+                return None
+            self._index.move_to_end(key)
+            offset, samples = entry
+            audio = np.frombuffer(self._map, dtype="<i2", count=samples, offset=offset)
+            self._remember(key, audio)
+            return audio
+
+    def put(self, key, audio):
+        if self.max_bytes == 0:
+            return
+        audio = np.ascontiguousarray(audio, dtype="<i2")
+        if len(audio) == 0:
+            return
+        with self._lock:
+            self._remember(key, audio)
+            if self._pcm_path is not None and key not in self._index:
+                self._append(key, audio)
+
+    def _remember(self, key, audio):
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= previous.nbytes
+        self._memory[key] = audio
+        self._memory_bytes += audio.nbytes
+        while self._memory_bytes > self.max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted.nbytes
+
+    def _load(self):
+        if not (os.path.exists(self._pcm_path) and os.path.exists(self._index_path)):
+            return
+        size = os.path.getsize(self._pcm_path)
+        with open(self._index_path, encoding="utf-8") as file:
+            entries = json.load(file)
+        for key, offset, samples in entries:
+            if offset + 2 * samples <= size:
+                self._index[key] = (offset, samples)
+                self._store_bytes = max(self._store_bytes, offset + 2 * samples)
+        self._remap()
+        logger.info(f"Phrase cache: {len(self._index)} phrases loaded from {self._pcm_path}")
+
+    def _append(self, key, audio):
+        if self._store_bytes + audio.nbytes > self.disk_max_bytes:
+            self._compact(self.disk_max_bytes // 2)
+            if self._store_bytes + audio.nbytes > self.disk_max_bytes:
+                return
+        with open(self._pcm_path, "r+b" if os.path.exists(self._pcm_path) else "wb") as file:
+            file.seek(self._store_bytes)
+            file.write(audio.tobytes())
+            file.truncate()
+        self._index[key] = (self._store_bytes, len(audio))
+        self._store_bytes += audio.nbytes
+        self._save_index()
+        self._remap()
+
+    def _compact(self, max_bytes):
+        """Rewrites the store with the most recently used phrases fitting in max_bytes."""
+        kept = []
+        total = 0
+        for key, (offset, samples) in reversed(self._index.items()):
+            if total + 2 * samples > max_bytes:
+                break
+            kept.append((key, offset, samples))
+            total += 2 * samples
+        temporary_path = self._pcm_path + ".tmp"
+        index = OrderedDict()
+        with open(temporary_path, "wb") as file:
+            for key, offset, samples in reversed(kept):
+                index[key] = (file.tell(), samples)
+                file.write(self._map[offset : offset + 2 * samples])
+        # arrays already handed out keep the previous mapping, which stays valid after the replace
+        os.replace(temporary_path, self._pcm_path)
+        self._index = index
+        self._store_bytes = total
+        self._save_index()
+        self._remap()
+        logger.debug(f"Phrase cache: store compacted to {len(index)} phrases")
+
+    def _save_index(self):
+        temporary_path = self._index_path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump([[key, offset, samples] for key, (offset, samples) in self._index.items()], file)
+        os.replace(temporary_path, self._index_path)
+
+    def _remap(self):
+        if self._store_bytes == 0:
+            self._map = None
+            return
+        with open(self._pcm_path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def stream_cached(audio, sample_rate, data=None):
+    """
+    Yields a cached phrase in chunks at the pace of a TTS stream: the first chunk at once, then staying
+    REPLAY_LEAD_S ahead of real time, until the utterance of `data` is cancelled.
+    """
+    chunk_samples = int(REPLAY_CHUNK_S * sample_rate)
+    start = time.perf_counter()
+    for offset in range(0, len(audio), chunk_samples):
+        if cancellation.is_cancelled(data):
+            return
+        delay = start + offset / sample_rate - REPLAY_LEAD_S - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        yield audio[offset : offset + chunk_samples]
@@ -0,0 +1,89 @@
+"""
+Local stand-in for the ElevenLabs stream-input websocket API, to run and test the streaming TTS mode without an
+API key or network access. Text is buffered like the real service (until the next length of
+chunk_length_schedule is reached at a word boundary, or the end of the input), and "synthesized" as a tone per
+character, 16 kHz int16 PCM in base64, after --generation_ms.
+
+    python -m TTS.stream_input_server --port 8765
+    python s2s_pipeline.py --tts elevenlabsStreamTTS --elevenlabs_tts_stream_url ws://localhost:8765 --elevenlabs_tts_api_key test ...
+"""
+import argparse
+import asyncio
+import base64
+import json
+import logging
+
+import numpy as np
+from websockets.asyncio.server import serve
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+CHUNK_S = 0.1
+
+
+def synthesize(text, ms_per_char=60):
+    samples_per_char = SAMPLE_RATE * ms_per_char // 1000
+    t = np.arange(samples_per_char) / SAMPLE_RATE
+    tones = [
+        np.zeros(samples_per_char) if char.isspace() else np.sin(2 * np.pi * (200 + 20 * (ord(char) % 20)) * t)
+        for char in text
+    ]
+    return (np.concatenate(tones) * 8000).astype("<i2") if tones else np.zeros(0, "<i2")
+
+
+class StreamInputSession:
+    def __init__(self, websocket, generation_ms):
+        self.websocket = websocket
+        self.generation_ms = generation_ms
+        self.pending = ""
+        self.schedule = [120, 160, 250, 290]
+
+    async def run(self):
+        async for message in self.websocket:
+            request = json.loads(message)
+            if "generation_config" in request:
+                self.schedule = list(request["generation_config"].get("chunk_length_schedule", self.schedule))
+            text = request.get("text", "")
+            if text == "":
+                await self.generate(self.pending)
+                await self.websocket.send(json.dumps({"isFinal": True}))
+                return
+            self.pending += text
+            threshold = self.schedule[0] if self.schedule else 0
+            if len(self.pending.strip()) >= threshold and " " in self.pending.strip():
+                cut = self.pending.rstrip().rindex(" ") + 1
+                text, self.pending = self.pending[:cut], self.pending[cut:]
+                if len(self.schedule) > 1:
+                    self.schedule.pop(0)
+                await self.generate(text)
+
+    async def generate(self, text):
+        if not text.strip():
+            return
+        await asyncio.sleep(self.generation_ms / 1000)
+        audio = synthesize(text.strip())
+        chunk = int(CHUNK_S * SAMPLE_RATE)
+        for start in range(0, len(audio), chunk):
+            payload = base64.b64encode(audio[start : start + chunk].tobytes()).decode()
+            await self.websocket.send(json.dumps({"audio": payload, "isFinal": None}))
+        logger.info(f"Synthesized {text.strip()!r}")
+
+
+async def main(host, port, generation_ms):
+    async def handler(websocket):
+        await StreamInputSession(websocket, generation_ms).run()
+
+    async with serve(handler, host, port):
+        logger.info(f"Stream-input stand-in server listening on ws://{host}:{port}")
+        await asyncio.get_running_loop().create_future()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--generation_ms", type=int, default=50, help="Delay before the audio of every chunk of text.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(args.host, args.port, args.generation_ms))
@@ -0,0 +1,117 @@
+import threading
+import torch
+
+# BatchedVAD.forward relies on the private attributes of the jit model of this release
+SILERO_VAD_REPO = "snakers4/silero-vad:v5.1.2"
+
+
+class VADSlot:
+    """
+    Recurrent state of one session in a BatchedVAD, usable as a silero model by a VADIterator.
+    """
+
+    def __init__(self, engine, index):
+        self.engine = engine
+        self.index = index
+
+    def reset_states(self):
+        self.engine.reset(self.index)
+
+    def close(self):
+        self.engine.release(self.index)
+
+    def __call__(self, x, sr):
+        return torch.tensor(self.engine.infer([self.index], x.view(1, -1)))
+
+
+class BatchedVAD:
+    """
+    Runs one Silero model for the windows of all sessions at once.
+    The recurrent state (and the audio context the model prepends to each window) of every session is a row of
+    the `state` and `context` tensors, indexed by the slot of the session. For a batch, the rows of the sessions
+    are gathered, passed to the model and scattered back, so one forward pass and one device sync serve all the
+    sessions that have a window ready.
+    Windows can be written directly into the rows of `windows` (see VADIterator.next_window), row i of the batch
+    being the i-th slot passed to infer.
+    """
+
+    state_size = 128
+    model_attributes = ("_state", "_context", "_last_sr", "_last_batch_size")
+
+    def __init__(self, model, sampling_rate=16000, capacity=16):
+        self.model = model
+        self.check_model()
+        self.sampling_rate = sampling_rate
+        self.window_size_samples = 512 if sampling_rate == 16000 else 256
+        self.context_size = 64 if sampling_rate == 16000 else 32
+        self.state = torch.zeros(2, capacity, self.state_size)
+        self.context = torch.zeros(capacity, self.context_size)
+        self.windows = torch.zeros(capacity, self.window_size_samples)
+        self.windows_array = self.windows.numpy()
+        self._free = list(range(capacity - 1, -1, -1))
+        self._lock = threading.Lock()
+
+    def check_model(self):
+        """Fails at setup rather than on the first window if the model does not keep its state like silero-vad v5."""
+        missing = [name for name in self.model_attributes if not hasattr(self.model, name)]
+        if missing:
+            raise RuntimeError(
+                f"The Silero VAD model has no {', '.join(missing)} attribute, load it from {SILERO_VAD_REPO} "
+                "or use the onnx VAD backend"
+            )
+
+    @property
+    def capacity(self):
+        return self.context.shape[0]
+
+    def allocate(self):
+        with self._lock:
+            if not self._free:
+                self._grow()
+            index = self._free.pop()
+        self.reset(index)
+        return VADSlot(self, index)
+
+    def release(self, index):
+        with self._lock:
+            self._free.append(index)
+
+    def reset(self, index):
+        self.state[:, index] = 0
+        self.context[index] = 0
+
+    def _grow(self):
+        capacity = self.capacity
+        self.state = torch.cat([self.state, torch.zeros_like(self.state)], dim=1)
+        self.context = torch.cat([self.context, torch.zeros_like(self.context)])
+        self.windows = torch.cat([self.windows, torch.zeros_like(self.windows)])
+        self.windows_array = self.windows.numpy()
+        self._free.extend(range(2 * capacity - 1, capacity - 1, -1))
+
+    @torch.no_grad()
+    def infer(self, indexes, windows=None):
+        """
+        Speech probabilities of a batch of windows, windows[i] belonging to the slot indexes[i].
+        By default the first len(indexes) rows of `windows` are used.
+        """
+        if windows is None:
+            windows = self.windows[: len(indexes)]
+        rows = torch.tensor(indexes)
+        output, state, context = self.forward(windows, self.state[:, rows], self.context[rows])
+        self.state[:, rows] = state
+        self.context[rows] = context
+        return output.reshape(-1).tolist()
+
+    def forward(self, windows, state, context):
+        """
+        Runs the model on a batch with the given state and context, returns the output and the new state and context.
+        The silero-vad v5 jit model keeps them in the `_state` and `_context` attributes (and resets them when the
+        batch size or the sampling rate changes), so they are swapped in and out around the call.
+        """
+        model = self.model
+        model._state = state
+        model._context = context
+        model._last_sr = self.sampling_rate
+        model._last_batch_size = windows.shape[0]
+        output = model(windows, self.sampling_rate)
+        return output, model._state, model._context
@@ -0,0 +1,35 @@
+import numpy as np
+import onnxruntime
+import torch
+
+from VAD.batched_vad import BatchedVAD
+
+
+class OnnxBatchedVAD(BatchedVAD):
+    """
+    BatchedVAD running the ONNX export of Silero VAD v5 (silero_vad.onnx) with ONNX Runtime.
+    The model is loaded from a local file, so nothing is downloaded at startup, and runs on `intra_op_threads`
+    CPU threads. The state goes in and out of the model explicitly, the audio context is prepended to the
+    windows here, as the jit model does internally.
+    """
+
+    def __init__(self, model_path, sampling_rate=16000, capacity=16, intra_op_threads=1):
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        session = onnxruntime.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        super().__init__(session, sampling_rate, capacity)
+        self.intra_op_threads = intra_op_threads
+        self._sr = np.array(sampling_rate, dtype=np.int64)
+
+    def check_model(self):
+        pass  # the state goes through the inputs and outputs of the model
+
+    def forward(self, windows, state, context):
+        x = torch.cat([context, windows], dim=1)
+        output, state = self.model.run(
+            ["output", "stateN"], {"input": x.numpy(), "state": state.numpy(), "sr": self._sr}
+        )
+        return torch.from_numpy(output), torch.from_numpy(state), x[:, -self.context_size:]
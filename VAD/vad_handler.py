@@ -1,27 +1,36 @@
 import torchaudio
+from VAD.batched_vad import SILERO_VAD_REPO, BatchedVAD
 from VAD.vad_iterator import VADIterator
-from baseHandler import BaseHandler
-import numpy as np
+from batchingHandler import BatchingHandler
 import torch
 from rich.console import Console
 
-from utils.utils import int2float
 from df.enhance import enhance, init_df
 import logging
 
-from utils.data import ImmutableDataChain
+from utils import cancellation, tracing
+from utils.ring_buffer import AudioRingBuffer
+from utils.session import Session
 
 logger = logging.getLogger(__name__)
 
 console = Console()
 
 
-class VADHandler(BaseHandler):
+class VADHandler(BatchingHandler):
     """
     Handles voice activity detection. When voice activity is detected, audio will be accumulated until the end of speech is detected and then passed
     to the following part.
+    Input items are either raw audio chunks or (session, samples written) tuples, each session keeps its own VADIterator.
+    The audio of a session is read from its AudioRingBuffer ("ring_buffer" state, filled by the socket receiver),
+    raw audio chunks are copied into the ring buffer of a default session.
+    The inputs already queued are taken together, and the next windows of all their sessions go through the model
+    in one batched step (see BatchedVAD), repeated until no session has a complete window left.
     """
 
+    batch_window_ms = 0
+    max_batch_size = 64
+
     def setup(
         self,
         should_listen,
@@ -33,6 +42,12 @@ class VADHandler(BaseHandler):
         max_speech_ms=float("inf"),
         speech_pad_ms=30,
         audio_enhancement=False,
+        partial_interval_ms=0,
+        speculative=False,
+        ring_buffer_s=60,
+        vad_backend="torch",
+        vad_onnx_model_path=None,
+        vad_intra_op_threads=1,
     ):
         self.should_listen = should_listen
         self.interruption_request_queue = interruption_request_queue
@@ -40,61 +55,133 @@ class VADHandler(BaseHandler):
         self.min_silence_ms = min_silence_ms
         self.min_speech_ms = min_speech_ms
         self.max_speech_ms = max_speech_ms
-        self.model, _ = torch.hub.load("snakers4/silero-vad", "silero_vad")
-        self.start_data = ImmutableDataChain()
-        self.iterator = VADIterator(
-            self.model,
-            self.start_data,
+        self.ring_buffer_s = ring_buffer_s
+        if vad_backend == "onnx":
+            from VAD.onnx_vad import OnnxBatchedVAD
+
+            if vad_onnx_model_path is None:
+                raise ValueError("vad_onnx_model_path is required by the onnx VAD backend")
+            self.engine = OnnxBatchedVAD(vad_onnx_model_path, sample_rate, intra_op_threads=vad_intra_op_threads)
+        elif vad_backend == "torch":
+            model, _ = torch.hub.load(SILERO_VAD_REPO, "silero_vad")
+            self.engine = BatchedVAD(model, sample_rate)
+        else:
+            raise ValueError(f"Unknown VAD backend {vad_backend}, expected 'torch' or 'onnx'")
+        self.iterator_kwargs = dict(
             threshold=thresh,
             sampling_rate=sample_rate,
             min_silence_duration_ms=min_silence_ms,
             speech_pad_ms=speech_pad_ms,
             interruption_request_queue=self.interruption_request_queue,
-            min_speech_ms = min_speech_ms
+            min_speech_ms = min_speech_ms,
+            partial_interval_ms=partial_interval_ms,
+            speculative=speculative,
         )
+        # Session of the raw audio chunks, that are not bound to any client
+        self.session = Session()
         self.audio_enhancement = audio_enhancement
         if audio_enhancement:
             self.enhanced_model, self.df_state, _ = init_df()
 
-    def process(self, audio_chunk):
-        audio_int16 = np.frombuffer(audio_chunk, dtype=np.int16)
-        audio_float32 = int2float(audio_int16)
-        vad_output = self.iterator(torch.from_numpy(audio_float32))
+    def get_ring_buffer(self, session):
+        return session.get_state("ring_buffer", lambda: AudioRingBuffer(int(self.ring_buffer_s * self.sample_rate)))
+
+    def get_iterator(self, session):
+        # the recurrent state of the session is a slot of the batched model
+        return session.get_state(
+            "vad_iterator",
+            lambda: VADIterator(
+                self.engine.allocate(), session.start_data, self.get_ring_buffer(session), **self.iterator_kwargs
+            ),
+        )
+
+    def process_batch(self, batch):
+        outputs = [[] for _ in batch]
+        # the outputs of a session go with its last input of the batch
+        last_inputs = {}
+        for i, audio_chunk in enumerate(batch):
+            session = self.session
+            if isinstance(audio_chunk, tuple):
+                session, _ = audio_chunk
+            else:
+                self.get_ring_buffer(session).write(audio_chunk)
+            last_inputs[session] = i
+        iterators = {
+            session: self.get_iterator(session) for session in last_inputs if not session.closed.is_set()
+        }
+
+        # an input may announce several windows, and a window may have been processed with a previous input
+        while True:
+            ready = [(session, iterator) for session, iterator in iterators.items() if iterator.has_window()]
+            if not ready:
+                break
+            for row, (_, iterator) in enumerate(ready):
+                iterator.next_window(out=self.engine.windows_array[row])
+            speech_probs = self.engine.infer([iterator.model.index for _, iterator in ready])
+            for (session, iterator), speech_prob in zip(ready, speech_probs):
+                vad_output = iterator.update(speech_prob, iterator.window_size_samples)
+                outputs[last_inputs[session]].extend(self.handle_window(session, iterator, vad_output))
+        return outputs
+
+    def handle_window(self, session, iterator, vad_output):
+        partial = iterator.pop_partial()
+        if partial is not None:
+            # provisional audio of the utterance being spoken, it takes the index the utterance will get
+            yield session.start_data.peek_data(partial, "user_audio").add_data(True, "is_partial")
+        speculative = iterator.pop_speculative()
+        if speculative is not None:
+            # probable end of speech: start working on the utterance, the results are held until it is committed
+            array, speculation = speculative
+            logger.debug("VAD: probable end of speech detected")
+            array = self.prepare_utterance(array)
+            if array is None:
+                iterator.reject_speculative()
+            else:
+                utterance = self.start_utterance(session, array)
+                yield utterance.add_data(speculation, "speculation")
         if vad_output is not None and len(vad_output) != 0:
             logger.debug("VAD: end of speech detected")
-            array = torch.cat(vad_output).cpu().numpy()
-            duration_ms = len(array) / self.sample_rate * 1000
-            if duration_ms < self.min_speech_ms or duration_ms > self.max_speech_ms:
-                logger.debug(
-                    f"audio input of duration: {len(array) / self.sample_rate}s, skipping"
+            array = self.prepare_utterance(vad_output)
+            if array is not None:
+                yield self.start_utterance(session, array)
+
+    def start_utterance(self, session, array):
+        return cancellation.start(tracing.start_timeline(session.start_data.add_data(array, "user_audio")))
+
+    def prepare_utterance(self, array):
+        """Returns the audio of the utterance, or None if its duration is out of bounds."""
+        duration_ms = len(array) / self.sample_rate * 1000
+        if duration_ms < self.min_speech_ms or duration_ms > self.max_speech_ms:
+            logger.debug(
+                f"audio input of duration: {len(array) / self.sample_rate}s, skipping"
+            )
+            return None
+        if self.should_listen is not None:
+            self.should_listen.clear()
+        logger.debug("Stop listening")
+        if self.audio_enhancement:
+            if self.sample_rate != self.df_state.sr():
+                audio_float32 = torchaudio.functional.resample(
+                    torch.from_numpy(array),
+                    orig_freq=self.sample_rate,
+                    new_freq=self.df_state.sr(),
+                )
+                enhanced = enhance(
+                    self.enhanced_model,
+                    self.df_state,
+                    audio_float32.unsqueeze(0),
+                )
+                enhanced = torchaudio.functional.resample(
+                    enhanced,
+                    orig_freq=self.df_state.sr(),
+                    new_freq=self.sample_rate,
                 )
             else:
-                if self.should_listen is not None:
-                    self.should_listen.clear()
-                logger.debug("Stop listening")
-                if self.audio_enhancement:
-                    if self.sample_rate != self.df_state.sr():
-                        audio_float32 = torchaudio.functional.resample(
-                            torch.from_numpy(array),
-                            orig_freq=self.sample_rate,
-                            new_freq=self.df_state.sr(),
-                        )
-                        enhanced = enhance(
-                            self.enhanced_model,
-                            self.df_state,
-                            audio_float32.unsqueeze(0),
-                        )
-                        enhanced = torchaudio.functional.resample(
-                            enhanced,
-                            orig_freq=self.df_state.sr(),
-                            new_freq=self.sample_rate,
-                        )
-                    else:
-                        enhanced = enhance(
-                            self.enhanced_model, self.df_state, audio_float32
-                        )
-                    array = enhanced.numpy().squeeze()
-                yield self.start_data.add_data(array, "user_audio")
+                enhanced = enhance(
+                    self.enhanced_model, self.df_state, torch.from_numpy(array)
+                )
+            array = enhanced.numpy().squeeze()
+        return array
 
     @property
     def min_time_to_debug(self):
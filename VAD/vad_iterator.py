@@ -1,20 +1,29 @@
+import logging
+
+import numpy as np
 import torch
 from utils.data import ImmutableDataChain
-from connections.socket_sender import logger
+from utils.ring_buffer import AudioRingBuffer
+from utils.speculation import Speculation
 from queue import Queue
 
+logger = logging.getLogger(__name__)
+
 
 class VADIterator:
     def __init__(
         self,
         model,
         start_data: ImmutableDataChain,
+        ring_buffer: AudioRingBuffer,
         threshold: float = 0.5,
         sampling_rate: int = 16000,
         min_silence_duration_ms: int = 100,
         speech_pad_ms: int = 30,
         interruption_request_queue: Queue= None,
         min_speech_ms: int = 1000,
+        partial_interval_ms: int = 0,
+        speculative: bool = False,
     ):
         """
         Mainly taken from https://github.com/snakers4/silero-vad
@@ -24,6 +33,14 @@ class VADIterator:
         ----------
         model: preloaded .jit/.onnx silero VAD model
 
+        start_data: ImmutableDataChain
+            Root of the session chain (see utils.session.Session), utterances are added to it as "user_audio"
+
+        ring_buffer: AudioRingBuffer
+            int16 audio of the session. Windows are read from it with next_window, and instead of copying the
+            speech windows the iterator keeps the sample positions of the speech, so an utterance is read from
+            the ring as one contiguous slice (short pauses inside of it included)
+
         threshold: float (default - 0.5)
             Speech threshold. Silero VAD outputs speech probabilities for each audio chunk, probabilities ABOVE this value are considered as SPEECH.
             It is better to tune this parameter for each dataset separately, but "lazy" 0.5 is pretty good for most datasets.
@@ -36,17 +53,27 @@ class VADIterator:
 
         speech_pad_ms: int (default - 30 milliseconds)
             Final speech chunks are padded by speech_pad_ms each side
+
+        partial_interval_ms: int (default - 0)
+            While speech goes on, every partial_interval_ms of new speech the buffered audio is made available
+            through pop_partial for a partial transcription. 0 disables partials
+
+        speculative: bool (default - False)
+            As soon as the speech probability drops (start of the silence timer), the buffered speech is made available
+            through pop_speculative together with a Speculation. The speculation is committed if the silence lasts
+            min_silence_duration_ms, then no utterance is returned at the end of speech. If the user goes on
+            speaking, it is cancelled and an interruption request drops the speculative utterance downstream
         """
 
         self.model = model
         self.start_data = start_data
+        self.ring_buffer = ring_buffer
         self.threshold = threshold
         self.sampling_rate = sampling_rate
         self.is_speaking = False
-        self.speech_start_sample = 0
-        self.buffer = []
         self.interruption_request_queue = interruption_request_queue
         self.min_speech_ms = min_speech_ms
+        self.speculative = speculative
 
         if sampling_rate not in [8000, 16000]:
             raise ValueError(
@@ -57,21 +84,69 @@ class VADIterator:
 
         self.min_silence_samples = sampling_rate * min_silence_duration_ms / 1000
         self.speech_pad_samples = sampling_rate * speech_pad_ms / 1000
+        self.partial_interval_samples = sampling_rate * partial_interval_ms / 1000
+        # silero models take windows of fixed size, converted to float32 in place
+        self.window_size_samples = 512 if sampling_rate == 16000 else 256
+        self.window = np.zeros(self.window_size_samples, dtype=np.float32)
+        self.window_tensor = torch.from_numpy(self.window)
         self.reset_states()
 
     def reset_states(self):
         self.model.reset_states()
         self.triggered = False
         self.temp_end = 0
-        self.current_sample = 0
+        self.current_sample = self.ring_buffer.oldest_sample
+        self.speech_start_sample = 0
+        self.speech_end_sample = 0
         self.samples_in_buffer = 0
         self.event_set = False
+        self.samples_at_last_partial = 0
+        self.partial_ready = False
+        self.speculation = None
+        self.speculative_ready = False
+
+    def close(self):
+        """Cancels the pending speculation and frees the model state, called when the session is closed."""
+        if self.speculation is not None:
+            self.speculation.cancel()
+            self.speculation = None
+        if hasattr(self.model, "close"):
+            self.model.close()
+
+    def request_interruption(self):
+        """Asks to drop everything downstream that belongs to the previous utterances of the session."""
+        session = self.start_data.get("session")
+        self.interruption_request_queue.put((session.session_id, self.start_data.get_counter("session")))
+
+    def has_window(self):
+        return self.current_sample + self.window_size_samples <= self.ring_buffer.samples_written
+
+    def next_window(self, out=None):
+        """
+        Converts the next unprocessed window of the ring buffer into `out` (e.g. a row of a BatchedVAD batch),
+        by default into self.window, which is returned as a tensor.
+        """
+        oldest_sample = self.ring_buffer.oldest_sample
+        if self.current_sample < oldest_sample:
+            logger.warning(f"VAD is {oldest_sample - self.current_sample} samples behind the ring buffer, skipping them")
+            self.current_sample = oldest_sample
+        window = self.window if out is None else out
+        self.ring_buffer.read_float(self.current_sample, self.current_sample + self.window_size_samples, out=window)
+        return self.window_tensor if out is None else out
+
+    def read_speech(self):
+        """float32 audio of the speech detected so far, copied out of the ring buffer."""
+        start = self.speech_start_sample
+        if start < self.ring_buffer.oldest_sample:
+            logger.warning("Utterance is longer than the ring buffer, its beginning is lost")
+            start = self.ring_buffer.oldest_sample
+        return self.ring_buffer.read_float(start, self.speech_end_sample)
 
     @torch.no_grad()
     def __call__(self, x):
         """
         x: torch.Tensor
-            audio chunk (see examples in repo)
+            the window of audio starting at current_sample, returned by next_window
 
         return_seconds: bool (default - False)
             whether return timestamps in seconds (default - samples)
@@ -84,38 +159,90 @@ class VADIterator:
                 raise TypeError("Audio cannot be casted to tensor. Cast it manually")
 
         window_size_samples = len(x[0]) if x.dim() == 2 else len(x)
-        self.current_sample += window_size_samples
-
         speech_prob = self.model(x, self.sampling_rate).item()
+        return self.update(speech_prob, window_size_samples)
+
+    def update(self, speech_prob, window_size_samples):
+        """
+        Advances by one window of the given speech probability (computed by __call__ or by a batched model).
+        Returns the audio of the utterance at the end of speech, else None.
+        """
+        self.current_sample += window_size_samples
 
         if (speech_prob >= self.threshold) and self.temp_end:#чел говорит, сдвигаем таймер времени с момента окончания речи
             self.temp_end = 0
+            if self.speculation is not None:#чел продолжил говорить, отменяем спекулятивную фразу
+                self.speculation.cancel()
+                self.speculation = None
+                self.speculative_ready = False
+                self.request_interruption()
 
         if (speech_prob >= self.threshold) and not self.triggered:#чел начал говорить
             self.triggered = True
             self.event_set = False
+            self.speech_start_sample = self.current_sample - window_size_samples
+            self.speech_end_sample = self.current_sample
+            self.samples_in_buffer = window_size_samples
             return None
 
         if self.triggered and (self.samples_in_buffer / self.sampling_rate * 1000)  >= self.min_speech_ms and not self.event_set:
-            self.interruption_request_queue.put(self.start_data.get_counter())
+            self.request_interruption()
             self.event_set = True
 
         if (speech_prob < self.threshold - 0.15) and self.triggered:#чел вроде закончил говорить
             if not self.temp_end:
                 self.temp_end = self.current_sample #запоминаем время, когда он закончил говорить
+                if self.speculative and self.speculation is None:
+                    self.speculation = Speculation()
+                    self.speculative_ready = True
             if self.current_sample - self.temp_end < self.min_silence_samples:
                 return None #если он не так много молчал, то ничего не возвращаем пока что
             else:
                 # end of speak тут он уже долго молчит
                 self.temp_end = 0
                 self.triggered = False
-                spoken_utterance = self.buffer
-                self.buffer = []
                 self.samples_in_buffer = 0
-                return spoken_utterance
+                self.samples_at_last_partial = 0
+                self.partial_ready = False
+                speculation, self.speculation = self.speculation, None
+                self.speculative_ready = False
+                if speculation is not None and not speculation.cancelled:
+                    speculation.commit() #спекулятивная фраза уже отправлена, подтверждаем её
+                    return None
+                return self.read_speech()
 
         if self.triggered:
-            self.buffer.append(x)
-            self.samples_in_buffer+=window_size_samples
+            self.speech_end_sample = self.current_sample
+            self.samples_in_buffer = self.speech_end_sample - self.speech_start_sample
+            if self.partial_interval_samples and self.samples_in_buffer - self.samples_at_last_partial >= self.partial_interval_samples:
+                self.samples_at_last_partial = self.samples_in_buffer
+                self.partial_ready = True
 
         return None
+
+    def pop_partial(self):
+        """
+        Returns the speech buffered so far if a partial transcription is due, else None.
+        """
+        if not self.partial_ready:
+            return None
+        self.partial_ready = False
+        return self.read_speech()
+
+    def pop_speculative(self):
+        """
+        Returns the speech buffered so far and its Speculation if the silence timer has just started, else None.
+        """
+        if not self.speculative_ready:
+            return None
+        self.speculative_ready = False
+        return self.read_speech(), self.speculation
+
+    def reject_speculative(self):
+        """
+        Cancels the speculation returned by pop_speculative when its speech was not dispatched (too short or too
+        long): nothing was started, so speech resuming after it must not interrupt the reply.
+        """
+        if self.speculation is not None:
+            self.speculation.cancel()
+            self.speculation = None
@@ -14,3 +14,15 @@ class MMSTTSHandlerArguments:
             "help": "The name of the TTS model to be used. Default is 'facebook/mms-tts-rus'."
         },
     )
+    mms_tts_cache_mb: float = field(
+        default=64,
+        metadata={
+            "help": "Size in MB of the in-memory cache of synthesized phrases, replayed instead of synthesized again. 0 disables it, the on-disk store included. Default is 64."
+        },
+    )
+    mms_tts_cache_dir: str = field(
+        default=None,
+        metadata={
+            "help": "Directory of the on-disk store of the phrase cache, kept between runs. Default is None (memory only)."
+        },
+    )
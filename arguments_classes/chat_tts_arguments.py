@@ -16,6 +16,6 @@ class ChatTTSHandlerArguments:
     chat_tts_chunk_size: int = field(
         default=512,
         metadata={
-            "help": "Sets the size of the audio data chunk processed per cycle, balancing playback latency and CPU load.. Default is 512。."
+            "help": "Not used, the audio is cut into frames of 512 samples by the SessionPlayout of the session. Default is 512."
         },
     )
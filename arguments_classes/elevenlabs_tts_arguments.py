@@ -26,3 +26,21 @@ class ElevenLabsTTSHandlerArguments:
             "help": "Модель TTS для генерации речи. По умолчанию 'eleven_turbo_v2_5'."
         },
     )
+    elevenlabs_tts_cache_mb: float = field(
+        default=64,
+        metadata={
+            "help": "Size in MB of the in-memory cache of synthesized phrases, replayed instead of synthesized again. 0 disables it, the on-disk store included. Default is 64."
+        },
+    )
+    elevenlabs_tts_cache_dir: str = field(
+        default=None,
+        metadata={
+            "help": "Directory of the on-disk store of the phrase cache, kept between runs. Default is None (memory only)."
+        },
+    )
+    elevenlabs_tts_stream_url: str = field(
+        default="wss://api.elevenlabs.io",
+        metadata={
+            "help": "Websocket URL of the stream-input API used by --tts elevenlabsStreamTTS, e.g. ws://localhost:8765 for the stand-in server of TTS/stream_input_server.py."
+        },
+    )
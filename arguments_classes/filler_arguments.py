@@ -25,6 +25,42 @@ class FillerHandlerArguments:
     filler_device: str = field(
         default="cuda",
         metadata={
-            "help": "Is not using just now"
+            "help": "Device of the filler_embedding_model, if any."
         },
-    )
\ No newline at end of file
+    )
+    filler_bank_path: str = field(
+        default="data/filler_data/filler_bank.pcm",
+        metadata={
+            "help": "File of the int16 PCM audio of all the fillers, decoded from the audio files at startup when they changed."
+        },
+    )
+    filler_blocksize: int = field(
+        default=512,
+        metadata={
+            "help": "Number of samples of the audio chunks the fillers are streamed in. Default is 512."
+        },
+    )
+    filler_selection: str = field(
+        default="embedding",
+        metadata={
+            "help": "How the filler is chosen: 'embedding' picks the filler whose text or contexts in the description JSON are closest in meaning to the transcription (filler_embedding_model), 'ngram' the one sharing the most character n-grams with it (closest spelling, no model, under a millisecond per turn), 'random' picks any. Default is 'embedding'."
+        },
+    )
+    filler_embedding_model: Optional[str] = field(
+        default="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
+        metadata={
+            "help": "transformers sentence encoder embedding the texts for the 'embedding' selection, run on filler_device. Default is 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2' (multilingual)."
+        },
+    )
+    filler_min_score: float = field(
+        default=0.2,
+        metadata={
+            "help": "Cosine similarity the closest filler must reach to be chosen over a random one. Default is 0.2."
+        },
+    )
+    filler_score_margin: float = field(
+        default=0.05,
+        metadata={
+            "help": "Fillers scoring within this margin of the best one are drawn at random among. Default is 0.05."
+        },
+    )
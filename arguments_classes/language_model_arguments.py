@@ -69,3 +69,9 @@ class LanguageModelHandlerArguments:
             "help": "Number of interactions assitant-user to keep for the chat. None for no limitations."
         },
     )
+    lm_clause_min_words: int = field(
+        default=0,
+        metadata={
+            "help": "When streaming, also cut a sentence for the TTS after a comma, semicolon or colon once it has at least this many words, so that the first audio starts sooner. Default is 0 (cut at sentence ends only)."
+        },
+    )
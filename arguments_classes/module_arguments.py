@@ -29,13 +29,31 @@ class ModuleArguments:
     llm: Optional[str] = field(
         default="transformers",
         metadata={
-            "help": "The LLM to use. Either 'transformers' or 'mlx-lm'. Default is 'transformers'"
+            "help": "The LLM to use. Either 'transformers', 'mlx-lm', 'open_api' or 'open_api_async'. Default is 'transformers'"
         },
     )
     tts: Optional[str] = field(
         default="parler",
         metadata={
-            "help": "The TTS to use. Either 'parler', 'melo', or 'chatTTS'. Default is 'parler'"
+            "help": "The TTS to use. Either 'parler', 'melo', 'chatTTS', 'MMSTTS', 'openaiTTS', 'elevenlabsTTS' or 'elevenlabsStreamTTS'. Default is 'parler'"
+        },
+    )
+    tts_lookahead: int = field(
+        default=2,
+        metadata={
+            "help": "Number of sentences the TTS handlers synthesizing one sentence at a time (parler, melo, chatTTS, MMSTTS, openaiTTS) may synthesize ahead of the one being played. Default is 2."
+        },
+    )
+    tts_prefetch_mb: float = field(
+        default=16,
+        metadata={
+            "help": "Size of the audio synthesized ahead and not played yet over all the sessions, in MB, past which no more sentences are started ahead of the one being played. Default is 16."
+        },
+    )
+    queue_limits: str = field(
+        default="recv_audio_chunks_queue=512:coalesce",
+        metadata={
+            "help": "Capacity and policy of the pipeline queues when full, as 'name=capacity[:policy],...' with the policy 'block' (default), 'drop_oldest' or 'coalesce' (an announcement of received audio replaces the queued one of its session). Queues not listed are unbounded. Default is 'recv_audio_chunks_queue=512:coalesce'."
         },
     )
     log_level: str = field(
@@ -44,3 +62,27 @@ class ModuleArguments:
             "help": "Provide logging level. Example --log_level debug, default=warning."
         },
     )
+    trace_file: Optional[str] = field(
+        default=None,
+        metadata={
+            "help": "If specified, the timeline of every utterance (end of speech, STT, filler, LLM first token and sentence, TTS first byte, first byte sent) is written to this file. Default is None."
+        },
+    )
+    trace_format: str = field(
+        default="jsonl",
+        metadata={
+            "help": "Format of --trace_file: 'jsonl' (one utterance per line, times in ms since the end of speech) or 'chrome' (trace event format for chrome://tracing or ui.perfetto.dev). Default is 'jsonl'."
+        },
+    )
+    metrics_port: Optional[int] = field(
+        default=None,
+        metadata={
+            "help": "If specified, serves Prometheus metrics (queue depths, items and processing times of the handlers, executor utilisation, interruptions) on http://metrics_host:metrics_port/metrics. Default is None."
+        },
+    )
+    metrics_host: str = field(
+        default="0.0.0.0",
+        metadata={
+            "help": "Host the metrics endpoint binds to. Default is '0.0.0.0'."
+        },
+    )
@@ -60,4 +60,22 @@ class OpenApiLanguageModelHandlerArguments:
             "help": "The stream parameter typically indicates whether data should be transmitted in a continuous flow rather"
                     " than in a single, complete response, often used for handling large or real-time data.Default is False"
         },
-    )
\ No newline at end of file
+    )
+    open_api_clause_min_words: int = field(
+        default=0,
+        metadata={
+            "help": "When streaming, also cut a sentence for the TTS after a comma, semicolon or colon once it has at least this many words, so that the first audio starts sooner. Default is 0 (cut at sentence ends only)."
+        },
+    )
+    open_api_max_connections: int = field(
+        default=16,
+        metadata={
+            "help": "Size of the HTTP connection pool, i.e. the maximum number of completions streamed at the same time. Default is 16."
+        },
+    )
+    open_api_http2: bool = field(
+        default=False,
+        metadata={
+            "help": "Use HTTP/2 when the server supports it (opt-in), so that concurrent completions share one connection (needs httpx[http2], HTTP/1.1 is used without it). Default is False."
+        },
+    )
@@ -19,4 +19,22 @@ class OpenAITTSHandlerArguments:
         metadata={
             "help": "Голосовая модель для TTS. По умолчанию 'alloy'."
         },
-    )
\ No newline at end of file
+    )
+    openai_tts_model: str = field(
+        default="tts-1",
+        metadata={
+            "help": "Модель OpenAI TTS, также входит в ключ кэша фраз. По умолчанию 'tts-1'."
+        },
+    )
+    openai_tts_cache_mb: float = field(
+        default=64,
+        metadata={
+            "help": "Size in MB of the in-memory cache of synthesized phrases, replayed instead of synthesized again. 0 disables it, the on-disk store included. Default is 64."
+        },
+    )
+    openai_tts_cache_dir: str = field(
+        default=None,
+        metadata={
+            "help": "Directory of the on-disk store of the phrase cache, kept between runs. Default is None (memory only)."
+        },
+    )
@@ -0,0 +1,36 @@
+from dataclasses import dataclass, field
+from typing import Optional
+
+
+@dataclass
+class SessionManagerArguments:
+    max_sessions: int = field(
+        default=16,
+        metadata={
+            "help": "Maximum number of clients served at the same time by one set of models. Further connections are refused. Default is 16."
+        },
+    )
+    session_handler_threads: int = field(
+        default=4,
+        metadata={
+            "help": "Number of worker threads of the shared language model handler (and of the openaiTTS synthesis), so that sessions do not wait for each other's answers. Default is 4."
+        },
+    )
+    ws_host: str = field(
+        default="0.0.0.0",
+        metadata={
+            "help": "The host IP address the WebSocket transport listens on. Default is '0.0.0.0'."
+        },
+    )
+    ws_port: Optional[int] = field(
+        default=None,
+        metadata={
+            "help": "Port of the WebSocket transport, where a client sends and receives audio over one connection with framed messages (see listen_and_play.py --transport websocket). Disabled by default."
+        },
+    )
+    ws_opus_bitrate: int = field(
+        default=24000,
+        metadata={
+            "help": "Bitrate in bit/s of the audio sent to the WebSocket clients asking for Opus, unless they ask for another one. Default is 24000."
+        },
+    )
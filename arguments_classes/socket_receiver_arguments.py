@@ -22,3 +22,10 @@ class SocketReceiverArguments:
             "help": "The size of each data chunk to be sent or received over the socket. Default is 1024 bytes."
         },
     )
+    recv_buffer_s: float = field(
+        default=60,
+        metadata={
+            "help": "Duration in seconds of the preallocated ring buffer each client's audio is received into. "
+            "Utterances longer than that lose their beginning. Default is 60 seconds."
+        },
+    )
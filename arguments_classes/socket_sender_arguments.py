@@ -16,3 +16,15 @@ class SocketSenderArguments:
             "help": "The port number on which the socket server listens. Default is 12346."
         },
     )
+    send_buffer_s: float = field(
+        default=0.1,
+        metadata={
+            "help": "Audio sent ahead of what the client plays, in seconds. Grown when the audio of an utterance comes late and shrunk back once it is steady. Default is 0.1."
+        },
+    )
+    send_max_buffer_s: float = field(
+        default=0.5,
+        metadata={
+            "help": "Upper bound of the audio sent ahead of what the client plays, in seconds. Default is 0.5."
+        },
+    )
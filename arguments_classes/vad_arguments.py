@@ -45,3 +45,33 @@ class VADHandlerArguments:
             "help": "improves sound quality by applying techniques like noise reduction, equalization, and echo cancellation. Default is False."
         },
     )
+    partial_interval_ms: int = field(
+        default=0,
+        metadata={
+            "help": "While the user is speaking, send the audio buffered so far for a partial transcription every partial_interval_ms of speech, so that the final transcription only decodes the tail. Measured in milliseconds. Default is 0 (disabled)."
+        },
+    )
+    speculative: bool = field(
+        default=False,
+        metadata={
+            "help": "Start STT and LLM on the utterance as soon as the silence begins instead of after min_silence_ms. If the user goes on speaking, the speculative work is dropped, otherwise its results are played. Default is False."
+        },
+    )
+    vad_backend: str = field(
+        default="torch",
+        metadata={
+            "help": "Runtime of the Silero VAD model: 'torch' loads it with torch.hub (downloaded at startup), 'onnx' runs the ONNX export from --vad_onnx_model_path with ONNX Runtime. Default is 'torch'."
+        },
+    )
+    vad_onnx_model_path: str = field(
+        default=None,
+        metadata={
+            "help": "Local path of silero_vad.onnx (Silero VAD v5), used by the 'onnx' backend. Default is None."
+        },
+    )
+    vad_intra_op_threads: int = field(
+        default=1,
+        metadata={
+            "help": "Number of CPU threads ONNX Runtime uses for the VAD model with the 'onnx' backend. Default is 1."
+        },
+    )
@@ -28,6 +28,18 @@ class WhisperSTTHandlerArguments:
             "help": "Compile mode for torch compile. Either 'default', 'reduce-overhead' and 'max-autotune'. Default is None (no compilation)"
         },
     )
+    stt_max_batch_size: int = field(
+        default=1,
+        metadata={
+            "help": "Maximum number of utterances (e.g. from different sessions) transcribed by one generate call. Default is 1 (no batching)."
+        },
+    )
+    stt_batch_window_ms: float = field(
+        default=20,
+        metadata={
+            "help": "How long to wait for more utterances to join a batch, bounding the latency added by batching. Measured in milliseconds. Default is 20 ms."
+        },
+    )
     stt_gen_max_new_tokens: int = field(
         default=128,
         metadata={
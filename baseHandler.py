@@ -5,6 +5,8 @@ import threading
 from queue import Queue
 from collections import deque  # Added for efficient buffer management
 import concurrent.futures
+from utils.session import get_session_id
+from utils import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +17,8 @@ class BaseHandler:
     To stop a handler properly, set the stop_event and, to avoid queue deadlocks, place b"END" in the input queue.
     Objects placed in the input queue will be processed by the `process` method, and the yielded results will be placed in the output queue.
     The cleanup method handles stopping the handler, and b"END" is placed in the output queue.
+    With threads=0 the handler has no executor and is not run, only its process is called by another handler
+    (e.g. the TTS backend of LookaheadTTSHandler).
     """
 
     def __init__(self, stop_event, queue_in, queue_out, threads=1, setup_args=(), setup_kwargs={}):
@@ -25,11 +29,16 @@ class BaseHandler:
         self._times = []
         self.threads = threads
 
-        self.writer_id_counter = 0                                  # Counter for assigning sequence numbers to requests
-        self.next_write_sequence = 0                                # Next sequence number that should write to the output queue
+        # Output order is kept per session, so that sessions sharing the handler do not wait for each other.
+        # The entries of a session are dropped once all its requests are written (closed sessions included),
+        # its next request starts again from 0
+        self.writer_id_counters = {}                                # Counters for assigning sequence numbers to requests
+        self.next_write_sequences = {}                              # Next sequence number that should write to the output queue
 
-        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads) if threads else None
         self.condition = threading.Condition()
+        if threads:
+            metrics.handler_threads.inc(threads, handler=self.__class__.__name__)
 
     def setup(self, *args, **kwargs):
         pass
@@ -45,15 +54,19 @@ class BaseHandler:
                 logger.debug("Stopping thread")
                 break
 
-            writer_id = self.writer_id_counter #Writer
-            self.writer_id_counter += 1
-            self.executor.submit(self.process_and_write, input_data, writer_id)
+            metrics.handler_inputs.inc(handler=self.__class__.__name__)
+            session_id = get_session_id(input_data)
+            with self.condition:
+                writer_id = self.writer_id_counters.get(session_id, 0) #Writer
+                self.writer_id_counters[session_id] = writer_id + 1
+            self.executor.submit(self.process_and_write, input_data, writer_id, session_id)
 
         self.executor.shutdown(wait=True)
+        metrics.handler_threads.dec(self.threads, handler=self.__class__.__name__)
         self.cleanup()
         self.queue_out.put(b"END")
 
-    def process_and_write(self, input_data, writer_id):
+    def process_and_write(self, input_data, writer_id, session_id=None):
 
         logger.debug(
             f"{self.__class__.__name__} [{writer_id}]: Started")
@@ -62,6 +75,8 @@ class BaseHandler:
         first_chunk_time = None                     # Время получения первого чанка
         last_chunk_time = None                      # Время получения последнего чанка
         buffer = deque()  # Internal buffer for storing chunks
+        handler = self.__class__.__name__
+        metrics.add_busy_thread(handler)
 
         try:
 
@@ -69,16 +84,18 @@ class BaseHandler:
             for chunk in self.process(input_data):
 
                 current_time = perf_counter()
+                metrics.handler_outputs.inc(handler=handler)
 
                 if first_chunk_time is None:
                     first_chunk_time = current_time
                     total_time_first_chunk = first_chunk_time - start_time
+                    metrics.handler_first_chunk_seconds.observe(total_time_first_chunk, handler=handler)
                     if total_time_first_chunk > self.min_time_to_debug:
                         logger.debug(
                             f"{self.__class__.__name__} [{writer_id}]: First chunk after {total_time_first_chunk:.3f} s")
 
                 with self.condition:
-                    if writer_id == self.next_write_sequence:
+                    if writer_id == self.next_write_sequences.get(session_id, 0):
                         while buffer:
                             self.queue_out.put(buffer.popleft())
                         self.queue_out.put(chunk)
@@ -87,12 +104,13 @@ class BaseHandler:
 
             last_chunk_time = perf_counter()
             total_time_all_chunks = last_chunk_time - start_time
+            metrics.handler_process_seconds.observe(total_time_all_chunks, handler=handler)
             if total_time_all_chunks > self.min_time_to_debug:
                 logger.debug(f"{self.__class__.__name__} [{writer_id}]: All chunks after {total_time_all_chunks:.3f} s")
             #Получили все данные, но ждём очереди записи.
             if buffer:
                 with self.condition:
-                    self.condition.wait_for(lambda: self.next_write_sequence == writer_id)
+                    self.condition.wait_for(lambda: self.next_write_sequences.get(session_id, 0) == writer_id)
                 while buffer:
                     self.queue_out.put(buffer.popleft())
 
@@ -103,8 +121,14 @@ class BaseHandler:
             self.queue_out.put(b"END")
 
         with self.condition:
-            self.next_write_sequence += 1
+            if self.writer_id_counters.get(session_id) == writer_id + 1:
+                # last request of the session written, nobody waits for its turn
+                del self.writer_id_counters[session_id]
+                self.next_write_sequences.pop(session_id, None)
+            else:
+                self.next_write_sequences[session_id] = writer_id + 1
             self.condition.notify_all()  # Уведомляем все потоки о том, что переменная изменилась
+        metrics.add_busy_thread(handler, -1)
 
     @property
     def last_time(self):
@@ -0,0 +1,86 @@
+from time import perf_counter
+import logging
+from queue import Empty
+from baseHandler import BaseHandler
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class BatchingHandler(BaseHandler):
+    """
+    Base class for pipeline parts that are cheaper to run on several inputs at once (e.g. one `generate` call for
+    the utterances of several sessions).
+    After an input arrives, the handler waits at most `batch_window_ms` for more inputs (0 only takes the inputs
+    already queued), up to `max_batch_size`, and passes them together to `process_batch`, which returns, for each
+    input, the list of its outputs.
+    The outputs are put in the output queue in the order of the inputs, so the added latency is bounded by the
+    window plus one batched call. With `max_batch_size=1` the handler behaves as a BaseHandler with one thread.
+    """
+
+    batch_window_ms = 20
+    max_batch_size = 1
+
+    def process(self, input_data):
+        yield from self.process_batch([input_data])[0]
+
+    def process_batch(self, batch):
+        raise NotImplementedError
+
+    def collect_batch(self):
+        """Returns the next batch of inputs and whether b"END" was received."""
+        input_data = self.queue_in.get()
+        if isinstance(input_data, bytes) and input_data == b"END":
+            return [], True
+
+        batch = [input_data]
+        deadline = perf_counter() + self.batch_window_ms / 1000
+        while len(batch) < self.max_batch_size:
+            # after the window, inputs already waiting still join the batch (a timeout of 0 does not block)
+            timeout = max(deadline - perf_counter(), 0)
+            try:
+                input_data = self.queue_in.get(timeout=timeout)
+            except Empty:
+                break
+            if isinstance(input_data, bytes) and input_data == b"END":
+                return batch, True
+            batch.append(input_data)
+        return batch, False
+
+    def run(self):
+        while not self.stop_event.is_set():
+            batch, end = self.collect_batch()
+            metrics.handler_inputs.inc(len(batch), handler=self.__class__.__name__)
+            if batch:
+                self.process_and_write_batch(batch)
+            if end:
+                logger.debug("Stopping thread")
+                break
+
+        self.executor.shutdown(wait=True)
+        metrics.handler_threads.dec(self.threads, handler=self.__class__.__name__)
+        self.cleanup()
+        self.queue_out.put(b"END")
+
+    def process_and_write_batch(self, batch):
+        handler = self.__class__.__name__
+        start_time = perf_counter()
+        metrics.add_busy_thread(handler)
+        try:
+            outputs = self.process_batch(batch)
+        except Exception as e:
+            logger.error(f"Error in {self.__class__.__name__}: {e}")
+            self.stop_event.set()
+            self.queue_out.put(b"END")
+            return
+        finally:
+            metrics.add_busy_thread(handler, -1)
+
+        total_time = perf_counter() - start_time
+        metrics.handler_process_seconds.observe(total_time, handler=handler)
+        if total_time > self.min_time_to_debug:
+            logger.debug(f"{self.__class__.__name__}: batch of {len(batch)} after {total_time:.3f} s")
+        for output in outputs:
+            metrics.handler_outputs.inc(len(output), handler=handler)
+            for chunk in output:
+                self.queue_out.put(chunk)
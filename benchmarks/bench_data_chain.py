@@ -0,0 +1,47 @@
+"""
+Per-item overhead of ImmutableDataChain in the pipeline queues.
+
+For every item passed between the handlers, the handler adds its output to the chain, the FilteredQueue validates
+it (index of "user_audio" and session) and the next handler reads it back. This measures these operations for
+chains of realistic depth (the keys of a turn) and deeper ones.
+
+    python benchmarks/bench_data_chain.py
+"""
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.data import FilteredQueue
+from utils.session import Session, get_session_id
+
+TURN_KEYS = ["user_audio", "text", "start_phrase", "llm_sentence", "output_audio_iterator"]
+
+
+def build_turn(depth):
+    data = Session(1).start_data
+    keys = TURN_KEYS + [f"extra_{i}" for i in range(max(0, depth - len(TURN_KEYS)))]
+    for key in keys:
+        data = data.add_data(key, key)
+    return data
+
+
+def per_chunk(data, queue):
+    chunk = data.add_data(b"\x00" * 1024, "output_audio_chunk")
+    queue._validate_item(chunk)
+    get_session_id(chunk)
+    chunk.get_data()
+
+
+def main(number=20000, repeat=5):
+    queue = FilteredQueue()
+    print(f"{'depth':>6} {'per chunk (us)':>15}")
+    for depth in (5, 10, 20, 50):
+        data = build_turn(depth)
+        best = min(timeit.repeat(lambda: per_chunk(data, queue), number=number, repeat=repeat))
+        print(f"{depth:>6} {best / number * 1e6:>15.2f}")
+
+
+if __name__ == "__main__":
+    main()
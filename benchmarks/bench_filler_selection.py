@@ -0,0 +1,65 @@
+"""
+Latency of the filler selection of a turn, for the fillers of data/filler_data/description.json and a larger
+synthetic bank, and the filler chosen for a few utterances, with the 'ngram' selection (closest spelling) and,
+given --embedding_model, the 'embedding' one (closest meaning).
+
+    python benchmarks/bench_filler_selection.py --embedding_model sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2
+"""
+import argparse
+import json
+import sys
+import timeit
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from FILLER_GEN.filler_selector import FillerSelector, NgramEmbedder, TransformersEmbedder
+
+UTTERANCES = [
+    "Подскажите, пожалуйста, когда придёт мой заказ?",
+    "Какой тариф мне подойдёт, если я много звоню за границу?",
+    "Я третий раз звоню, деньги так и не вернули, сколько можно!",
+    "Запишите меня на пятницу на вечер.",
+    "У меня не получается войти в приложение, пишет ошибку.",
+]
+
+
+def bench(name, embedder, descriptions, synthetic, number):
+    print(f"{name}:")
+    print(f"{'fillers':>8} {'texts':>6} {'select (ms)':>12}")
+    for bank in (descriptions, synthetic):
+        selector = FillerSelector(bank, embedder)
+        seconds = min(
+            timeit.repeat(lambda: [selector.select(text) for text in UTTERANCES], number=number // 10, repeat=5)
+        )
+        print(f"{len(bank):>8} {len(selector.owners):>6} {seconds / (number // 10) / len(UTTERANCES) * 1000:>12.3f}")
+    selector = FillerSelector(descriptions, embedder)
+    for text in UTTERANCES:
+        scores = selector.scores(text)
+        best = int(scores.argmax())
+        print(f"{scores[best]:.2f} {descriptions[best]['text']:<25} <- {text}")
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--embedding_model", default=None)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--number", type=int, default=1000)
+    args = parser.parse_args()
+
+    descriptions = json.loads((ROOT / "data/filler_data/description.json").read_text(encoding="utf-8"))
+    synthetic = [
+        {"text": f"{item['text']} {i}", "contexts": [f"{context} {i}" for context in item.get("contexts", [])]}
+        for i in range(20)
+        for item in descriptions
+    ]
+    bench("ngram", NgramEmbedder(), descriptions, synthetic, args.number)
+    if args.embedding_model is not None:
+        # fewer rounds, an encoder call takes milliseconds
+        bench("embedding", TransformersEmbedder(args.embedding_model, args.device), descriptions, synthetic, 50)
+
+
+if __name__ == "__main__":
+    main()
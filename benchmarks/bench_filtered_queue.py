@@ -0,0 +1,99 @@
+"""
+Time of an interruption (FilteredQueue.filter) of one session while the queue holds N items of other sessions and
+of the interrupted session, and time of a put and a get, for N from 100 to 100000.
+filter only goes through the stale generations of the session, so its time does not grow with N.
+First checks that producers blocked on a full queue with the block policy do not hold up an interruption, and
+that a closed session leaves nothing in the index of the queue.
+
+    python benchmarks/bench_filtered_queue.py
+"""
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.data import FilteredQueue
+from utils.session import Session
+
+UTTERANCES = 4  # generations of the interrupted session in the queue
+
+
+def fill(queue, sessions, interrupted, n):
+    utterances = {session: [session.start_data.add_data(i, "user_audio") for i in range(UTTERANCES)] for session in sessions}
+    for i in range(n):
+        session = sessions[i % len(sessions)]
+        queue.put(utterances[session][i % UTTERANCES].add_data(i, "llm_sentence"))
+    # the utterance that interrupts the others
+    return interrupted.start_data.add_data(None, "user_audio").get_index("user_audio")
+
+
+def check_blocked_producers(producers=2):
+    """
+    Producers that found room in a queue of capacity 1 and race for it, the losers find the queue full under the
+    lock of the queue: an interruption (filter) must not wait for them, i.e. for a consumer.
+    """
+    queue = FilteredQueue("check", maxsize=1, policy="block")
+    session = Session(1)
+    data = session.start_data.add_data(None, "user_audio")
+    threads = [
+        threading.Thread(target=queue.put, args=(data.add_data(i, "llm_sentence"),), daemon=True)
+        for i in range(producers)
+    ]
+    with queue._put_lock:  # the producers all see the room, then wait for the lock
+        for thread in threads:
+            thread.start()
+        time.sleep(0.2)
+    time.sleep(0.2)
+    interruption = threading.Thread(target=queue.filter, args=(0, session.session_id), daemon=True)
+    interruption.start()
+    interruption.join(timeout=1)
+    assert not interruption.is_alive(), "filter waited for a blocked put"
+    received = [queue.get(timeout=1) for _ in range(producers)]
+    assert sorted(item.get("llm_sentence") for item in received) == list(range(producers))
+    print(f"{producers} producers racing for the room of a full queue: filter did not wait")
+
+
+def check_forget_session(items=100):
+    queue = FilteredQueue("check")
+    session, other = Session(1), Session(2)
+    fill(queue, [session, other], session, items)
+    queue.forget_session(session.session_id)
+    index = queue._queue
+    assert session.session_id not in index.indexes
+    assert not any(key[0] == session.session_id for key in index.generations), "generations of a closed session left"
+    received = [queue.get() for _ in range(items)]  # its items are still delivered
+    assert len(received) == items and not index.generations and not index.indexes
+    print("closed session: its generations are dropped from the index")
+
+
+def main():
+    check_blocked_producers()
+    check_forget_session()
+    print(f"{'items':>8} {'filter ms':>10} {'dropped':>8} {'put us':>8} {'get us':>8}")
+    for n in (100, 1000, 10000, 100000):
+        sessions = [Session(i) for i in range(16)]
+        queue = FilteredQueue("bench")
+        phrase_id = fill(queue, sessions, sessions[0], n)
+
+        before = queue.qsize()
+        start = time.perf_counter()
+        queue.filter(phrase_id, sessions[0].session_id)
+        filter_ms = (time.perf_counter() - start) * 1000
+        dropped = before - queue.qsize()
+
+        item = sessions[1].start_data.add_data(None, "user_audio")
+        start = time.perf_counter()
+        for _ in range(1000):
+            queue.put(item)
+        put_us = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        for _ in range(1000):
+            queue.get()
+        get_us = (time.perf_counter() - start) * 1000
+        print(f"{n:>8} {filter_ms:>10.3f} {dropped:>8} {put_us:>8.2f} {get_us:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
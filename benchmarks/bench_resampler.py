@@ -0,0 +1,79 @@
+"""
+Resampling of TTS output to 16 kHz, chunk by chunk as the TTS handlers stream it (chunks of CHUNK_S seconds):
+librosa.resample on every chunk (the previous approach of the handlers) against StreamingResampler.
+
+For 44.1, 24 and 22.05 kHz it prints the time to resample 10 s of audio, the latency of the first chunk (a new
+resampler per sentence) and the largest difference to resampling the whole signal at once, which is where the
+chunks of librosa are cut without the samples around their edges.
+It first checks that StreamingResampler gives the same output for any chunking, empty and 1-sample chunks included.
+
+    python benchmarks/bench_resampler.py
+"""
+import sys
+import timeit
+from pathlib import Path
+
+import librosa
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.resampler import StreamingResampler
+
+TARGET_SR = 16000
+CHUNK_S = 0.1
+DURATION_S = 10
+
+
+def signal(sample_rate):
+    t = np.arange(int(DURATION_S * sample_rate)) / sample_rate
+    return (0.5 * np.sin(2 * np.pi * 220 * t) + 0.2 * np.sin(2 * np.pi * 2500 * t)).astype(np.float32)
+
+
+def librosa_chunks(audio, sample_rate, chunk):
+    return np.concatenate(
+        [librosa.resample(audio[i : i + chunk], orig_sr=sample_rate, target_sr=TARGET_SR) for i in range(0, len(audio), chunk)]
+    )
+
+
+def streaming_chunks(audio, sample_rate, chunk):
+    resampler = StreamingResampler(sample_rate, TARGET_SR)
+    return np.concatenate([resampler.process(audio[i : i + chunk]) for i in range(0, len(audio), chunk)] + [resampler.flush()])
+
+
+def check_tiny_chunks():
+    for sample_rate in (44100, 24000, 22050):
+        audio = signal(sample_rate)[: sample_rate // 2]
+        whole = streaming_chunks(audio, sample_rate, len(audio))
+        resampler = StreamingResampler(sample_rate, TARGET_SR)
+        sizes = [0, 1, 0, 3, 2, 1] + [len(audio) // 2] + [0, 3, 2] + [1] * 200
+        output, position = [], 0
+        for size in sizes + [len(audio)]:
+            output.append(resampler.process(audio[position : position + size]))
+            position += size
+        output.append(resampler.flush())
+        assert np.allclose(np.concatenate(output), whole, atol=1e-5), sample_rate
+        assert StreamingResampler(sample_rate, TARGET_SR).process(np.zeros(0)).dtype == np.float32
+    print("empty and tiny chunks: same output as the whole signal")
+
+
+def main():
+    check_tiny_chunks()
+    print(f"{'rate':>6} {'method':<10} {'10 s (ms)':>10} {'x real time':>12} {'first chunk (ms)':>17} {'max edge error':>15}")
+    for sample_rate in (44100, 24000, 22050):
+        audio = signal(sample_rate)
+        chunk = int(CHUNK_S * sample_rate)
+        whole = librosa.resample(audio, orig_sr=sample_rate, target_sr=TARGET_SR)
+        for name, method in (("librosa", librosa_chunks), ("streaming", streaming_chunks)):
+            seconds = min(timeit.repeat(lambda: method(audio, sample_rate, chunk), number=1, repeat=5))
+            first = min(timeit.repeat(lambda: method(audio[:chunk], sample_rate, chunk), number=10, repeat=5)) / 10
+            output = method(audio, sample_rate, chunk)
+            error = np.abs(output[: len(whole)] - whole)[100:-100].max()
+            print(
+                f"{sample_rate:>6} {name:<10} {seconds * 1000:>10.1f} {DURATION_S / seconds:>12.0f} "
+                f"{first * 1000:>17.3f} {error:>15.5f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
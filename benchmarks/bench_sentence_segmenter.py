@@ -0,0 +1,77 @@
+"""
+Sentence splitting of a streamed LLM answer: nltk.sent_tokenize on the accumulated text after every token (the
+previous approach of the LLM handlers) against the incremental SentenceSegmenter.
+
+The answers are long English and Russian texts streamed in tokens of a few characters.
+
+    python benchmarks/bench_sentence_segmenter.py
+"""
+import sys
+import timeit
+from pathlib import Path
+
+from nltk import sent_tokenize
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from LLM.sentence_segmenter import SentenceSegmenter
+
+ENGLISH = (
+    "Sure, here is a short overview of the topic. The first thing to keep in mind is that latency adds up across "
+    "every stage of the pipeline, so a few milliseconds here and there matter. Dr. Smith measured it in 2023, "
+    "e.g. on a call center workload, and found that 3.5 seconds of silence is enough for callers to hang up! "
+    "Why does it happen? Mostly because people expect an answer as fast as a human would give it. "
+)
+RUSSIAN = (
+    "Конечно, вот краткий обзор темы. Прежде всего стоит помнить, что задержка складывается на каждом этапе "
+    "конвейера, поэтому важны даже несколько миллисекунд. А. С. Иванов измерил её в 2023 г. на нагрузке "
+    "колл-центра, т.е. на реальных звонках, и обнаружил, что 3,5 секунды тишины достаточно, чтобы человек положил "
+    "трубку! Почему так происходит? В основном потому, что люди ждут ответа так же быстро, как от человека. "
+)
+
+
+def stream(text, token_size=4):
+    return [text[i : i + token_size] for i in range(0, len(text), token_size)]
+
+
+def split_with_sent_tokenize(tokens, language):
+    sentences = []
+    printable_text = ""
+    for new_text in tokens:
+        printable_text += new_text
+        split = sent_tokenize(printable_text, language=language)
+        if len(split) > 1:
+            sentences.append(split[0])
+            printable_text = new_text
+    sentences.append(printable_text)
+    return sentences
+
+
+def split_with_segmenter(tokens, clause_min_words=0):
+    segmenter = SentenceSegmenter(clause_min_words)
+    sentences = []
+    for new_text in tokens:
+        sentences.extend(segmenter.feed(new_text))
+    sentences.append(segmenter.flush())
+    return sentences
+
+
+def main(number=3):
+    print(f"{'text':>8} {'chars':>7} {'sent_tokenize (ms)':>19} {'segmenter (ms)':>15} {'sentences':>10}")
+    for name, paragraph, language in (("english", ENGLISH, "english"), ("russian", RUSSIAN, "russian")):
+        for repeats in (1, 10, 40):
+            tokens = stream(paragraph * repeats)
+            nltk_time = min(timeit.repeat(lambda: split_with_sent_tokenize(tokens, language), number=1, repeat=number))
+            segmenter_time = min(timeit.repeat(lambda: split_with_segmenter(tokens), number=1, repeat=number))
+            n_sentences = len(split_with_segmenter(tokens))
+            print(
+                f"{name:>8} {len(paragraph) * repeats:>7} {nltk_time * 1000:>19.2f} {segmenter_time * 1000:>15.2f} {n_sentences:>10}"
+            )
+    print()
+    print("First sentences with clause_min_words=5:")
+    for sentence in split_with_segmenter(stream(RUSSIAN), clause_min_words=5)[:4]:
+        print(f"  {sentence}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Silence between the sentences of an answer played in real time, for a TTS synthesizing one sentence at a time
+(first audio after LATENCY_S, then REAL_TIME_FACTOR s of synthesis per s of audio), run by LookaheadTTSHandler
+with a look-ahead depth of 0 (a sentence is synthesized once the previous one is played) to 2, and the largest
+amount of audio waiting to be played with and without a small prefetch cap.
+
+    python benchmarks/bench_tts_lookahead.py
+"""
+import sys
+import threading
+import time
+from pathlib import Path
+from queue import Queue
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from TTS.lookahead_tts_handler import LookaheadTTSHandler
+from utils.session import Session
+
+SAMPLE_RATE = 16000
+CHUNK_S = 0.1
+LATENCY_S = 0.15
+REAL_TIME_FACTOR = 0.4
+SENTENCES = [f"Sentence number {i} of the answer." for i in range(6)]
+
+
+class SleepingTTS:
+    """Stands for a local TTS handler: process takes (sentence, language_code) and yields int16 chunks."""
+
+    def __init__(self, sentence_s):
+        self.sentence_s = sentence_s
+
+    def process(self, llm_sentence):
+        time.sleep(LATENCY_S)
+        for _ in range(round(self.sentence_s / CHUNK_S)):
+            time.sleep(CHUNK_S * REAL_TIME_FACTOR)
+            yield np.zeros(int(CHUNK_S * SAMPLE_RATE), dtype=np.int16)
+
+
+def play(depth, sentence_s=0.6, max_prefetch_mb=16):
+    stop_event = threading.Event()
+    queue_in, queue_out = Queue(), Queue()
+    handler = LookaheadTTSHandler(
+        stop_event, queue_in, queue_out, setup_args=(SleepingTTS(sentence_s),),
+        setup_kwargs={"depth": depth, "max_prefetch_mb": max_prefetch_mb},
+    )
+    thread = threading.Thread(target=handler.run)
+    thread.start()
+    data = Session(1).start_data.add_data(np.zeros(1), "user_audio")
+    for sentence in SENTENCES:
+        queue_in.put(data.add_data(sentence, "llm_sentence"))
+
+    gaps = []
+    peak = 0
+    played_until = None
+    for _ in SENTENCES:
+        iterator = queue_out.get().get("output_audio_iterator")
+        for position, chunk in enumerate(iterator):
+            if position == 0 and played_until is not None:
+                gaps.append(max(0.0, time.perf_counter() - played_until))
+            peak = max(peak, handler.budget.used + chunk.nbytes)
+            time.sleep(len(chunk) / SAMPLE_RATE)  # playback
+            played_until = time.perf_counter()
+    queue_in.put(b"END")
+    thread.join()
+    return gaps, peak
+
+
+def main():
+    print(f"{'depth':>5} {'mean gap (ms)':>14} {'max gap (ms)':>13} {'peak prefetch (KB)':>19}")
+    for depth in (0, 1, 2):
+        gaps, peak = play(depth)
+        print(f"{depth:>5} {np.mean(gaps) * 1000:>14.0f} {np.max(gaps) * 1000:>13.0f} {peak / 1024:>19.1f}")
+    # a cap of 20 KB (0.6 s of audio) holds back the sentences after the one being played
+    gaps, peak = play(2, max_prefetch_mb=20 / 1024)
+    print(f"{'2, cap':>5} {np.mean(gaps) * 1000:>14.0f} {np.max(gaps) * 1000:>13.0f} {peak / 1024:>19.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Throughput of the Silero VAD backends, in 512-sample windows per second and per CPU core.
+
+Both backends run through BatchedVAD as VADHandler does, with `batch` sessions stepping together. The torch
+backend uses torch's intra-op threads (torch.get_num_threads(), or --torch_threads), the onnx one the given
+number of ONNX Runtime threads.
+
+    python benchmarks/bench_vad.py --onnx_model_path silero_vad.onnx --threads 1 --batch_sizes 1 8 32
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import torch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from VAD.batched_vad import SILERO_VAD_REPO, BatchedVAD
+
+
+def measure(engine, batch_size, seconds):
+    slots = [engine.allocate() for _ in range(batch_size)]
+    indexes = [slot.index for slot in slots]
+    engine.windows[:batch_size] = torch.randn(batch_size, engine.window_size_samples) * 0.1
+    engine.infer(indexes)  # warmup
+    steps = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        engine.infer(indexes)
+        steps += 1
+    elapsed = time.perf_counter() - start
+    for slot in slots:
+        slot.close()
+    return steps * batch_size / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--onnx_model_path", default=None, help="silero_vad.onnx, the onnx backend is skipped without it")
+    parser.add_argument("--jit_model_path", default=None, help="silero_vad.jit, loaded with torch.hub if not given")
+    parser.add_argument("--threads", type=int, default=1, help="ONNX Runtime intra-op threads")
+    parser.add_argument("--torch_threads", type=int, default=None)
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--seconds", type=float, default=3)
+    args = parser.parse_args()
+
+    if args.torch_threads is not None:
+        torch.set_num_threads(args.torch_threads)
+    if args.jit_model_path is not None:
+        model = torch.jit.load(args.jit_model_path)
+    else:
+        model, _ = torch.hub.load(SILERO_VAD_REPO, "silero_vad")
+    backends = [("torch", BatchedVAD(model), torch.get_num_threads())]
+    if args.onnx_model_path is not None:
+        from VAD.onnx_vad import OnnxBatchedVAD
+
+        backends.append(("onnx", OnnxBatchedVAD(args.onnx_model_path, intra_op_threads=args.threads), args.threads))
+
+    print(f"{'backend':>8} {'threads':>8} {'batch':>6} {'windows/s':>11} {'windows/s/core':>15}")
+    for name, engine, threads in backends:
+        for batch_size in args.batch_sizes:
+            rate = measure(engine, batch_size, args.seconds)
+            print(f"{name:>8} {threads:>8} {batch_size:>6} {rate:>11.0f} {rate / threads:>15.0f}")
+
+
+if __name__ == "__main__":
+    main()
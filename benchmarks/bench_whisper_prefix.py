@@ -0,0 +1,95 @@
+"""
+Time of the final transcription of an utterance by WhisperSTTHandler, from scratch and after the stable prefix of
+its partial transcriptions (forced as decoder_input_ids, so that only the tail is decoded), for one utterance and
+for a batch of them.
+It first checks the decoded output of a prefixed call: the text starts with the prefix, and the special tokens
+(start of transcript, language, task) are not repeated.
+
+    python benchmarks/bench_whisper_prefix.py --audio utterance.wav --model_name openai/whisper-tiny --device cpu
+"""
+import argparse
+import sys
+import threading
+import time
+import wave
+from pathlib import Path
+from queue import Queue
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from STT.whisper_stt_handler import WhisperSTTHandler
+
+
+def read_audio(path):
+    with wave.open(path, "rb") as wav:
+        if wav.getsampwidth() != 2 or wav.getnchannels() != 1 or wav.getframerate() != 16000:
+            raise ValueError(f"{path} must be 16 kHz mono 16-bit PCM")
+        return np.frombuffer(wav.readframes(wav.getnframes()), dtype="<i2").astype(np.float32) / 32768
+
+
+def leading_special(handler, ids):
+    special_ids = set(handler.processor.tokenizer.all_special_ids)
+    return next((i for i, token_id in enumerate(ids) if token_id not in special_ids), len(ids))
+
+
+def check_prefixed_transcription(handler, audio):
+    ids, texts, _ = handler.transcribe([audio])
+    full = handler.hypothesis(ids[0])
+    # two partials agreeing on the whole transcription: the prefix stops before its last word
+    prefix = handler.stable_prefix(full, full)
+    assert prefix, f"no stable prefix in {texts[0]!r}, use a longer utterance"
+    special_ids = set(handler.processor.tokenizer.all_special_ids)
+    assert not special_ids.intersection(prefix), "the prefix keeps special tokens"
+
+    prefix_text = handler.processor.tokenizer.decode(prefix, skip_special_tokens=True).strip()
+    for prefixed_ids, text in zip(*handler.transcribe([audio, audio], [prefix, prefix])[:2]):
+        assert text.strip().startswith(prefix_text), f"{text!r} does not start with {prefix_text!r}"
+        hypothesis = handler.hypothesis(prefixed_ids)
+        n_special = leading_special(handler, hypothesis)
+        assert n_special == leading_special(handler, full), f"special tokens repeated: {hypothesis[:n_special]}"
+        assert hypothesis[n_special : n_special + len(prefix)] == prefix
+    print(f"prefixed transcription: {prefix_text!r} + tail, special tokens once")
+    return prefix
+
+
+def timed(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--audio", required=True, help="16 kHz mono 16-bit wav of one utterance")
+    parser.add_argument("--model_name", default="openai/whisper-tiny")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--torch_dtype", default="float32")
+    parser.add_argument("--batch_size", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    handler = WhisperSTTHandler(
+        threading.Event(), Queue(), Queue(),
+        setup_kwargs={
+            "model_name": args.model_name,
+            "device": args.device,
+            "torch_dtype": args.torch_dtype,
+            "max_batch_size": args.batch_size,
+            "gen_kwargs": {"max_new_tokens": 128},
+        },
+    )
+    audio = read_audio(args.audio)
+    prefix = check_prefixed_transcription(handler, audio)
+
+    print(f"{'utterances':>10} {'from scratch ms':>16} {'after prefix ms':>16}")
+    for n in sorted({1, args.batch_size}):
+        scratch = timed(lambda: handler.transcribe([audio] * n), args.repeat)
+        prefixed = timed(lambda: handler.transcribe([audio] * n, [prefix] * n), args.repeat)
+        print(f"{n:>10} {scratch * 1000:>16.1f} {prefixed * 1000:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
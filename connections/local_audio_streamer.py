@@ -2,7 +2,6 @@ import threading
 import sounddevice as sd
 import numpy as np
 
-import time
 import logging
 
 logger = logging.getLogger(__name__)
@@ -39,6 +38,5 @@ class LocalAudioStreamer:
             blocksize=self.list_play_chunk_size,
         ):
             logger.info("Starting local audio stream")
-            while not self.stop_event.is_set():
-                time.sleep(0.001)
+            self.stop_event.wait()
             print("Stopping recording")
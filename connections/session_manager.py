@@ -0,0 +1,465 @@
+import itertools
+import selectors
+import socket
+import threading
+import logging
+from queue import Empty
+from time import monotonic
+from urllib.parse import parse_qs, urlsplit
+from rich.console import Console
+from websockets.frames import Frame, Opcode
+from websockets.http11 import Request
+from websockets.protocol import State
+from websockets.server import ServerProtocol
+
+from connections.session_playout import SessionPlayout
+from connections.websocket_transport import CODEC_PCM, HEADER, PcmCodec, WebSocketPlayout, make_codec, unpack_frame
+from utils.data import FilteredQueue
+from utils.ring_buffer import AudioRingBuffer
+from utils.session import Session
+
+logger = logging.getLogger(__name__)
+
+console = Console()
+
+
+class SessionManager:
+    """
+    Accepts any number of client connections (up to max_sessions) on the receive and send ports and gives each
+    client its own Session, while all sessions share the VAD, STT, LLM and TTS handlers of the pipeline.
+
+    A client connects to the receive port first and to the send port second (see listen_and_play.py), the two
+    connections are paired in this order, preferring connections coming from the same host.
+    All the sockets are served by one selectors loop (epoll on Linux) in the thread of run, so the number of
+    threads does not grow with the sessions. Incoming audio is received with recv_into straight into the
+    AudioRingBuffer of the session, and (session, samples written) is put in queue_out whenever a chunk of it is
+    available. The iterators of generated audio are taken from queue_in and routed to the session they belong to,
+    where a SessionPlayout frames, paces and writes them with sendmsg. The queues and iterators feeding the loop
+    wake it up through a socket pair. Closing a connection only ends its session.
+
+    With ws_port, clients can also connect with one WebSocket carrying both directions (see listen_and_play.py
+    --transport websocket), served by the same loop with the sans-I/O protocol of websockets. The codec is chosen
+    by the client in the URL (ws://host:port/?codec=opus&bitrate=24000), PCM if Opus is not available, and the server
+    answers the handshake with {"type": "session", "session_id", "codec", "sample_rate", "frame_samples"}.
+    Audio messages carry the codec, the session id and the utterance id of the audio (see websocket_transport.py).
+    """
+
+    def __init__(
+        self,
+        stop_event,
+        queue_out,
+        queue_in,
+        interruption_manager,
+        recv_host="0.0.0.0",
+        recv_port=12345,
+        send_host="0.0.0.0",
+        send_port=12346,
+        chunk_size=1024,
+        ring_buffer_samples=16000 * 60,
+        max_sessions=16,
+        send_buffer_s=0.1,
+        send_max_buffer_s=0.5,
+        ws_host="0.0.0.0",
+        ws_port=None,
+        ws_opus_bitrate=24000,
+        sample_rate=16000,
+    ):
+        self.stop_event = stop_event
+        self.queue_out = queue_out
+        self.queue_in = queue_in
+        self.interruption_manager = interruption_manager
+        self.recv_host = recv_host
+        self.recv_port = recv_port
+        self.send_host = send_host
+        self.send_port = send_port
+        self.chunk_size = chunk_size
+        self.ring_buffer_samples = ring_buffer_samples
+        self.max_sessions = max_sessions
+        self.send_buffer_s = send_buffer_s
+        self.send_max_buffer_s = send_max_buffer_s
+        self.ws_host = ws_host
+        self.ws_port = ws_port
+        self.ws_opus_bitrate = ws_opus_bitrate
+        self.sample_rate = sample_rate
+
+        self.sessions = {}
+        self._session_ids = itertools.count(1)
+        self._waiting_for_sender = []  # sessions with a receive connection but no send connection yet
+        self._lock = threading.Lock()
+
+        self.selector = selectors.DefaultSelector()
+        self.playouts = {}  # session_id -> SessionPlayout, once the send connection is paired
+        self.deadlines = {}  # session_id -> time at which its playout must be pumped again
+        # sessions to pump, marked by the other threads, which write to the socket pair to wake up the loop
+        self._woken = set()
+        self._woken_lock = threading.Lock()
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_reader.setblocking(False)
+        self._wakeup_writer.setblocking(False)
+
+    def run(self):
+        listeners = [
+            self.listen(self.recv_host, self.recv_port, self.on_receiver_connected),
+            self.listen(self.send_host, self.send_port, self.on_sender_connected),
+        ]
+        if self.ws_port:
+            listeners.append(self.listen(self.ws_host, self.ws_port, self.on_websocket_connected))
+        self.selector.register(self._wakeup_reader, selectors.EVENT_READ, self.on_wakeup)
+        self.queue_in.listener = lambda: self.wake(None)
+        self.wake(None)  # iterators queued before the loop started
+
+        self._ended = False
+        while not self.stop_event.is_set() and not self._ended:
+            timeout = 0.5  # to notice stop_event
+            if self.deadlines:
+                timeout = max(0.0, min(timeout, min(self.deadlines.values()) - monotonic()))
+            for key, mask in self.selector.select(timeout):
+                try:
+                    key.data(key.fileobj, mask)
+                except Exception as e:
+                    # a failing client only ends its own session, the loop serves all of them
+                    self.on_connection_error(key.fileobj, e)
+            self.pump()
+
+        self.queue_in.listener = None
+        with self._lock:
+            sessions = list(self.sessions.values())
+        for session in sessions:
+            self.close_session(session)
+        for listener in listeners:
+            self.selector.unregister(listener)
+            listener.close()
+        self.selector.close()
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
+        logger.info("Session manager closed")
+
+    def on_connection_error(self, conn, error):
+        with self._lock:
+            session = next((session for session in self.sessions.values() if conn in session.connections), None)
+        if session is None:
+            logger.error(f"Error on {conn}: {error!r}")
+            return
+        logger.error(f"Error in session {session.session_id}, closing it: {error!r}")
+        self.close_session(session)
+
+    def listen(self, host, port, on_connected):
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server_socket.bind((host, port))
+        server_socket.listen()
+        server_socket.setblocking(False)
+        self.selector.register(server_socket, selectors.EVENT_READ, lambda server, mask: self.accept(server, on_connected))
+        logger.info(f"Waiting for connections on {host}:{port}")
+        return server_socket
+
+    def accept(self, server_socket, on_connected):
+        try:
+            conn, address = server_socket.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        conn.setblocking(False)
+        on_connected(conn, address)
+
+    def wake(self, session_id):
+        """Thread safe: the loop pumps the playout of the session (None for the routing of queue_in) soon."""
+        with self._woken_lock:
+            first = not self._woken
+            self._woken.add(session_id)
+        if first:
+            try:
+                self._wakeup_writer.send(b"\0")
+            except (BlockingIOError, OSError):
+                pass  # the loop is already woken up, or closed
+
+    def on_wakeup(self, conn, mask):
+        try:
+            while conn.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def pump(self):
+        with self._woken_lock:
+            woken, self._woken = self._woken, set()
+        if None in woken:
+            self.dispatch()
+        now = monotonic()
+        woken.update(session_id for session_id, deadline in self.deadlines.items() if deadline <= now)
+        for session_id in woken:
+            playout = self.playouts.get(session_id)
+            if playout is None:
+                continue
+            try:
+                delay = playout.pump()
+            except OSError as e:
+                logger.info(f"Sender connection lost: {e}")
+                self.close_session(playout.session)
+                continue
+            except Exception as e:
+                self.on_connection_error(playout.conn, e)
+                continue
+            if delay is None:
+                self.deadlines.pop(session_id, None)
+            else:
+                self.deadlines[session_id] = now + delay
+            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if playout.wants_write else 0)
+            key = self.selector.get_key(playout.conn)
+            if key.events != events:
+                self.selector.modify(playout.conn, events, key.data)
+
+    def dispatch(self):
+        """Routes the audio iterators of queue_in to the session they were generated for."""
+        while True:
+            try:
+                data = self.queue_in.get_nowait()
+            except Empty:
+                return
+            if isinstance(data, bytes) and data == b"END":
+                self._ended = True
+                return
+            session = data.get("session")
+            if session is None or session.closed.is_set():
+                continue
+            session.iterator_queue.put(data)
+
+    def open_session(self, conn, address):
+        """Creates the session of a new client, None if max_sessions are already open."""
+        session = Session(next(self._session_ids), address)
+        session.connections = [conn]
+        session.iterator_queue = FilteredQueue("session_iterator_queue")
+        with self._lock:
+            if len(self.sessions) >= self.max_sessions:
+                logger.warning(f"Refusing {address}: {self.max_sessions} sessions already open")
+                conn.close()
+                return
+            self.sessions[session.session_id] = session
+
+        self.interruption_manager.add_filtered_queue(session.iterator_queue)
+        console.print(f"[blue]Session {session.session_id} opened for {address[0]}")
+
+        # the VAD reads the audio of the session from here
+        session.ring_buffer = AudioRingBuffer(self.ring_buffer_samples)
+        session.announced = 0  # bytes of the ring buffer announced in queue_out
+        session.set_state("ring_buffer", session.ring_buffer)
+        return session
+
+    def on_receiver_connected(self, conn, address):
+        session = self.open_session(conn, address)
+        if session is None:
+            return
+        with self._lock:
+            self._waiting_for_sender.append(session)
+        self.selector.register(conn, selectors.EVENT_READ, lambda conn, mask: self.receive(session, conn))
+
+    def receive(self, session, conn):
+        ring_buffer = session.ring_buffer
+        try:
+            received = ring_buffer.recv_into(conn, self.chunk_size)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            received = 0
+        if not received:
+            # connection closed
+            logger.info("Receiver closed")
+            self.close_session(session)
+            return
+        self.announce(session)
+
+    def announce(self, session):
+        ring_buffer = session.ring_buffer
+        if ring_buffer.bytes_written - session.announced >= self.chunk_size:
+            session.announced = ring_buffer.bytes_written
+            self.queue_out.put((session, ring_buffer.samples_written))
+
+    def on_sender_connected(self, conn, address):
+        with self._lock:
+            candidates = [session for session in self._waiting_for_sender if session.address[0] == address[0]]
+            candidates = candidates or self._waiting_for_sender
+            if not candidates:
+                logger.warning(f"Refusing {address}: no session is waiting for a send connection")
+                conn.close()
+                return
+            session = candidates[0]
+            self._waiting_for_sender.remove(session)
+            session.connections.append(conn)
+
+        session_id = session.session_id
+        self.playouts[session_id] = SessionPlayout(
+            session,
+            conn,
+            lambda: self.wake(session_id),
+            buffer_time=self.send_buffer_s,
+            max_buffer_time=self.send_max_buffer_s,
+        )
+        self.selector.register(conn, selectors.EVENT_READ, self.on_send_connection_event)
+        self.wake(session_id)  # audio generated before the send connection
+
+    def on_send_connection_event(self, conn, mask):
+        playout = next((playout for playout in self.playouts.values() if playout.conn is conn), None)
+        if playout is None:
+            return
+        if mask & selectors.EVENT_READ:
+            # the client does not send anything on this connection, readable means closed
+            try:
+                closed = not conn.recv(4096)
+            except (BlockingIOError, InterruptedError):
+                closed = False
+            except OSError:
+                closed = True
+            if closed:
+                logger.info("Sender connection closed by the client")
+                self.close_session(playout.session)
+                return
+        if mask & selectors.EVENT_WRITE:
+            self.wake(playout.session.session_id)
+
+    def on_websocket_connected(self, conn, address):
+        session = self.open_session(conn, address)
+        if session is None:
+            return
+        session.protocol = ServerProtocol()
+        session.codec = None  # chosen at the handshake
+        session.fragments = []  # frames of a fragmented message
+        self.selector.register(
+            conn, selectors.EVENT_READ, lambda conn, mask: self.on_websocket_event(session, conn, mask)
+        )
+
+    def on_websocket_event(self, session, conn, mask):
+        if mask & selectors.EVENT_WRITE:
+            self.wake(session.session_id)
+        if not mask & selectors.EVENT_READ:
+            return
+        protocol = session.protocol
+        try:
+            data = conn.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if data:
+            protocol.receive_data(data)
+        else:
+            protocol.receive_eof()
+        refused = False
+        for event in protocol.events_received():
+            if isinstance(event, Request):
+                refused = not self.accept_websocket(session, conn, event)
+            elif isinstance(event, Frame):
+                self.on_websocket_frame(session, event)
+        playout = self.playouts.get(session.session_id)
+        if playout is not None:
+            try:
+                playout.send_protocol_data()  # pongs, answer to a close
+            except OSError:
+                data = b""
+        if not data or refused or protocol.state is State.CLOSED or protocol.close_expected():
+            logger.info("WebSocket closed")
+            self.close_session(session)
+
+    def accept_websocket(self, session, conn, request):
+        """Answers the handshake, returns False if it was refused."""
+        protocol = session.protocol
+        response = protocol.accept(request)
+        protocol.send_response(response)
+        if response.status_code != 101:
+            for data in protocol.data_to_send():
+                try:
+                    conn.send(data)
+                except OSError:
+                    break
+            return False
+
+        query = parse_qs(urlsplit(request.path).query)
+        session.codec = make_codec(
+            query.get("codec", [PcmCodec.name])[0],
+            sample_rate=self.sample_rate,
+            bitrate=self.parse_bitrate(query.get("bitrate", [None])[0]),
+        )
+        session_id = session.session_id
+        playout = WebSocketPlayout(
+            session,
+            conn,
+            lambda: self.wake(session_id),
+            protocol,
+            session.codec,
+            buffer_time=self.send_buffer_s,
+            max_buffer_time=self.send_max_buffer_s,
+        )
+        self.playouts[session_id] = playout
+        playout.send_message(
+            {
+                "type": "session",
+                "session_id": session_id,
+                "codec": session.codec.name,
+                "sample_rate": session.codec.sample_rate,
+                "frame_samples": session.codec.frame_samples,
+            }
+        )
+        logger.info(f"WebSocket of session {session_id} open with {session.codec.name}")
+        return True
+
+    def parse_bitrate(self, value):
+        """Bitrate asked by a client, ws_opus_bitrate if it is missing or not a valid Opus bitrate."""
+        if value is None:
+            return self.ws_opus_bitrate
+        try:
+            bitrate = int(value)
+        except ValueError:
+            bitrate = 0
+        if not 6000 <= bitrate <= 510000:
+            logger.warning(f"Invalid Opus bitrate {value!r} asked by a client, using {self.ws_opus_bitrate}")
+            return self.ws_opus_bitrate
+        return bitrate
+
+    def on_websocket_frame(self, session, frame):
+        if frame.opcode not in (Opcode.BINARY, Opcode.CONT):
+            return  # control frames are answered by the protocol, text messages are not used by clients
+        if frame.opcode is Opcode.CONT and not session.fragments:
+            return  # continuation of a text message
+        session.fragments.append(frame.data)
+        if not frame.fin:
+            return
+        message, session.fragments = b"".join(session.fragments), []
+        if len(message) < HEADER.size:
+            logger.warning("Ignoring a WebSocket message without header")
+            return
+        codec_id, _, _, payload = unpack_frame(message)
+        if codec_id == CODEC_PCM:
+            codec = PcmCodec()
+        elif codec_id == session.codec.codec_id:
+            codec = session.codec
+        else:
+            logger.warning(f"Ignoring audio with codec {codec_id}, session {session.session_id} uses {session.codec.name}")
+            return
+        try:
+            audio = codec.decode(payload)
+        except Exception as e:
+            logger.warning(f"Ignoring audio that could not be decoded: {e}")
+            return
+        session.ring_buffer.write(audio)
+        self.announce(session)
+
+    def close_session(self, session):
+        with self._lock:
+            if self.sessions.pop(session.session_id, None) is None:
+                return
+            if session in self._waiting_for_sender:
+                self._waiting_for_sender.remove(session)
+
+        session.close()
+        playout = self.playouts.pop(session.session_id, None)
+        self.deadlines.pop(session.session_id, None)
+        for conn in session.connections:
+            try:
+                self.selector.unregister(conn)
+            except (KeyError, ValueError):
+                pass
+            if playout is not None and conn is playout.conn:
+                playout.close()
+            else:
+                conn.close()
+        self.interruption_manager.remove_filtered_queue(session.iterator_queue)
+        self.interruption_manager.forget_session(session.session_id)
+        console.print(f"[blue]Session {session.session_id} closed")
@@ -0,0 +1,175 @@
+import logging
+import socket
+from collections import deque
+from queue import Empty
+
+from utils import cancellation, tracing
+from utils.framing import BlockFramer
+from utils.playout import PlayoutScheduler
+
+logger = logging.getLogger(__name__)
+
+# sendmsg takes at most IOV_MAX (1024 on Linux) buffers
+MAX_FRAMES_PER_WRITE = 64
+
+
+class SessionPlayout:
+    """
+    Audio output of one session, driven by the I/O loop of the SessionManager without blocking: it takes the audio
+    iterators of the session in order from iterator_queue, cuts their chunks into frames with a BlockFramer
+    (a sentence ending mid-frame is continued by the next one), and writes the frames that are due for the
+    PlayoutScheduler to the socket with one sendmsg per pump.
+    Items, chunks and speculations that are not ready leave the session waiting for `wake`, the listener set on
+    them, which makes the loop pump the session again.
+    """
+
+    def __init__(self, session, conn, wake, blocksize=512, sample_rate=16000, buffer_time=0.1, max_buffer_time=0.5):
+        self.session = session
+        self.conn = conn
+        self.wake = wake
+        self.iterator_queue = session.iterator_queue
+        self.iterator_queue.listener = wake
+        # the frames of a write (unsent included) and the next one cut are alive at once, none of them is overwritten
+        self.framer = BlockFramer(blocksize, slots=MAX_FRAMES_PER_WRITE + 2)
+        self.playout = PlayoutScheduler(sample_rate, lead=buffer_time, max_lead=max_buffer_time)
+        self.current = None  # item whose iterator is being read
+        self.waiting = None  # item of an undecided speculation
+        self.carry_data = None  # item the samples carried by the framer belong to
+        self.frames = deque()  # (item, frame) cut and not sent yet
+        self.unsent = []  # buffers of a partial write, sent before anything else
+
+    def pump(self):
+        """
+        Sends what can be sent now. Returns the delay after which the session must be pumped again, or None if it
+        waits for a wake (new audio, writable socket). Raises OSError if the connection is lost.
+        """
+        if self.unsent and not self.write(self.unsent):
+            return None
+        buffers = []
+        delay = None
+        while True:
+            if len(buffers) >= MAX_FRAMES_PER_WRITE:
+                delay = 0
+                break
+            if not self.frames and not self.fill():
+                break
+            item, frame = self.frames[0]
+            if cancellation.is_cancelled(item):
+                self.frames.popleft()
+                continue
+            due = self.playout.delay(item.get_index("user_audio"))
+            if due > 0:
+                delay = due
+                break
+            self.frames.popleft()
+            self.playout.sent(frame)
+            buffers.extend(self.pack(item, frame))
+            tracing.mark(item, "first_byte_sent")
+            if item.get("llm_sentence") is not None or item.get("llm_fragment") is not None:
+                tracing.mark(item, "first_reply_byte_sent")
+        if buffers and not self.write(buffers):
+            return None
+        return delay
+
+    def pack(self, item, frame):
+        """Buffers to write for a frame of the item: its raw int16 bytes."""
+        return [memoryview(frame).cast("B")]
+
+    def write(self, buffers):
+        """Writes the buffers with one sendmsg, keeps what the socket did not take. Returns True if all was sent."""
+        try:
+            sent = self.conn.sendmsg(buffers) if hasattr(self.conn, "sendmsg") else self.conn.send(b"".join(buffers))
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        while buffers and sent >= len(buffers[0]):
+            sent -= len(buffers[0])
+            buffers = buffers[1:]
+        if buffers:
+            buffers[0] = buffers[0][sent:]
+        self.unsent = list(buffers)
+        return not self.unsent
+
+    @property
+    def wants_write(self):
+        return bool(self.unsent)
+
+    def fill(self):
+        """Cuts the next frames from the audio available without waiting. Returns True if frames were added."""
+        while not self.frames:
+            if self.current is None and not self.next_item():
+                return False
+            if cancellation.is_cancelled(self.current):
+                logger.debug("Utterance cancelled, dropping the rest of its audio")
+                self.framer.reset()
+                self.current = self.carry_data = None
+                continue
+            iterator = self.current.get_data("output_audio_iterator")
+            try:
+                chunk = iterator.next_nowait()
+            except Empty:
+                return False
+            except StopIteration:
+                self.end_of_item()
+                continue
+            is_reply = self.current.get("llm_sentence") is not None or self.current.get("llm_fragment") is not None
+            for frame in self.framer.push(chunk):
+                if is_reply:
+                    tracing.mark(self.current, "tts_first_byte")
+                self.frames.append((self.current, frame))
+        return True
+
+    def next_item(self):
+        """Starts reading the next iterator of the session, returns False if there is none ready."""
+        while True:
+            item, self.waiting = self.waiting, None
+            if item is None:
+                try:
+                    item = self.iterator_queue.get_nowait()
+                except Empty:
+                    return False
+                if isinstance(item, bytes):
+                    continue
+                speculation = item.get("speculation")
+                if speculation is not None:
+                    speculation.add_done_callback(self.wake)
+            speculation = item.get("speculation")
+            if speculation is not None and not speculation.wait(timeout=0):
+                # audio of a speculative utterance is only played once the end of speech is confirmed
+                self.waiting = item
+                return False
+            if speculation is not None and speculation.cancelled:
+                logger.debug("Dropping the audio of a cancelled speculative utterance")
+                continue
+            return self.start_item(item)
+
+    def start_item(self, item):
+        if self.carry_data is not None and self.carry_data.get_index("user_audio") != item.get_index("user_audio"):
+            self.flush()
+        self.current = item
+        item.get_data("output_audio_iterator").listener = self.wake
+        return True
+
+    def end_of_item(self):
+        self.carry_data = self.current if self.framer.pending else None
+        self.current = None
+        if not self.iterator_queue.qsize():
+            # nothing queued to continue the audio with
+            self.flush()
+
+    def flush(self):
+        frame = self.framer.flush()
+        data, self.carry_data = self.carry_data, None
+        if frame is not None and not cancellation.is_cancelled(data):
+            self.frames.append((data, frame))
+
+    def close(self):
+        self.iterator_queue.listener = None
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.conn.close()
+        logger.info(
+            f"Sender closed, {self.playout.underruns} underruns ({self.playout.underrun_seconds:.2f} s), "
+            f"lead {self.playout.lead * 1000:.0f} ms"
+        )
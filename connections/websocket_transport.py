@@ -0,0 +1,121 @@
+import json
+import logging
+import struct
+
+import numpy as np
+
+from connections.session_playout import SessionPlayout
+
+logger = logging.getLogger(__name__)
+
+# Binary messages: codec, session id, utterance id, then the audio of one frame encoded with the codec.
+# Text messages are JSON control messages, the server sends {"type": "session", ...} right after the handshake.
+HEADER = struct.Struct("!BII")
+CODEC_PCM = 0
+CODEC_OPUS = 1
+NO_UTTERANCE = 0xFFFFFFFF  # audio of the client
+
+
+def pack_frame(codec_id, session_id, utterance_id, payload):
+    if utterance_id is None:
+        utterance_id = NO_UTTERANCE
+    return HEADER.pack(codec_id, session_id, utterance_id) + bytes(payload)
+
+
+def unpack_frame(message):
+    """Returns (codec id, session id, utterance id, payload) of a binary message."""
+    message = memoryview(message)
+    codec_id, session_id, utterance_id = HEADER.unpack_from(message)
+    return codec_id, session_id, utterance_id, message[HEADER.size :]
+
+
+class PcmCodec:
+    """16-bit little-endian PCM, as on the TCP sockets."""
+
+    name = "pcm"
+    codec_id = CODEC_PCM
+
+    def __init__(self, sample_rate=16000, frame_samples=512):
+        self.sample_rate = sample_rate
+        self.frame_samples = frame_samples
+
+    def encode(self, frame):
+        return np.ascontiguousarray(frame, dtype="<i2").tobytes()
+
+    def decode(self, payload):
+        payload = memoryview(payload).cast("B")
+        return np.frombuffer(payload[: len(payload) // 2 * 2], dtype="<i2")
+
+
+class OpusCodec:
+    """
+    Opus in frames of frame_ms (20 ms: 320 samples at 16 kHz), one packet per message.
+    Needs opuslib and the libopus shared library.
+    """
+
+    name = "opus"
+    codec_id = CODEC_OPUS
+
+    def __init__(self, sample_rate=16000, bitrate=24000, frame_ms=20):
+        import opuslib
+
+        self.sample_rate = sample_rate
+        self.frame_samples = sample_rate * frame_ms // 1000
+        self.max_frame_samples = sample_rate * 120 // 1000  # longest Opus packet
+        self.encoder = opuslib.Encoder(sample_rate, 1, opuslib.APPLICATION_VOIP)
+        self.encoder.bitrate = bitrate
+        self.decoder = opuslib.Decoder(sample_rate, 1)
+
+    def encode(self, frame):
+        return self.encoder.encode(np.ascontiguousarray(frame, dtype="<i2").tobytes(), self.frame_samples)
+
+    def decode(self, payload):
+        return np.frombuffer(self.decoder.decode(bytes(payload), self.max_frame_samples), dtype="<i2")
+
+
+def make_codec(name, sample_rate=16000, bitrate=24000):
+    """The codec called name, PCM if it is not Opus or Opus is not available."""
+    if name == OpusCodec.name:
+        try:
+            return OpusCodec(sample_rate, bitrate)
+        except Exception as e:  # opuslib raises a plain Exception when libopus is missing
+            logger.warning(f"Opus is not available ({e}), using PCM")
+    return PcmCodec(sample_rate)
+
+
+class WebSocketPlayout(SessionPlayout):
+    """
+    SessionPlayout of a client connected with a WebSocket: every frame is encoded with the codec of the session and
+    sent as a binary message carrying the session and utterance ids. protocol is the sans-I/O
+    websockets.server.ServerProtocol of the connection, whose bytes are written by the playout.
+    """
+
+    def __init__(self, session, conn, wake, protocol, codec, **kwargs):
+        super().__init__(session, conn, wake, blocksize=codec.frame_samples, sample_rate=codec.sample_rate, **kwargs)
+        self.protocol = protocol
+        self.codec = codec
+
+    def pack(self, item, frame):
+        message = pack_frame(
+            self.codec.codec_id, self.session.session_id, item.get_index("user_audio"), self.codec.encode(frame)
+        )
+        self.protocol.send_binary(message)
+        return self.protocol.data_to_send()
+
+    def send_message(self, message):
+        self.protocol.send_text(json.dumps(message).encode())
+        self.send_protocol_data()
+
+    def send_protocol_data(self):
+        """Writes what the protocol has to send besides audio (handshake, control messages, pongs, close)."""
+        buffers = self.protocol.data_to_send()
+        if buffers:
+            self.write(self.unsent + buffers)
+
+    def close(self):
+        try:
+            self.protocol.send_close()
+            self.send_protocol_data()
+        except Exception:
+            pass  # the connection is already closing or lost
+        super().close()
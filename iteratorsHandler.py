@@ -5,6 +5,8 @@ from queue import Queue
 from collections import deque  # Added for efficient buffer management
 import concurrent.futures
 from utils.process_iterator import ProcessIterator
+from utils.data import ImmutableDataChain
+from utils import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +27,7 @@ class IteratorHandler:
         self._times = []
         self.threads = threads
         self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+        metrics.handler_threads.inc(threads, handler=self.__class__.__name__)
 
     def setup(self, *args, **kwargs):
         pass
@@ -40,31 +43,55 @@ class IteratorHandler:
                 logger.debug("Stopping thread")
                 break
 
-            iterator = ProcessIterator()
-            self.queue_out.put(iterator)
-            self.executor.submit(self.process_and_write, input_data, iterator)
+            metrics.handler_inputs.inc(handler=self.__class__.__name__)
+            iterator = self.create_iterator(input_data)
+            # the iterators are put in the order of the inputs, whatever the order their chunks are produced in
+            self.queue_out.put(self.output(input_data, iterator))
+            metrics.handler_outputs.inc(handler=self.__class__.__name__)
+            self.submit(input_data, iterator)
 
         self.executor.shutdown(wait=True)
+        metrics.handler_threads.dec(self.threads, handler=self.__class__.__name__)
         self.cleanup()
         self.queue_out.put(b"END")
 
+    def create_iterator(self, input_data):
+        return ProcessIterator()
+
+    def output(self, input_data, iterator):
+        """Item of the output queue for the iterator of the input."""
+        if isinstance(input_data, ImmutableDataChain):
+            return input_data.add_data(iterator, "output_audio_iterator")
+        return iterator
+
+    def submit(self, input_data, iterator):
+        """Starts producing the chunks of the iterator, right away by default."""
+        self.executor.submit(self.process_and_write, input_data, iterator)
+
     def process_and_write(self, input_data, iterator):
+        handler = self.__class__.__name__
         start_time = perf_counter()
         first_chunk = True
+        metrics.add_busy_thread(handler)
 
         try:
             for chunk in self.process(input_data):
                 if first_chunk:
                     logger.debug(f"{self.__class__.__name__} started output after: {perf_counter() - start_time:.3f} s")
+                    metrics.handler_first_chunk_seconds.observe(perf_counter() - start_time, handler=handler)
                     first_chunk = False
                 iterator.put(chunk)
             iterator.close()
             logger.debug(f"{self.__class__.__name__} finished output after: {perf_counter() - start_time:.3f} s")
+            metrics.handler_process_seconds.observe(perf_counter() - start_time, handler=handler)
         except Exception as e:
             logger.error(f"Error in {self.__class__.__name__}: {e}")
+            iterator.close()
             self.stop_event.set()
             self.queue_out.put(b"END")
             return
+        finally:
+            metrics.add_busy_thread(handler, -1)
 
     @property
     def last_time(self):
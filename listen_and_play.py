@@ -1,6 +1,8 @@
+import json
 import socket
 import threading
-from queue import Queue
+from queue import Queue, Empty
+from urllib.parse import urlencode
 from dataclasses import dataclass, field
 import sounddevice as sd
 from transformers import HfArgumentParser
@@ -28,6 +30,25 @@ class ListenAndPlayArguments:
         default=12346,
         metadata={"help": "The network port for receiving data. Default is 12346."},
     )
+    transport: str = field(
+        default="socket",
+        metadata={
+            "help": "'socket' for the two TCP connections of raw PCM, 'websocket' for one WebSocket connection "
+            "to ws_url with framed messages. Default is 'socket'."
+        },
+    )
+    ws_url: str = field(
+        default="ws://localhost:12347",
+        metadata={"help": "URL of the WebSocket transport of the server (--ws_port). Default is 'ws://localhost:12347'."},
+    )
+    codec: str = field(
+        default="pcm",
+        metadata={"help": "Codec of the WebSocket transport, 'pcm' or 'opus' (needs opuslib and libopus). Default is 'pcm'."},
+    )
+    opus_bitrate: int = field(
+        default=24000,
+        metadata={"help": "Bitrate of the Opus audio, in bit/s, both ways. Default is 24000."},
+    )
 
 
 def listen_and_play(
@@ -121,7 +142,124 @@ def listen_and_play(
         print("Connection closed.")
 
 
+def listen_and_play_websocket(
+    send_rate=16000,
+    recv_rate=16000,
+    list_play_chunk_size=1024,
+    ws_url="ws://localhost:12347",
+    codec="pcm",
+    opus_bitrate=24000,
+):
+    import numpy as np
+    from websockets.exceptions import ConnectionClosed
+    from websockets.sync.client import connect
+
+    from connections.websocket_transport import NO_UTTERANCE, make_codec, pack_frame, unpack_frame
+    from utils.framing import BlockFramer
+
+    websocket = connect(f"{ws_url}?{urlencode({'codec': codec, 'bitrate': opus_bitrate})}", compression=None)
+    session = json.loads(websocket.recv())
+    codec = make_codec(session["codec"], session["sample_rate"], opus_bitrate)
+    session_id = session["session_id"]
+    print(f"Session {session_id} with {codec.name}, recording and streaming...")
+
+    stop_event = threading.Event()
+    recv_queue = Queue()
+    send_queue = Queue()
+
+    playing = bytearray()  # received audio not played yet, the frames of the codec are not blocks of the stream
+
+    def callback_recv(outdata, frames, time, status):
+        while len(playing) < len(outdata):
+            try:
+                playing.extend(recv_queue.get_nowait())
+            except Empty:
+                break
+        played = min(len(playing), len(outdata))
+        outdata[:played] = playing[:played]
+        outdata[played:] = b"\x00" * (len(outdata) - played)
+        del playing[:played]
+
+    def callback_send(indata, frames, time, status):
+        send_queue.put(bytes(indata))
+
+    def send():
+        framer = BlockFramer(codec.frame_samples)
+        while not stop_event.is_set():
+            data = send_queue.get()
+            for frame in framer.push(np.frombuffer(data, dtype="<i2")):
+                try:
+                    websocket.send(pack_frame(codec.codec_id, session_id, NO_UTTERANCE, codec.encode(frame)))
+                except ConnectionClosed:
+                    return
+
+    def recv():
+        utterance = None
+        try:
+            for message in websocket:
+                if isinstance(message, str):
+                    continue
+                _, _, utterance_id, payload = unpack_frame(message)
+                if utterance_id != utterance:
+                    # the audio of a new utterance replaces what is left of the interrupted one
+                    utterance = utterance_id
+                    while not recv_queue.empty():
+                        recv_queue.get_nowait()
+                recv_queue.put(codec.decode(payload).tobytes())
+        except ConnectionClosed:
+            pass
+
+    try:
+        send_stream = sd.RawInputStream(
+            samplerate=send_rate,
+            channels=1,
+            dtype="int16",
+            blocksize=list_play_chunk_size,
+            callback=callback_send,
+        )
+        recv_stream = sd.RawOutputStream(
+            samplerate=recv_rate,
+            channels=1,
+            dtype="int16",
+            blocksize=list_play_chunk_size,
+            callback=callback_recv,
+        )
+        send_stream.start()
+        recv_stream.start()
+
+        send_thread = threading.Thread(target=send)
+        send_thread.start()
+        recv_thread = threading.Thread(target=recv)
+        recv_thread.start()
+
+        input("Press Enter to stop...")
+
+    except KeyboardInterrupt:
+        print("Finished streaming.")
+
+    finally:
+        stop_event.set()
+        send_queue.put(b"")
+        websocket.close()
+        recv_thread.join()
+        send_thread.join()
+        print("Connection closed.")
+
+
 if __name__ == "__main__":
     parser = HfArgumentParser((ListenAndPlayArguments,))
     (listen_and_play_kwargs,) = parser.parse_args_into_dataclasses()
-    listen_and_play(**vars(listen_and_play_kwargs))
+    kwargs = vars(listen_and_play_kwargs)
+    transport = kwargs.pop("transport")
+    ws_url, codec, opus_bitrate = kwargs.pop("ws_url"), kwargs.pop("codec"), kwargs.pop("opus_bitrate")
+    if transport == "websocket":
+        listen_and_play_websocket(
+            send_rate=kwargs["send_rate"],
+            recv_rate=kwargs["recv_rate"],
+            list_play_chunk_size=kwargs["list_play_chunk_size"],
+            ws_url=ws_url,
+            codec=codec,
+            opus_bitrate=opus_bitrate,
+        )
+    else:
+        listen_and_play(**kwargs)
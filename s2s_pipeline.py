@@ -3,7 +3,7 @@ import os
 import sys
 from copy import copy
 from pathlib import Path
-from queue import Queue
+from utils.bounded_queue import BoundedQueue, parse_queue_limits
 from utils.data import FilteredQueue
 from threading import Event
 from typing import Optional
@@ -23,6 +23,7 @@ from arguments_classes.filler_arguments import FillerHandlerArguments
 from arguments_classes.parler_tts_arguments import ParlerTTSHandlerArguments
 from arguments_classes.socket_receiver_arguments import SocketReceiverArguments
 from arguments_classes.socket_sender_arguments import SocketSenderArguments
+from arguments_classes.session_manager_arguments import SessionManagerArguments
 from arguments_classes.vad_arguments import VADHandlerArguments
 from arguments_classes.whisper_stt_arguments import WhisperSTTHandlerArguments
 from arguments_classes.melo_tts_arguments import MeloTTSHandlerArguments
@@ -34,7 +35,7 @@ from transformers import (
     HfArgumentParser,
 )
 from utils.thread_manager import ThreadManager
-from utils.deiterator import DeiteratorHandler
+from utils import metrics, tracing
 from INTERRUPTION.interruption_manager_handler import InterruptionManagerHandler
 
 # Ensure that the necessary NLTK resources are available
@@ -77,6 +78,7 @@ def parse_arguments():
             ModuleArguments,
             SocketReceiverArguments,
             SocketSenderArguments,
+            SessionManagerArguments,
             VADHandlerArguments,
             WhisperSTTHandlerArguments,
             ParaformerSTTHandlerArguments,
@@ -210,26 +212,49 @@ def prepare_all_args(
     rename_args(elevenlabs_tts_handler_kwargs, "elevenlabs_tts")
 
 
-def initialize_queues_and_events():
+def initialize_queues_and_events(queue_limits=""):
+    # capacity and policy of the queues given in --queue_limits, the others are unbounded
+    limits = parse_queue_limits(queue_limits)
+
+    def bounded(name):
+        return BoundedQueue(name, *limits.get(name, (0, "block")))
+
+    def filtered(name):
+        return FilteredQueue(name, *limits.get(name, (0, "block")))
+
     return {
         "stop_event": Event(),  # Останавливает работу вообще всего навсегда
         "should_listen": Event(),  # Для того, чтобы не слушать пользователя
         # "is_speaking_event": Event(),  #Начал ли пользователь говорить. Если событие установлен, то vad гарантировано что-то выдаст, когда пользователь закончит говорить
-        "interruption_request_queue": Queue(),
-        "recv_audio_chunks_queue": Queue(),  # Полученое аудио
-        "send_audio_chunks_queue": FilteredQueue(),  # Готовое аудио для отправки
-        "spoken_prompt_queue": FilteredQueue(),  # Куски речи
-        "text_prompt_queue": FilteredQueue(),  # Куски текст
-        "preprocessed_text_prompt_queue": FilteredQueue(),  # Куски предобработаного текста
-        "lm_response_queue": FilteredQueue(),  # Ответы LLM
-        "audio_response_queue_of_iterators": FilteredQueue(),
+        "interruption_request_queue": bounded("interruption_request_queue"),
+        "recv_audio_chunks_queue": bounded("recv_audio_chunks_queue"),  # Полученое аудио, (session, chunk)
+        "spoken_prompt_queue": filtered("spoken_prompt_queue"),  # Куски речи
+        "text_prompt_queue": filtered("text_prompt_queue"),  # Куски текст
+        "preprocessed_text_prompt_queue": filtered("preprocessed_text_prompt_queue"),  # Куски предобработаного текста
+        "lm_response_queue": filtered("lm_response_queue"),  # Ответы LLM
+        "audio_response_queue_of_iterators": filtered("audio_response_queue_of_iterators"),
     }
 
 
+def release_queues(queues_and_events):
+    """Stops blocking the producers on full queues, their consumers stop with the pipeline."""
+    for instance in queues_and_events.values():
+        if hasattr(instance, "release"):
+            instance.release()
+
+
+def register_queue_metrics(queues_and_events):
+    """Reports the depth of every queue of the pipeline when the metrics are collected."""
+    for name, instance in queues_and_events.items():
+        if hasattr(instance, "qsize"):
+            metrics.queue_depth.set_function(instance.qsize, queue=name)
+
+
 def build_pipeline(
         module_kwargs,
         socket_receiver_kwargs,
         socket_sender_kwargs,
+        session_manager_kwargs,
         vad_handler_kwargs,
         whisper_stt_handler_kwargs,
         paraformer_stt_handler_kwargs,
@@ -250,7 +275,6 @@ def build_pipeline(
     # is_speaking_event = queues_and_events["is_speaking_event"]
     interruption_request_queue = queues_and_events["interruption_request_queue"]
     recv_audio_chunks_queue = queues_and_events["recv_audio_chunks_queue"]
-    send_audio_chunks_queue = queues_and_events["send_audio_chunks_queue"]
     spoken_prompt_queue = queues_and_events["spoken_prompt_queue"]
     text_prompt_queue = queues_and_events["text_prompt_queue"]
     preprocessed_text_prompt_queue = queues_and_events["preprocessed_text_prompt_queue"]
@@ -258,25 +282,34 @@ def build_pipeline(
     audio_response_queue_of_iterators = queues_and_events["audio_response_queue_of_iterators"]
     should_listen = None
 
-    from connections.socket_receiver import SocketReceiver
-    from connections.socket_sender import SocketSender
-
-    comms_handlers = [
-        SocketReceiver(
-            stop_event = stop_event,
-            queue_out = recv_audio_chunks_queue,
-            should_listen = None, #should_listen = should_listen,
-            host=socket_receiver_kwargs.recv_host,
-            port=socket_receiver_kwargs.recv_port,
-            chunk_size=socket_receiver_kwargs.chunk_size,
-        ),
-        SocketSender(
-            stop_event,
-            send_audio_chunks_queue,
-            host=socket_sender_kwargs.send_host,
-            port=socket_sender_kwargs.send_port,
-        ),
-    ]
+    from connections.session_manager import SessionManager
+
+    interruption_manager = InterruptionManagerHandler(
+        stop_event = stop_event,
+        interruption_request_queue = interruption_request_queue,
+        filtered_queues=[instance for instance in queues_and_events.values() if isinstance(instance, FilteredQueue)]
+    )
+
+    # Accepts the clients and plays the generated audio to the session it belongs to
+    session_manager = SessionManager(
+        stop_event,
+        queue_out=recv_audio_chunks_queue,
+        queue_in=audio_response_queue_of_iterators,
+        interruption_manager=interruption_manager,
+        recv_host=socket_receiver_kwargs.recv_host,
+        recv_port=socket_receiver_kwargs.recv_port,
+        send_host=socket_sender_kwargs.send_host,
+        send_port=socket_sender_kwargs.send_port,
+        chunk_size=socket_receiver_kwargs.chunk_size,
+        ring_buffer_samples=int(socket_receiver_kwargs.recv_buffer_s * vad_handler_kwargs.sample_rate),
+        max_sessions=session_manager_kwargs.max_sessions,
+        send_buffer_s=socket_sender_kwargs.send_buffer_s,
+        send_max_buffer_s=socket_sender_kwargs.send_max_buffer_s,
+        ws_host=session_manager_kwargs.ws_host,
+        ws_port=session_manager_kwargs.ws_port,
+        ws_opus_bitrate=session_manager_kwargs.ws_opus_bitrate,
+        sample_rate=vad_handler_kwargs.sample_rate,
+    )
 
     vad = VADHandler(
         stop_event,
@@ -293,25 +326,26 @@ def build_pipeline(
     filler = get_filler_handler(module_kwargs, stop_event, text_prompt_queue, preprocessed_text_prompt_queue,
                                 audio_response_queue_of_iterators, filler_handler_kwargs)
 
+    if module_kwargs.tts == "elevenlabsStreamTTS":
+        # the streaming TTS takes the text of the LLM as it is generated
+        open_api_language_model_handler_kwargs.fragments = True
     lm = get_llm_handler(module_kwargs, stop_event, preprocessed_text_prompt_queue, lm_response_queue,
                          language_model_handler_kwargs,
-                         open_api_language_model_handler_kwargs, mlx_language_model_handler_kwargs)
+                         open_api_language_model_handler_kwargs, mlx_language_model_handler_kwargs,
+                         threads=session_manager_kwargs.session_handler_threads)
+    if hasattr(lm, "filter"):
+        # handlers cancelling their running requests on interruption
+        interruption_manager.add_filtered_queue(lm)
 
     tts = get_tts_handler(module_kwargs, stop_event, lm_response_queue, audio_response_queue_of_iterators,
                           None,
                           parler_tts_handler_kwargs, melo_tts_handler_kwargs, chat_tts_handler_kwargs,
                           mms_tts_handler_kwargs, openai_tts_handler_kwargs, elevenlabs_tts_handler_kwargs,
-                          iterated=True)
+                          iterated=True, threads=session_manager_kwargs.session_handler_threads)
+    if hasattr(tts, "filter"):
+        interruption_manager.add_filtered_queue(tts)
 
-    deiterator = DeiteratorHandler(stop_event, audio_response_queue_of_iterators, send_audio_chunks_queue)
-
-    interruption_manager = InterruptionManagerHandler(
-        stop_event = stop_event,
-        interruption_request_queue = interruption_request_queue,
-        filtered_queues=[instance for instance in queues_and_events.values() if isinstance(instance, FilteredQueue)]
-    )
-
-    return ThreadManager([*comms_handlers, vad, stt, filler, lm, tts, deiterator, interruption_manager])
+    return ThreadManager([session_manager, vad, stt, filler, lm, tts, interruption_manager])
 
 
 def get_stt_handler(module_kwargs, stop_event, spoken_prompt_queue, text_prompt_queue, whisper_stt_handler_kwargs,
@@ -351,7 +385,8 @@ def get_llm_handler(
         lm_response_queue,
         language_model_handler_kwargs,
         open_api_language_model_handler_kwargs,
-        mlx_language_model_handler_kwargs
+        mlx_language_model_handler_kwargs,
+        threads=1,
 ):
     if module_kwargs.llm == "transformers":
         from LLM.language_model import LanguageModelHandler
@@ -367,6 +402,16 @@ def get_llm_handler(
             stop_event,
             queue_in=text_prompt_queue,
             queue_out=lm_response_queue,
+            threads=threads,
+            setup_kwargs=vars(open_api_language_model_handler_kwargs),
+        )
+    elif module_kwargs.llm == "open_api_async":
+        from LLM.async_openai_api_language_model import AsyncOpenApiModelHandler
+        return AsyncOpenApiModelHandler(
+            stop_event,
+            queue_in=text_prompt_queue,
+            queue_out=lm_response_queue,
+            threads=threads,  # puts in lm_response_queue, which may block when it is full
             setup_kwargs=vars(open_api_language_model_handler_kwargs),
         )
 
@@ -380,19 +425,37 @@ def get_llm_handler(
         )
 
     else:
-        raise ValueError("The LLM should be either transformers or mlx-lm")
+        raise ValueError("The LLM should be either transformers, mlx-lm, open_api or open_api_async")
 
 
 def get_tts_handler(module_kwargs, stop_event, lm_response_queue, send_audio_chunks_queue, should_listen,
                     parler_tts_handler_kwargs, melo_tts_handler_kwargs, chat_tts_handler_kwargs, mms_tts_handler_kwargs,
-                    openai_tts_handler_kwargs, elevenlabs_tts_handler_kwargs, iterated=False):
-    if module_kwargs.tts == "parler":
+                    openai_tts_handler_kwargs, elevenlabs_tts_handler_kwargs, iterated=False, threads=1):
+    if iterated and module_kwargs.tts in ("parler", "melo", "chatTTS", "MMSTTS", "openaiTTS"):
+        from TTS.lookahead_tts_handler import LookaheadTTSHandler
+        # only the process of the handler is used, the sentences are scheduled by the look-ahead handler:
+        # it is built without queues nor executor
+        backend = get_tts_handler(module_kwargs, stop_event, None, None, should_listen or Event(),
+                                  parler_tts_handler_kwargs, melo_tts_handler_kwargs, chat_tts_handler_kwargs,
+                                  mms_tts_handler_kwargs, openai_tts_handler_kwargs, elevenlabs_tts_handler_kwargs,
+                                  threads=0)
+        return LookaheadTTSHandler(
+            stop_event,
+            queue_in=lm_response_queue,
+            queue_out=send_audio_chunks_queue,
+            # the API synthesizes the sentences of the sessions concurrently, the local models one at a time
+            threads=threads if module_kwargs.tts == "openaiTTS" else 1,
+            setup_args=(backend,),
+            setup_kwargs={"depth": module_kwargs.tts_lookahead, "max_prefetch_mb": module_kwargs.tts_prefetch_mb},
+        )
+    elif module_kwargs.tts == "parler":
         assert not iterated
         from TTS.parler_handler import ParlerTTSHandler
         return ParlerTTSHandler(
             stop_event,
             queue_in=lm_response_queue,
             queue_out=send_audio_chunks_queue,
+            threads=threads,
             setup_args=(should_listen,),
             setup_kwargs=vars(parler_tts_handler_kwargs),
         )
@@ -409,6 +472,7 @@ def get_tts_handler(module_kwargs, stop_event, lm_response_queue, send_audio_chu
             stop_event,
             queue_in=lm_response_queue,
             queue_out=send_audio_chunks_queue,
+            threads=threads,
             setup_args=(should_listen,),
             setup_kwargs=vars(melo_tts_handler_kwargs),
         )
@@ -423,6 +487,7 @@ def get_tts_handler(module_kwargs, stop_event, lm_response_queue, send_audio_chu
             stop_event,
             queue_in=lm_response_queue,
             queue_out=send_audio_chunks_queue,
+            threads=threads,
             setup_args=(should_listen,),
             setup_kwargs=vars(chat_tts_handler_kwargs),
         )
@@ -437,6 +502,7 @@ def get_tts_handler(module_kwargs, stop_event, lm_response_queue, send_audio_chu
             stop_event,
             queue_in=lm_response_queue,
             queue_out=send_audio_chunks_queue,
+            threads=threads,
             setup_args=(should_listen,),
             setup_kwargs=vars(mms_tts_handler_kwargs),
         )
@@ -451,6 +517,7 @@ def get_tts_handler(module_kwargs, stop_event, lm_response_queue, send_audio_chu
             stop_event,
             queue_in=lm_response_queue,
             queue_out=send_audio_chunks_queue,
+            threads=threads,
             setup_args=(should_listen,),
             setup_kwargs=vars(openai_tts_handler_kwargs),
         )
@@ -482,6 +549,16 @@ def get_tts_handler(module_kwargs, stop_event, lm_response_queue, send_audio_chu
             setup_args=(should_listen,),
             setup_kwargs=vars(elevenlabs_tts_handler_kwargs),
         )
+    elif module_kwargs.tts == "elevenlabsStreamTTS":
+        assert iterated
+        from TTS.elevenlabs_stream_input_handler import ElevenLabsStreamInputTTSHandler
+        return ElevenLabsStreamInputTTSHandler(
+            stop_event,
+            queue_in=lm_response_queue,
+            queue_out=send_audio_chunks_queue,
+            setup_args=(should_listen,),
+            setup_kwargs=vars(elevenlabs_tts_handler_kwargs),
+        )
     else:
         raise ValueError("The TTS should be either parler, melo or chatTTS")
 
@@ -503,6 +580,7 @@ def main():
         module_kwargs,
         socket_receiver_kwargs,
         socket_sender_kwargs,
+        session_manager_kwargs,
         vad_handler_kwargs,
         whisper_stt_handler_kwargs,
         paraformer_stt_handler_kwargs,
@@ -519,6 +597,8 @@ def main():
     ) = parse_arguments()
 
     setup_logger(module_kwargs.log_level)
+    if module_kwargs.trace_file:
+        tracing.configure(module_kwargs.trace_file, module_kwargs.trace_format)
 
     prepare_all_args(
         module_kwargs,
@@ -536,12 +616,16 @@ def main():
         elevenlabs_tts_handler_kwargs
     )
 
-    queues_and_events = initialize_queues_and_events()
+    queues_and_events = initialize_queues_and_events(module_kwargs.queue_limits)
+    if module_kwargs.metrics_port is not None:
+        register_queue_metrics(queues_and_events)
+        metrics.MetricsServer(module_kwargs.metrics_host, module_kwargs.metrics_port).start()
 
     pipeline_manager = build_pipeline(
         module_kwargs,
         socket_receiver_kwargs,
         socket_sender_kwargs,
+        session_manager_kwargs,
         vad_handler_kwargs,
         whisper_stt_handler_kwargs,
         paraformer_stt_handler_kwargs,
@@ -562,6 +646,7 @@ def main():
         pipeline_manager.start()
         input()
     except KeyboardInterrupt:
+        release_queues(queues_and_events)
         pipeline_manager.stop()
 
 
@@ -0,0 +1,266 @@
+import heapq
+import queue
+import time
+from collections import deque
+
+from utils import metrics
+
+POLICIES = ("block", "drop_oldest", "coalesce")
+
+
+def _is_end(item):
+    return isinstance(item, bytes) and item == b"END"
+
+
+def announced_session(item):
+    """
+    Coalescing key of the (session, samples written) announcements of received audio: the audio stays in the ring
+    buffer of the session, so only the latest announcement of a session matters. None for other items.
+    """
+    if isinstance(item, tuple) and len(item) == 2 and isinstance(item[1], int):
+        return item[0]
+    return None
+
+
+class BoundedQueue(queue.Queue):
+    """
+    queue.Queue holding at most maxsize items (unbounded if 0), with a policy for a put into a full queue:
+      - block: waits for room, like queue.Queue (but a put with a timeout raises queue.Full as usual);
+      - drop_oldest: drops the oldest item, right for live audio where the latest matters most;
+      - coalesce: replaces the queued item with the same coalesce_key (not None), in its place, and drops the oldest
+        item if there is none.
+    b"END" is always queued and never dropped, so that the handlers still stop. Every put finding the queue full is
+    counted in the s2s_queue_overflows_total metric, labelled with the name of the queue and the action taken.
+    release() stops the blocking, for the shutdown: the consumers may be gone already.
+    """
+
+    def __init__(self, name="queue", maxsize=0, policy="block", coalesce_key=announced_session):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown queue policy {policy!r}, expected one of {POLICIES}")
+        super().__init__(maxsize)
+        self.name = name
+        self.policy = policy
+        self.coalesce_key = coalesce_key
+        self.released = False
+
+    def _full(self):
+        return 0 < self.maxsize <= self._qsize()
+
+    def put(self, item, block=True, timeout=None):
+        with self.not_full:
+            if self._would_block(item):
+                metrics.queue_overflows.inc(queue=self.name, action="blocked")
+                if not block:
+                    raise queue.Full
+                self._wait_for_room(timeout)
+            self._insert(item)
+
+    def try_put(self, item):
+        """
+        Puts the item unless the put would block, returns whether it was put. With wait_for_room, a producer can wait
+        for room without holding its own locks and put under them without blocking (see FilteredQueue.put).
+        """
+        with self.not_full:
+            if self._would_block(item):
+                return False
+            self._insert(item)
+            return True
+
+    def wait_for_room(self, timeout=None):
+        """Waits until a put would not block, another producer may fill the queue again before the next put."""
+        with self.not_full:
+            if self._would_block():
+                metrics.queue_overflows.inc(queue=self.name, action="blocked")
+                self._wait_for_room(timeout)
+
+    def _would_block(self, item=None):
+        return self.policy == "block" and self._full() and not self.released and not _is_end(item)
+
+    def _insert(self, item):
+        # with self.not_full held, the queue is not full or the policy makes room
+        if self._full() and not _is_end(item):
+            if self.policy == "coalesce" and self._coalesce(item):
+                return
+            self._drop_oldest()
+        self._put(item)
+        self.unfinished_tasks += 1
+        self.not_empty.notify()
+
+    def _wait_for_room(self, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._full() and not self.released:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise queue.Full
+            self.not_full.wait(remaining)
+
+    def _coalesce(self, item):
+        key = self.coalesce_key(item) if self.coalesce_key is not None else None
+        if key is None:
+            return False
+        for i, queued in enumerate(self.queue):
+            if not _is_end(queued) and self.coalesce_key(queued) == key:
+                self.queue[i] = item
+                metrics.queue_overflows.inc(queue=self.name, action="coalesced")
+                return True
+        return False
+
+    def _drop_oldest(self):
+        for i, queued in enumerate(self.queue):
+            if not _is_end(queued):
+                del self.queue[i]
+                self.unfinished_tasks -= 1
+                metrics.queue_overflows.inc(queue=self.name, action="dropped_oldest")
+                return
+
+    def release(self):
+        """From now on a full queue drops (or coalesces) instead of blocking, and the blocked puts go on."""
+        with self.not_full:
+            self.released = True
+            self.not_full.notify_all()
+
+
+class _Generation:
+    """Items of one (session id, index) of an IndexedQueue."""
+
+    __slots__ = ("key", "count", "alive")
+
+    def __init__(self, key):
+        self.key = key
+        self.count = 0  # items queued and not taken
+        self.alive = True
+
+
+_REMOVED = object()  # item of an entry dropped by the overflow policy
+
+
+class IndexedQueue(BoundedQueue):
+    """
+    BoundedQueue whose items are grouped in generations: generation(item) gives (session id, index) of the item,
+    e.g. the index of the utterance it belongs to, or None for items never purged (b"END" is never purged either).
+    purge(session_id, index) drops every generation of the session older than index at once: the generations are
+    marked dead and their entries are skipped when they reach the head of the queue, so an interruption costs
+    O(stale generations of the session), whatever the length of the queue. get() stays blocking and FIFO.
+    """
+
+    def __init__(self, name="queue", maxsize=0, policy="block", generation=None, coalesce_key=announced_session):
+        self.generation = generation
+        super().__init__(name, maxsize, policy, coalesce_key)
+
+    # storage hooks of queue.Queue, called with self.mutex held
+
+    def _init(self, maxsize):
+        self.queue = deque()  # [generation, item] in put order, dead entries included until they are reached
+        self.generations = {}  # (session id, index) -> _Generation with items queued
+        self.indexes = {}  # session id -> heap of the indexes of its generations (stale ones are skipped)
+        self.live = 0
+
+    def _qsize(self):
+        return self.live
+
+    def _put(self, item):
+        key = None if _is_end(item) or self.generation is None else self.generation(item)
+        generation = None
+        if key is not None and key[1] is not None:
+            generation = self.generations.get(key)
+            if generation is None:
+                generation = self.generations[key] = _Generation(key)
+                heapq.heappush(self.indexes.setdefault(key[0], []), key[1])
+            generation.count += 1
+        self.queue.append([generation, item])
+        self.live += 1
+
+    def _get(self):
+        while True:
+            generation, item = self.queue.popleft()
+            if item is _REMOVED or (generation is not None and not generation.alive):
+                continue
+            self._take_from(generation)
+            return item
+
+    def _take_from(self, generation):
+        self.live -= 1
+        if generation is not None:
+            generation.count -= 1
+            if not generation.count:
+                session_id = generation.key[0]
+                self.generations.pop(generation.key, None)
+                heap = self.indexes.get(session_id)
+                while heap and (session_id, heap[0]) not in self.generations:
+                    heapq.heappop(heap)
+                if heap is not None and not heap:
+                    del self.indexes[session_id]
+
+    def _live_entries(self):
+        for entry in self.queue:
+            if entry[1] is not _REMOVED and (entry[0] is None or entry[0].alive):
+                yield entry
+
+    def _coalesce(self, item):
+        key = self.coalesce_key(item) if self.coalesce_key is not None else None
+        if key is None:
+            return False
+        generation = self.generation(item) if self.generation is not None else None
+        for entry in self._live_entries():
+            queued_generation = entry[0].key if entry[0] is not None else None
+            if not _is_end(entry[1]) and queued_generation == generation and self.coalesce_key(entry[1]) == key:
+                entry[1] = item
+                metrics.queue_overflows.inc(queue=self.name, action="coalesced")
+                return True
+        return False
+
+    def _drop_oldest(self):
+        for entry in self._live_entries():
+            if not _is_end(entry[1]):
+                self._take_from(entry[0])
+                entry[1] = _REMOVED
+                self.unfinished_tasks -= 1
+                metrics.queue_overflows.inc(queue=self.name, action="dropped_oldest")
+                return
+
+    def purge(self, session_id, index):
+        """Drops the items of the generations of the session older than index, returns how many were dropped."""
+        with self.mutex:
+            heap = self.indexes.get(session_id)
+            dropped = 0
+            while heap and heap[0] < index:
+                generation = self.generations.pop((session_id, heapq.heappop(heap)), None)
+                if generation is not None:
+                    generation.alive = False
+                    dropped += generation.count
+            if heap is not None and not heap:
+                del self.indexes[session_id]
+            if dropped:
+                self.live -= dropped
+                self.unfinished_tasks -= dropped
+                self._compact()
+                self.not_full.notify_all()
+            return dropped
+
+    def forget(self, session_id):
+        """Drops the generations of a closed session from the index, its items stay queued and are never purged."""
+        with self.mutex:
+            # every generation of the index has its index in the heap of its session
+            for index in self.indexes.pop(session_id, ()):
+                self.generations.pop((session_id, index), None)
+
+    def _compact(self):
+        # the dead entries are released when they are reached, or here once they outnumber the live ones
+        if len(self.queue) > 2 * self.live + 64:
+            self.queue = deque(self._live_entries())
+
+
+def parse_queue_limits(spec):
+    """
+    Parses "name=capacity[:policy],..." (e.g. "recv_audio_chunks_queue=512:coalesce,lm_response_queue=64")
+    into {name: (capacity, policy)}, the policy is block if not given.
+    """
+    limits = {}
+    for entry in filter(None, (entry.strip() for entry in (spec or "").split(","))):
+        name, _, limit = entry.partition("=")
+        capacity, _, policy = limit.partition(":")
+        policy = policy.strip() or "block"
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown queue policy {policy!r} for {name.strip()}, expected one of {POLICIES}")
+        limits[name.strip()] = (int(capacity), policy)
+    return limits
@@ -0,0 +1,65 @@
+import threading
+import weakref
+
+from utils.data import ImmutableDataChain
+
+_lock = threading.Lock()
+_tokens = {}  # session_id -> user_phrase_id -> CancellationToken, dropped with the last item of the utterance
+
+
+class CancellationToken:
+    """
+    Cancellation of the work on one utterance. It is added to the chain as "cancellation" at the end of speech, so
+    every item derived from the utterance shares it. An interruption cancels the tokens of the previous utterances
+    of the session, and the handlers check it between chunks to stop generating and close their upstream streams,
+    while FilteredQueue.filter only drops the queued items.
+    """
+
+    def __init__(self):
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+
+def start(data):
+    """Adds a CancellationToken to the chain of a new utterance ("user_audio" just added)."""
+    token = CancellationToken()
+    session_id = getattr(data.get("session"), "session_id", None)
+    with _lock:
+        _tokens.setdefault(session_id, weakref.WeakValueDictionary())[data.get_index("user_audio")] = token
+    return data.add_data(token, "cancellation")
+
+
+def cancel_before(phrase_id, session_id=None):
+    """Cancels the utterances of the session older than the phrase, the items FilteredQueue.filter drops."""
+    with _lock:
+        tokens = _tokens.get(session_id)
+        tokens = list(tokens.items()) if tokens is not None else []
+    for user_phrase_id, token in tokens:
+        if user_phrase_id < phrase_id:
+            token.cancel()
+
+
+def forget_session(session_id):
+    """Cancels all the utterances of a closed session."""
+    with _lock:
+        tokens = _tokens.pop(session_id, None)
+        tokens = list(tokens.values()) if tokens is not None else []
+    for token in tokens:
+        token.cancel()
+
+
+def is_cancelled(data):
+    """True if the utterance of the item was interrupted or is a cancelled speculation."""
+    if not isinstance(data, ImmutableDataChain):
+        return False
+    token = data.get("cancellation")
+    if token is not None and token.cancelled:
+        return True
+    speculation = data.get("speculation")
+    return speculation is not None and speculation.cancelled
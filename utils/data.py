@@ -1,8 +1,22 @@
 import threading
-import queue
-import threading
+from utils import metrics
+from utils.bounded_queue import IndexedQueue
+
+# Only add_data/peek_data need it, to hand out indexes. Reads are lock-free, since instances never change.
+_counter_lock = threading.Lock()
+_EMPTY = {}
+
 
 class ImmutableDataChain:
+    """
+    Immutable linked list of values, each instance sees the values of the instances it was created from.
+    Instead of walking the chain, every instance keeps the map key -> (value, index, counter, depth) of the keys
+    of the previous instances. The map is built once per instance for all of its children and shared by them
+    (and by the children of instances without key), so lookups are O(1) and adding data copies a few entries at most.
+    """
+
+    __slots__ = ("_key", "_value", "_previous", "index", "_counter", "_save_data", "_depth", "_inherited", "_visible")
+
     def __init__(self, value=None, key=None, save_data=True, previous=None, index=None):
         """
         key - ключ значения. Может быть None, но это означает, что данные будут потеряны после add_data.
@@ -15,37 +29,56 @@ class ImmutableDataChain:
         self._value = value
         self._previous = previous
         self.index = index
-        self._counter = -1
+        self._counter = [-1]  # mutable cell, shared with the entries of the children
         self._save_data = save_data
-        self._lock = threading.Lock()  # Блокировка для синхронизации
+        self._depth = previous._depth + 1 if previous is not None else 0
+        self._inherited = previous._entries_for_children() if previous is not None else _EMPTY
+        self._visible = None
+
+    def _entries_for_children(self):
+        """Entries seen by the instances linked to this one, built on first use."""
+        if self._key is None:
+            return self._inherited
+        visible = self._visible
+        if visible is None:
+            # a concurrent build gives the same result, so no lock is needed
+            visible = {**self._inherited, self._key: (self._value, self.index, self._counter, self._depth)}
+            self._visible = visible
+        return visible
+
+    def _child(self, value, key, save_data, index):
+        if self._key is None or not self._save_data:
+            return ImmutableDataChain(value, key, save_data, self._previous, index)
+        else:
+            return ImmutableDataChain(value, key, save_data, self, index)
 
     def add_data(self, value, key=None, save_data=True):
-        with self._lock:
-            self._counter += 1
-            if self._key is None or not self._save_data:
-                return ImmutableDataChain(value, key, save_data, self._previous, self._counter)
-            else:
-                return ImmutableDataChain(value, key, save_data, self, self._counter)
+        with _counter_lock:
+            self._counter[0] += 1
+            index = self._counter[0]
+        return self._child(value, key, save_data, index)
+
+    def peek_data(self, value, key=None, save_data=True):
+        """
+        Same as add_data, but the new instance gets the index of the next add_data call without taking it.
+        Used for provisional data of an item that does not exist yet (e.g. audio of an utterance still being spoken),
+        so that it is filtered together with that item.
+        """
+        with _counter_lock:
+            index = self._counter[0] + 1
+        return self._child(value, key, save_data, index)
 
     def get_data(self, key=None):
-        with self._lock:
-            # Рекурсивно ищем значение по ключу
-            if key is None or self._key == key:
-                return self._value
-            elif self._previous is not None:
-                return self._previous.get_data(key)
-            else:
-                return None
+        if key is None or self._key == key:
+            return self._value
+        entry = self._inherited.get(key)
+        return entry[0] if entry is not None else None
 
     def to_dict(self):
-        with self._lock:
-            data_dict = {}
-            current = self
-            while current is not None:
-                if current._key is not None and current._key not in data_dict:
-                    data_dict[current._key] = current._value
-                current = current._previous
-            return data_dict
+        data_dict = {key: entry[0] for key, entry in self._inherited.items()}
+        if self._key is not None:
+            data_dict[self._key] = self._value
+        return data_dict
 
     def get(self, key, default=None):
         value = self.get_data(key)
@@ -57,25 +90,38 @@ class ImmutableDataChain:
             raise KeyError(f"Ключ '{key}' не найден")
         return value
 
+    def _first_without_key(self):
+        current = self
+        while current is not None and current._key is not None:
+            current = current._previous
+        return current
+
     def get_index(self, key):
         """Возвращает индекс, соответствующий ключу, или None, если ключ не найден."""
-        with self._lock:
-            if self._key == key:
-                return self.index
-            elif self._previous is not None:
-                return self._previous.get_index(key)
-            else:
-                return None
+        if self._key == key:
+            return self.index
+        if key is None:
+            current = self._first_without_key()
+            return current.index if current is not None else None
+        entry = self._inherited.get(key)
+        return entry[1] if entry is not None else None
 
     def get_counter(self, key=None):
         """Возвращает значение counter, соответствующее ключу, или None, если ключ не найден."""
-        with self._lock:
-            if self._key == key:
-                return self._counter+1
-            elif self._previous is not None:
-                return self._previous.get_counter(key)+1
-            else:
+        if self._key == key:
+            return self._counter[0] + 1
+        if key is None:
+            current = self._first_without_key()
+            if current is None:
+                return None
+            counter, depth = current._counter, current._depth
+        else:
+            entry = self._inherited.get(key)
+            if entry is None:
                 return None
+            _, _, counter, depth = entry
+        # +1 for every instance between this one and the one holding the key
+        return counter[0] + 1 + self._depth - depth
 
 
 example_data = {
@@ -84,55 +130,93 @@ example_data = {
     "language_code":None,
     "start_phrase":None,
     "llm_sentence":None,
+    "llm_fragment":None,
+    "llm_done":None,
     "output_audio_iterator": None,
     "output_audio_chunk":None
 }
 
 
 class FilteredQueue:
-    def __init__(self):
-        self._queue = queue.Queue()
-        self._user_phrase_id = 0
+    """
+    Queue of the items of the pipeline that drops the items made obsolete by an interruption.
+    The items are stored by generation, the (session, 'user_audio' index) they belong to, so filter drops the
+    stale generations of the session without going through the queue.
+    """
+
+    def __init__(self, name="filtered_queue", maxsize=0, policy="block"):
+        self.name = name  # label of the metrics of the queue
+        self._queue = IndexedQueue(name, maxsize, policy, generation=self._generation)
+        self._user_phrase_ids = {}  # session_id -> user_phrase_id, items of other sessions are not affected
         self._put_lock = threading.Lock()
-        self._get_lock = threading.Lock()
+        self.listener = None  # called after every put, e.g. to wake up the I/O loop reading the queue with get_nowait
 
-    def set_user_phrase_id(self, phrase_id: int):
-        """Sets the user_phrase_id that will be used for comparison."""
-        self._user_phrase_id = phrase_id
+    def set_user_phrase_id(self, phrase_id: int, session_id=None):
+        """Sets the user_phrase_id that will be used for comparison with the items of the session."""
+        self._user_phrase_ids[session_id] = phrase_id
+
+    def forget_session(self, session_id):
+        """Drops the interruption scope of a closed session."""
+        self._user_phrase_ids.pop(session_id, None)
+        self._queue.forget(session_id)
 
     def put(self, item: ImmutableDataChain):
         """Puts the item in the queue if it passes the validation check."""
-        with self._put_lock:
-            if self._validate_item(item):
-                self._queue.put(item)
-            else:
-                print(f"Item rejected: 'user_audio' not matching {self._user_phrase_id} or missing.")
-
-    def get(self):
-        """Gets the next item from the queue, blocking until one is available."""
-        return self._queue.get()
+        if isinstance(item, bytes) and item == b"END":
+            self._queue.put(item)
+        else:
+            # a full queue is waited for without the lock, which would hold up the interruptions, and the put under
+            # the lock never blocks: if another producer took the room meanwhile, the room is waited for again
+            while True:
+                self._queue.wait_for_room()
+                with self._put_lock:
+                    if not self._validate_item(item):
+                        metrics.filtered_items_dropped.inc(queue=self.name)
+                        print(f"Item rejected: 'user_audio' not matching {self._user_phrase_ids} or missing.")
+                        return
+                    if self._queue.try_put(item):
+                        break
+        if self.listener is not None:
+            self.listener()
+
+    def get(self, timeout=None):
+        """Gets the next item from the queue, blocking until one is available or raising queue.Empty after timeout."""
+        return self._queue.get(timeout=timeout)
+
+    def get_nowait(self):
+        """Gets the next item from the queue, raising queue.Empty if there is none."""
+        return self._queue.get_nowait()
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def release(self):
+        """Stops blocking the puts when the queue is full, see BoundedQueue.release."""
+        self._queue.release()
 
     def remove_non_matching(self):
-        """Removes all items in the queue that don't match the user_phrase_id."""
-        temp_queue = queue.Queue()
-        while not self._queue.empty():
-            item = self._queue.get()
-            if self._validate_item(item):
-                temp_queue.put(item)
-
-        while not temp_queue.empty():
-            item = temp_queue.get()
-            self._queue.put(item)
+        """Removes all items in the queue that don't match the user_phrase_id of their session."""
+        dropped = sum(
+            self._queue.purge(session_id, phrase_id) for session_id, phrase_id in list(self._user_phrase_ids.items())
+        )
+        if dropped:
+            metrics.filtered_items_dropped.inc(dropped, queue=self.name)
+
+    @staticmethod
+    def _generation(item: ImmutableDataChain):
+        return getattr(item.get("session"), "session_id", None), item.get_index('user_audio')
 
     def _validate_item(self, item: ImmutableDataChain) -> bool:
-        """Checks if the item has 'user_audio' matching the current user_phrase_id."""
-        user_phrase_id = item.get_index('user_audio')
+        """Checks if the item has 'user_audio' matching the current user_phrase_id of its session."""
+        session_id, user_phrase_id = self._generation(item)
         if user_phrase_id is None:
             return False
-        return user_phrase_id >= self._user_phrase_id
-
-    def filter(self, phrase_id: int):
-        """Sets the user_phrase_id and removes non-matching items in one step."""
-        with self._put_lock, self._get_lock:  # Lock both get and put actions while modifying the queue
-            self.set_user_phrase_id(phrase_id)
-            self.remove_non_matching()
+        return user_phrase_id >= self._user_phrase_ids.get(session_id, 0)
+
+    def filter(self, phrase_id: int, session_id=None):
+        """Sets the user_phrase_id of the session and drops its older generations in one step."""
+        with self._put_lock:  # no item of the session can be validated against the previous user_phrase_id meanwhile
+            self.set_user_phrase_id(phrase_id, session_id)
+            dropped = self._queue.purge(session_id, phrase_id)
+        if dropped:
+            metrics.filtered_items_dropped.inc(dropped, queue=self.name)
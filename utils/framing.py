@@ -0,0 +1,63 @@
+import numpy as np
+
+
+class BlockFramer:
+    """
+    Cuts a stream of int16 audio chunks of any length into frames of blocksize samples.
+    The samples left after the last whole frame of a chunk are carried to the next chunk (which may be the next
+    sentence) instead of being padded with silence, and only flush() pads, at the end of the stream.
+    Whole frames are views of the chunk they come from: chunks are never reused by their producers, while the frames
+    wait in the queues of the session. The carried samples, and the frame straddling two chunks they become, are
+    kept in a preallocated ring of `slots` frames instead of new arrays: a slot is reused once `slots` more frames
+    were assembled in the ring, so the consumer must not hold more than slots - 1 of them at once.
+    Chunks must be int16 (float audio has to be scaled by its producer), anything else raises TypeError.
+    """
+
+    def __init__(self, blocksize=512, dtype=np.int16, slots=4):
+        self.blocksize = blocksize
+        self.dtype = np.dtype(dtype)
+        self.ring = np.zeros((slots, blocksize), dtype=self.dtype)
+        self.slot = 0  # slot of the carried samples
+        self.carried = 0
+
+    @property
+    def pending(self):
+        """Samples waiting for the next chunk to make a frame."""
+        return self.carried
+
+    def push(self, chunk):
+        """Yields the whole frames available with the chunk."""
+        chunk = np.asarray(chunk)
+        if chunk.dtype != self.dtype:
+            raise TypeError(f"BlockFramer takes {self.dtype} audio, got {chunk.dtype}")
+        chunk = chunk.reshape(-1)
+        if self.carried:
+            needed = self.blocksize - self.carried
+            taken = min(needed, len(chunk))
+            self.ring[self.slot, self.carried : self.carried + taken] = chunk[:taken]
+            self.carried += taken
+            if self.carried < self.blocksize:
+                return
+            yield self.take_slot()
+            chunk = chunk[needed:]
+        whole = len(chunk) - len(chunk) % self.blocksize
+        for start in range(0, whole, self.blocksize):
+            yield chunk[start : start + self.blocksize]
+        self.carried = len(chunk) - whole
+        self.ring[self.slot, : self.carried] = chunk[whole:]
+
+    def flush(self):
+        """Returns the carried samples padded to a frame, or None if there are none."""
+        if not self.carried:
+            return None
+        self.ring[self.slot, self.carried :] = 0
+        return self.take_slot()
+
+    def take_slot(self):
+        frame = self.ring[self.slot]
+        self.slot = (self.slot + 1) % len(self.ring)
+        self.carried = 0
+        return frame
+
+    def reset(self):
+        self.carried = 0
@@ -0,0 +1,245 @@
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._lock = threading.Lock()
+
+    def samples(self):
+        """(name, labels, value) of the metric, labels being a tuple of (label, value)."""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name, help_text):
+        super().__init__(name, help_text)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, labels, value) for labels, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    """Value set by the code, or computed when the metrics are collected by the functions given to set_function."""
+
+    type_name = "gauge"
+
+    def __init__(self, name, help_text):
+        super().__init__(name, help_text)
+        self._values = {}
+        self._functions = {}
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def set_function(self, function, **labels):
+        with self._lock:
+            self._functions[tuple(sorted(labels.items()))] = function
+
+    def remove(self, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values.pop(key, None)
+            self._functions.pop(key, None)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+            functions = dict(self._functions)
+        for labels, function in functions.items():
+            try:
+                values[labels] = function()
+            except Exception as e:
+                logger.debug(f"Gauge {self.name}{_format_labels(labels)} failed: {e}")
+        return [(self.name, labels, value) for labels, value in values.items()]
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # labels -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {labels: list(counts) for labels, counts in self._values.items()}
+        samples = []
+        for labels, counts in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts[:-1]):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", labels + (("le", bound),), cumulative))
+            samples.append((f"{self.name}_sum", labels, counts[-1]))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    In-process metrics of the pipeline, rendered in the Prometheus text format.
+    Metrics are created on first use by name, so handlers can record them without any setup.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help_text, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, **kwargs)
+            return metric
+
+    def counter(self, name, help_text=""):
+        return self._get(Counter, name, help_text)
+
+    def gauge(self, name, help_text=""):
+        return self._get(Gauge, name, help_text)
+
+    def histogram(self, name, help_text="", buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help_text, buckets=buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class MetricsServer:
+    """Serves the metrics of a registry on http://host:port/metrics from a daemon thread."""
+
+    def __init__(self, host="0.0.0.0", port=9100, registry=REGISTRY):
+        registry_ = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry_.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        logger.info(f"Serving metrics on http://{self.server.server_address[0]}:{self.server.server_address[1]}/metrics")
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# Metrics of the pipeline, labelled with the class name of the handler or the name of the queue
+handler_inputs = REGISTRY.counter("s2s_handler_inputs_total", "Items taken by the handler from its input queue.")
+handler_outputs = REGISTRY.counter("s2s_handler_outputs_total", "Items put by the handler in its output queues.")
+handler_process_seconds = REGISTRY.histogram(
+    "s2s_handler_process_seconds", "Time to process one input (one batch for batching handlers) until its last output."
+)
+handler_first_chunk_seconds = REGISTRY.histogram(
+    "s2s_handler_first_chunk_seconds", "Time from the start of processing to the first output."
+)
+handler_threads = REGISTRY.gauge("s2s_handler_threads", "Worker threads of the handler executors.")
+handler_busy_threads = REGISTRY.gauge("s2s_handler_busy_threads", "Worker threads of the handler executors processing an input.")
+handler_executor_utilisation = REGISTRY.gauge(
+    "s2s_handler_executor_utilisation", "Busy worker threads over worker threads of the handler executors."
+)
+queue_depth = REGISTRY.gauge("s2s_queue_depth", "Items waiting in the queue.")
+filtered_items_dropped = REGISTRY.counter(
+    "s2s_filtered_items_dropped_total", "Items dropped by a FilteredQueue because an interruption made them obsolete."
+)
+queue_overflows = REGISTRY.counter(
+    "s2s_queue_overflows_total",
+    "Puts that found a bounded queue full, by action of its policy: blocked, dropped_oldest or coalesced.",
+)
+interruptions = REGISTRY.counter("s2s_interruptions_total", "Interruption requests applied to the pipeline queues.")
+requests_in_flight = REGISTRY.gauge("s2s_requests_in_flight", "Requests of the asyncio handlers started and not finished yet.")
+requests_cancelled = REGISTRY.counter(
+    "s2s_requests_cancelled_total", "Requests of the asyncio handlers aborted because an interruption made them obsolete."
+)
+
+tts_prefetch_bytes = REGISTRY.gauge(
+    "s2s_tts_prefetch_bytes", "Audio synthesized ahead by the look-ahead TTS handler and not played yet, in bytes."
+)
+
+sender_underruns = REGISTRY.counter(
+    "s2s_sender_underruns_total", "Chunks of an utterance sent after the client had played all the audio before them."
+)
+sender_underrun_seconds = REGISTRY.histogram(
+    "s2s_sender_underrun_seconds", "Silence heard by the client during an utterance, per underrun."
+)
+
+
+def add_busy_thread(handler, amount=1):
+    handler_busy_threads.inc(amount, handler=handler)
+    threads = handler_threads.get(handler=handler)
+    if threads:
+        handler_executor_utilisation.set(handler_busy_threads.get(handler=handler) / threads, handler=handler)
@@ -0,0 +1,83 @@
+import logging
+import time
+
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class PlayoutScheduler:
+    """
+    Media clock of the audio sent to one client, which plays it at sample_rate as soon as it arrives.
+    The media time of a stream is counted in samples (bytes sent over bytes_per_sample, whatever the type of the
+    chunks), and a chunk is sent once the client has less than `lead` seconds of audio left to play.
+    A stream is the audio of one utterance: the audio of the next one starts a new clock. If a chunk of the same
+    utterance comes after the client has played everything (an underrun), the clock is moved by the duration of
+    the stall, which is counted, and the lead is grown by `grow` up to max_lead to absorb the jitter. After
+    `steady_s` seconds of audio without underrun, the lead is shrunk by `shrink_s` down to min_lead.
+    """
+
+    def __init__(
+        self,
+        sample_rate=16000,
+        bytes_per_sample=2,
+        lead=0.1,
+        min_lead=0.05,
+        max_lead=0.5,
+        grow=1.5,
+        steady_s=5.0,
+        shrink_s=0.01,
+        clock=time.monotonic,
+    ):
+        self.sample_rate = sample_rate
+        self.bytes_per_sample = bytes_per_sample
+        self.lead = lead
+        self.min_lead = min(min_lead, lead)
+        self.max_lead = max(max_lead, lead)
+        self.grow = grow
+        self.steady_s = steady_s
+        self.shrink_s = shrink_s
+        self.clock = clock
+
+        self.stream = None  # utterance of the current stream
+        self.start = None  # clock time at which the client plays the first sample of the stream
+        self.samples = 0  # samples of the stream sent
+        self.steady_samples = 0  # samples sent since the last underrun or change of the lead
+        self.underruns = 0
+        self.underrun_seconds = 0.0
+
+    @property
+    def media_time(self):
+        return self.samples / self.sample_rate
+
+    def delay(self, stream):
+        """Seconds to wait before sending the next chunk of the stream, starting a new stream if needed."""
+        now = self.clock()
+        if stream != self.stream or self.start is None:
+            self.stream = stream
+            self.start = now
+            self.samples = 0
+            return 0.0
+        stall = (now - self.start) - self.media_time
+        if stall > 0:
+            self.underrun(stall)
+            self.start += stall
+            return 0.0
+        return max(0.0, self.media_time - self.lead - (now - self.start))
+
+    def sent(self, chunk):
+        samples = memoryview(chunk).nbytes // self.bytes_per_sample
+        self.samples += samples
+        self.steady_samples += samples
+        if self.steady_samples >= self.steady_s * self.sample_rate and self.lead > self.min_lead:
+            self.lead = max(self.min_lead, self.lead - self.shrink_s)
+            self.steady_samples = 0
+
+    def underrun(self, stall):
+        self.underruns += 1
+        self.underrun_seconds += stall
+        self.steady_samples = 0
+        self.lead = min(self.max_lead, self.lead * self.grow)
+        metrics.sender_underruns.inc()
+        metrics.sender_underrun_seconds.observe(stall)
+        logger.debug(f"Underrun of {stall * 1000:.0f} ms, lead {self.lead * 1000:.0f} ms")
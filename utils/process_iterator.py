@@ -4,29 +4,47 @@ from queue import Queue, Empty
 class ProcessIterator:
     """
     Итератор, который хранит и выдает чанки данных.
+    listener, если задан, вызывается после каждого put и close (например, чтобы разбудить цикл ввода-вывода,
+    который читает итератор через next_nowait).
     """
 
     def __init__(self):
         self.chunk_queue = Queue()
         self._sentinel = object()
+        self.listener = None
 
     def put(self, chunk):
         """
         Добавляет чанк в итератор.
         """
         self.chunk_queue.put(chunk)
+        self._notify()
 
     def close(self):
         """
         Помечает итератор как закрытый (больше данных не будет).
         """
         self.chunk_queue.put(self._sentinel)
+        self._notify()
+
+    def _notify(self):
+        listener = self.listener
+        if listener is not None:
+            listener()
 
     def __iter__(self):
         return self
 
     def __next__(self):
-        chunk = self.chunk_queue.get()
+        return self._take(self.chunk_queue.get())
+
+    def next_nowait(self):
+        """
+        Как next(), но выбрасывает queue.Empty, если следующего чанка ещё нет.
+        """
+        return self._take(self.chunk_queue.get_nowait())
+
+    def _take(self, chunk):
         if chunk is self._sentinel:
             raise StopIteration
-        return chunk
\ No newline at end of file
+        return chunk
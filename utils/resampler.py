@@ -0,0 +1,132 @@
+from functools import lru_cache
+from math import ceil, gcd
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+@lru_cache(maxsize=None)
+def polyphase_filter(up, down, zero_crossings=16, rolloff=0.945, beta=8.6):
+    """
+    Kaiser windowed sinc low-pass filter at the upsampled rate, cut at rolloff times the lower of the two Nyquist
+    frequencies, split into its `up` phases. Row p holds the taps h[p + t * up] in reverse order, so that it is
+    applied to input samples in increasing order. Returns (phases, center of the filter).
+    """
+    cutoff = rolloff / (2 * max(up, down))  # cycles per upsampled sample
+    half = ceil(zero_crossings / (2 * cutoff))
+    n = np.arange(-half, half + 1)
+    taps = 2 * cutoff * up * np.sinc(2 * cutoff * n) * np.kaiser(len(n), beta)
+    taps_per_phase = ceil(len(taps) / up)
+    taps = np.pad(taps, (0, taps_per_phase * up - len(taps)))
+    phases = taps.reshape(taps_per_phase, up).T[:, ::-1]
+    return np.ascontiguousarray(phases, dtype=np.float32), half
+
+
+@lru_cache(maxsize=None)
+def block_filter(up, down, zero_crossings=16):
+    """
+    The phases of polyphase_filter as one matrix for `up` consecutive outputs (a block), the block k // up of the
+    output uses the same phases and starts `down` input samples after the previous one.
+    Returns (matrix of shape (width, up), offset of the first input of the block from (k // up) * down).
+    """
+    phases, center = polyphase_filter(up, down, zero_crossings)
+    taps = phases.shape[1]
+    positions = np.arange(up) * down + center
+    offsets = positions // up - (taps - 1)  # first input of the taps of every output of the block
+    width = offsets[-1] - offsets[0] + taps
+    matrix = np.zeros((width, up), dtype=np.float32)
+    for j, (offset, phase) in enumerate(zip(offsets - offsets[0], positions % up)):
+        matrix[offset : offset + taps, j] = phases[phase]
+    return matrix, int(offsets[0])
+
+
+class StreamingResampler:
+    """
+    Polyphase resampler of one audio stream, fed chunk by chunk (e.g. the chunks of a TTS streamer).
+    The last input samples are kept between chunks, so the output is the same as resampling the whole stream at
+    once, without discontinuities at the edges of the chunks. Output sample k is the filter centered on input
+    time k / target_sr: it is produced once the input covers its taps (half the filter, about 1 ms of audio for
+    16 zero crossings), and flush() produces the last ones, for ceil(n * target_sr / orig_sr) samples in all.
+    The filters are computed once per pair of rates, a resampler per sentence is cheap.
+    """
+
+    def __init__(self, orig_sr, target_sr, zero_crossings=16):
+        divisor = gcd(int(orig_sr), int(target_sr))
+        self.up = int(target_sr) // divisor
+        self.down = int(orig_sr) // divisor
+        self.zero_crossings = zero_crossings
+        self.phases, self.center = polyphase_filter(self.up, self.down, zero_crossings)
+        self.taps = self.phases.shape[1]
+        self.reset()
+
+    def reset(self):
+        self.history = np.zeros(self.taps - 1, dtype=np.float32)
+        self.history_start = -(self.taps - 1)  # stream index of history[0], the stream is 0 before its start
+        self.next_output = 0
+        self.samples_in = 0
+
+    def process(self, chunk):
+        """Resamples the next chunk of the stream (float samples), returns the float32 samples now available."""
+        chunk = np.asarray(chunk, dtype=np.float32).reshape(-1)
+        self.samples_in += len(chunk)
+        return self._resample(chunk)
+
+    def flush(self):
+        """Returns the last samples of the stream, and resets the resampler for a new stream."""
+        total = ceil(self.samples_in * self.up / self.down)
+        padding = np.zeros(self.taps + self.center // self.up + 1, dtype=np.float32)
+        output = self._resample(padding, limit=total)
+        self.reset()
+        return output
+
+    def _resample(self, chunk, limit=None):
+        if self.up == self.down:
+            return chunk.copy()
+        buffer = np.concatenate((self.history, chunk))
+        buffer_end = self.history_start + len(buffer)
+        # output k needs the input samples up to (k * down + center) // up
+        end = (buffer_end * self.up - 1 - self.center) // self.down + 1
+        if limit is not None:
+            end = min(end, limit)
+        start, end = self.next_output, max(end, self.next_output)
+        if start == end:
+            # not enough input for the next output (empty or tiny chunks): it is only kept for the next chunk
+            self.history = buffer
+            return np.zeros(0, dtype=np.float32)
+        # whole blocks of `up` outputs in one matrix product, the outputs before and after them one by one
+        first_block, last_block = -(-start // self.up), end // self.up
+        if first_block < last_block:
+            output = [
+                self._outputs(buffer, start, first_block * self.up),
+                self._blocks(buffer, first_block, last_block),
+                self._outputs(buffer, last_block * self.up, end),
+            ]
+        else:
+            output = [self._outputs(buffer, start, end)]
+
+        self.next_output = max(end, self.next_output)
+        keep_from = (self.next_output * self.down + self.center) // self.up - (self.taps - 1)
+        keep_from = min(max(keep_from, self.history_start), buffer_end)
+        self.history = buffer[keep_from - self.history_start :].copy()
+        self.history_start = keep_from
+        return np.concatenate(output)
+
+    def _outputs(self, buffer, start, end):
+        if start >= end:
+            return np.zeros(0, dtype=np.float32)
+        positions = np.arange(start, end, dtype=np.int64) * self.down + self.center
+        last_inputs = positions // self.up
+        windows = sliding_window_view(buffer, self.taps)[last_inputs - (self.taps - 1) - self.history_start]
+        return np.einsum("ij,ij->i", windows, self.phases[positions % self.up])
+
+    def _blocks(self, buffer, first_block, last_block):
+        matrix, offset = block_filter(self.up, self.down, self.zero_crossings)
+        first_input = first_block * self.down + offset - self.history_start
+        inputs = sliding_window_view(buffer, len(matrix))[first_input :: self.down][: last_block - first_block]
+        return (inputs @ matrix).reshape(-1)
+
+
+def resample(audio, orig_sr, target_sr):
+    """Resamples a whole signal with StreamingResampler."""
+    resampler = StreamingResampler(orig_sr, target_sr)
+    return np.concatenate((resampler.process(audio), resampler.flush()))
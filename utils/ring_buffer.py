@@ -0,0 +1,69 @@
+import numpy as np
+
+
+class AudioRingBuffer:
+    """
+    Preallocated ring of int16 samples, written by the socket with recv_into and read as views.
+    Every byte is stored twice (at i and i + capacity), so any span of up to `capacity` samples is one contiguous
+    view, even when it wraps around. Positions are absolute sample counts since the start of the stream.
+    One writer and one reader may use the buffer from different threads: the reader only reads samples below
+    `samples_written`, and the writer overwrites samples older than `capacity`.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._samples = np.zeros(2 * capacity, dtype=np.int16)
+        self._bytes = self._samples.view(np.uint8)
+        self._capacity_bytes = 2 * capacity
+        self.bytes_written = 0
+
+    @property
+    def samples_written(self):
+        return self.bytes_written // 2
+
+    @property
+    def oldest_sample(self):
+        """Oldest sample that can still be read, a partially received sample already overwrites the one before it."""
+        return max(0, (self.bytes_written + 1) // 2 - self.capacity)
+
+    def _mirror(self, position, n_bytes):
+        capacity_bytes = self._capacity_bytes
+        self._bytes[capacity_bytes + position : capacity_bytes + position + n_bytes] = self._bytes[position : position + n_bytes]
+        self.bytes_written += n_bytes
+
+    def recv_into(self, conn, max_bytes):
+        """
+        Receives at most max_bytes from the socket directly into the buffer.
+        Returns the number of bytes received, 0 when the connection is closed.
+        """
+        position = self.bytes_written % self._capacity_bytes
+        n_bytes = min(max_bytes, self._capacity_bytes - position)
+        received = conn.recv_into(memoryview(self._bytes[position : position + n_bytes]), n_bytes)
+        if received:
+            self._mirror(position, received)
+        return received
+
+    def write(self, data):
+        """Copies bytes (e.g. a chunk of a local stream) into the buffer."""
+        data = np.frombuffer(data, dtype=np.uint8)
+        while len(data):
+            position = self.bytes_written % self._capacity_bytes
+            n_bytes = min(len(data), self._capacity_bytes - position)
+            self._bytes[position : position + n_bytes] = data[:n_bytes]
+            self._mirror(position, n_bytes)
+            data = data[n_bytes:]
+
+    def view(self, start, length):
+        """int16 view of `length` samples from the absolute position `start`, valid until they are overwritten."""
+        if length > self.capacity:
+            raise ValueError(f"Cannot view {length} samples of a ring of {self.capacity} samples")
+        if start < self.oldest_sample or start + length > self.samples_written:
+            raise IndexError(
+                f"Samples [{start}, {start + length}) are not in the buffer [{self.oldest_sample}, {self.samples_written})"
+            )
+        position = start % self.capacity
+        return self._samples[position : position + length]
+
+    def read_float(self, start, end, out=None):
+        """float32 samples in [-1, 1) from start to end, into `out` if given, otherwise into a new array."""
+        return np.multiply(self.view(start, end - start), 1 / 32768, out=out, dtype=np.float32)
@@ -0,0 +1,60 @@
+import threading
+from utils.data import ImmutableDataChain
+
+
+class Session:
+    """
+    State of one connected client.
+    Heavy models (STT, LLM, TTS) are shared by all sessions, while everything that belongs to a single caller
+    (VAD state, chat history, interruption scope) lives here and is dropped together with the session.
+    Every ImmutableDataChain created for the client starts at `start_data`, so the session can be recovered
+    from any item of the pipeline with `data.get("session")`.
+    """
+
+    def __init__(self, session_id=None, address=None):
+        self.session_id = session_id
+        self.address = address
+        self.start_data = ImmutableDataChain(self, "session")
+        self.closed = threading.Event()
+        self._state = {}
+        self._state_lock = threading.Lock()
+
+    def get_state(self, name, factory):
+        """
+        Returns the per-session object stored under `name`, creating it with `factory()` on first use.
+        """
+        with self._state_lock:
+            if name not in self._state:
+                self._state[name] = factory()
+            return self._state[name]
+
+    def set_state(self, name, value):
+        with self._state_lock:
+            self._state[name] = value
+
+    def close(self):
+        """Closes the session, state objects having a close() method are closed with it."""
+        self.closed.set()
+        with self._state_lock:
+            states = list(self._state.values())
+            self._state.clear()
+        for state in states:
+            if hasattr(state, "close"):
+                state.close()
+
+    def __repr__(self):
+        return f"Session({self.session_id}, {self.address})"
+
+
+def get_session(item):
+    """Returns the session a pipeline item belongs to, or None for items outside of any session."""
+    if isinstance(item, ImmutableDataChain):
+        return item.get("session")
+    if isinstance(item, tuple) and item and isinstance(item[0], Session):
+        return item[0]
+    return None
+
+
+def get_session_id(item):
+    session = get_session(item)
+    return session.session_id if session is not None else None
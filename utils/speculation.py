@@ -0,0 +1,51 @@
+import threading
+
+
+class Speculation:
+    """
+    Outcome of an utterance sent downstream before the end of speech is confirmed.
+    The VAD commits it when the silence lasts min_silence_ms, or cancels it when the user goes on speaking.
+    Handlers can start working on a speculative utterance right away, but must not make its results visible
+    (play audio, extend the chat history) before it is committed.
+    """
+
+    def __init__(self):
+        self._decided = threading.Event()
+        self._committed = False
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    def commit(self):
+        self._committed = True
+        self._decide()
+
+    def cancel(self):
+        self._committed = False
+        self._decide()
+
+    def _decide(self):
+        with self._lock:
+            self._decided.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def add_done_callback(self, callback):
+        """Calls callback() once the speculation is decided, right away if it already is."""
+        with self._lock:
+            if not self._decided.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def wait(self, timeout=None):
+        """Blocks until the speculation is decided or timeout elapsed. Returns True if it was decided."""
+        return self._decided.wait(timeout)
+
+    @property
+    def committed(self):
+        return self._decided.is_set() and self._committed
+
+    @property
+    def cancelled(self):
+        return self._decided.is_set() and not self._committed
@@ -0,0 +1,17 @@
+from transformers import StoppingCriteria, StoppingCriteriaList
+
+from utils import cancellation
+
+
+class CancellationCriteria(StoppingCriteria):
+    """Stops transformers' generate (run in its own thread by the handlers) once the utterance is cancelled."""
+
+    def __init__(self, data):
+        self.data = data
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return cancellation.is_cancelled(self.data)
+
+
+def cancellation_criteria(data):
+    return StoppingCriteriaList([CancellationCriteria(data)])
@@ -0,0 +1,145 @@
+import json
+import logging
+import threading
+import time
+import weakref
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+# Stages of an utterance, in the order they usually happen
+EVENTS = (
+    "vad_end",
+    "stt_done",
+    "filler_emitted",
+    "llm_first_token",
+    "llm_first_sentence",
+    "tts_first_byte",
+    "first_byte_sent",  # first audio played to the user, the filler if there is one
+    "first_reply_byte_sent",  # first audio of the reply itself
+)
+
+# perf_counter is monotonic but has no epoch, exported timestamps are moved to wall clock time
+_WALL_CLOCK_OFFSET = time.time() - perf_counter()
+
+_exporter = None
+
+
+class Timeline:
+    """
+    Timestamps of the stages of one utterance. It is added to the chain as "timeline" at the end of speech, so every
+    item derived from the utterance (transcription, sentences, audio chunks) shares it, and each stage marks the
+    first time it is reached.
+    """
+
+    def __init__(self, session_id=None, utterance=None):
+        self.session_id = session_id
+        self.utterance = utterance
+        self.events = {}
+
+    def mark(self, event):
+        """Records the time of the event if it is the first one of its kind. Returns True if it was recorded."""
+        # setdefault is atomic, so concurrent marks of the same event keep the first one
+        now = perf_counter()
+        return self.events.setdefault(event, now) == now
+
+    def elapsed(self, event, since="vad_end"):
+        if event not in self.events or since not in self.events:
+            return None
+        return self.events[event] - self.events[since]
+
+
+class TraceExporter:
+    """
+    Writes the timelines to `path` as JSON lines (one utterance per line, times in ms since vad_end) or in the
+    Chrome trace event format (chrome://tracing, ui.perfetto.dev), where every session is a process, every
+    utterance a thread and every stage a span ending at its event.
+    """
+
+    def __init__(self, path, trace_format="jsonl"):
+        if trace_format not in ("jsonl", "chrome"):
+            raise ValueError(f"Unknown trace format {trace_format}, expected 'jsonl' or 'chrome'")
+        self.trace_format = trace_format
+        self._file = open(path, "w", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._first = True
+        if trace_format == "chrome":
+            self._file.write("[\n")
+
+    def write(self, session_id, utterance, events):
+        if not events:
+            return
+        with self._lock:
+            if self._file.closed:
+                return
+            if self.trace_format == "jsonl":
+                self._file.write(json.dumps(self.to_record(session_id, utterance, events)) + "\n")
+            else:
+                for trace_event in self.to_chrome_events(session_id, utterance, events):
+                    self._file.write(("" if self._first else ",\n") + json.dumps(trace_event))
+                    self._first = False
+            self._file.flush()
+
+    @staticmethod
+    def to_record(session_id, utterance, events):
+        start = events.get("vad_end", min(events.values()))
+        return {
+            "session": session_id,
+            "utterance": utterance,
+            "start": start + _WALL_CLOCK_OFFSET,
+            "events": {name: round((t - start) * 1000, 3) for name, t in sorted(events.items(), key=lambda e: e[1])},
+        }
+
+    @staticmethod
+    def to_chrome_events(session_id, utterance, events):
+        trace_events = []
+        previous = None
+        for name, t in sorted(events.items(), key=lambda e: e[1]):
+            ts = (t + _WALL_CLOCK_OFFSET) * 1e6
+            if previous is not None:
+                trace_events.append(
+                    {"name": name, "ph": "X", "ts": previous, "dur": ts - previous, "pid": session_id or 0, "tid": utterance or 0}
+                )
+            trace_events.append({"name": name, "ph": "i", "s": "t", "ts": ts, "pid": session_id or 0, "tid": utterance or 0})
+            previous = ts
+        return trace_events
+
+    def close(self):
+        with self._lock:
+            if self.trace_format == "chrome":
+                self._file.write("\n]\n")
+            self._file.close()
+
+
+def configure(path, trace_format="jsonl"):
+    """Exports the timelines of all the utterances to `path`, nothing is exported until it is called."""
+    global _exporter
+    if _exporter is not None:
+        _exporter.close()
+    _exporter = TraceExporter(path, trace_format) if path else None
+
+
+def start_timeline(data):
+    """
+    Adds a Timeline to the chain of a new utterance ("user_audio" just added) and marks its end of speech.
+    The timeline is exported once it is not referenced anymore, i.e. when every item of the utterance went
+    through the pipeline or was dropped by an interruption.
+    """
+    session = data.get("session")
+    timeline = Timeline(getattr(session, "session_id", None), data.get_index("user_audio"))
+    timeline.mark("vad_end")
+    if _exporter is not None:
+        # the finalizer must not reference the timeline itself
+        weakref.finalize(timeline, _exporter.write, timeline.session_id, timeline.utterance, timeline.events)
+    return data.add_data(timeline, "timeline")
+
+
+def mark(data, event):
+    """Marks the event on the timeline of the chain, if it has one. Returns True if it was the first such event."""
+    timeline = data.get("timeline")
+    if timeline is None:
+        return False
+    recorded = timeline.mark(event)
+    if recorded and event == "first_byte_sent":
+        logger.info(f"Time to first audio: {timeline.elapsed(event):.3f}")
+    return recorded
@@ -5,6 +5,38 @@ def next_power_of_2(x):
     return 1 if x == 0 else 2 ** (x - 1).bit_length()
 
 
+def sentence_and_language(data):
+    """
+    Sentence and language code of the input of a TTS handler: a chain with "llm_sentence" (e.g. from
+    LookaheadTTSHandler, which keeps its cancellation token), a (sentence, language_code) tuple or the sentence.
+    """
+    if isinstance(data, tuple):
+        return data
+    if hasattr(data, "get_data"):
+        return data.get("llm_sentence"), data.get("language_code")
+    return data, None
+
+
+def text_and_language(data):
+    """
+    Prompt and language code of the input of a language model handler: a chain with "text" (from the STT handlers),
+    a (text, language_code) tuple or the text.
+    """
+    if isinstance(data, tuple):
+        return data
+    if hasattr(data, "get_data"):
+        return data.get("text"), data.get("language_code")
+    return data, None
+
+
+def to_int16(audio, scale=32768):
+    """
+    int16 PCM of audio scaled by `scale` (32768 for float audio in [-1, 1], 1 for audio already in int16 units),
+    clipped: resampled peaks may overshoot full scale, and would wrap around into clicks.
+    """
+    return np.clip(np.asarray(audio) * scale, -32768, 32767).astype(np.int16)
+
+
 def int2float(sound):
     """
     Taken from https://github.com/snakers4/silero-vad